@@ -13,56 +13,22 @@
 
 import os
 import numpy
-from itertools import groupby, izip, chain
+from itertools import chain
 from math import sqrt
 
 from openalea.mtg.mtg import MTG
 from openalea.plantgl.all import Scene as pglScene, Viewer
 
-from alinea.caribu.file_adaptor import read_can, read_light, read_pattern, \
+from alinea.caribu.file_adaptor import read_can, read_canb, is_canb, read_light, read_pattern, \
     read_opt, build_materials
-from alinea.caribu.plantgl_adaptor import scene_to_cscene, mtg_to_cscene
-from alinea.caribu.caribu import raycasting, radiosity, mixed_radiosity, \
-    x_raycasting, x_radiosity, x_mixed_radiosity, opt_string_and_labels, \
-    triangles_string, pattern_string
+from alinea.caribu.plantgl_adaptor import scene_to_meshes, mtg_to_meshes
+from alinea.caribu.caribu import opt_string_and_labels, triangles_string, \
+    pattern_string, exposure_matrix, apply_sky, MaterialIndex
+from alinea.caribu.backends import problem, select_backend
 from alinea.caribu.display import jet_colors, generate_scene, nan_to_zero
 from alinea.caribu.caribu_shell import vperiodise
-
-
-def _agregate(values, indices, fun=sum):
-    """ performs aggregation of outputs along indices """
-    ag = {}
-    for key, group in groupby(sorted(izip(indices, values), key=lambda x: x[0]),
-                              lambda x: x[0]):
-        vals = [elt[1] for elt in group]
-        try:
-            ag[key] = fun(vals)
-        except TypeError:
-            ag[key] = vals[0]
-    return ag
-
-
-def _convert(output, conv_unit):
-    """ convert caribu output to meter/meter_square
-    """
-    # To DO ? filtering eabs_max / zero + occultations ?
-    if conv_unit == 1:
-        return output
-    else:
-        meter_square = conv_unit ** 2
-        output['area'] = [area * meter_square for area in output['area']]
-        for k in ['Eabs', 'Ei', 'Ei_sup', 'Ei_inf']:
-            output[k] = [nrj / meter_square for nrj in output[k]]
-        return output
-
-
-def _wsum(nrj_area):
-    nrj, area = zip(*nrj_area)
-    area_tot = sum(area)
-    if area_tot == 0:
-        return 0
-    else:
-        return sum([e * a if a > 0 else 0 for e, a in nrj_area]) / area_tot
+from alinea.caribu.scene_store import TriangleStore, IndexedMesh, is_mesh
+from alinea.caribu.aggregation import GroupedResults
 
 
 def domain_mesh(domain, z=0., subdiv=1):
@@ -108,7 +74,7 @@ class CaribuScene(object):
         Args:
             scene (dict): a {primitive_id: [triangles,]} dict.A triangle is a
                     list of 3-tuples points coordinates
-                    Alternatively, scene can be a *.can file or a mtg with
+                    Alternatively, scene can be a *.can or *.canb file or a mtg with
                     'geometry' property or a plantGL scene.
                     For the later case, shape.id are used as primitive_id.
             light (list): a list of (Energy, (vx, vy, vz)) tuples defining light
@@ -160,23 +126,27 @@ class CaribuScene(object):
             raise ValueError('unrecognised scene unit: ' + scene_unit)
         self.conv_unit = self.units[scene_unit]
 
-        self.scene = None
+        self.geometry = None
         if scene is not None:
             if isinstance(scene, dict):
                 elt = scene[scene.keys()[0]]
-                try:
-                    assert isinstance(elt, list)
-                    assert isinstance(elt[0], list)
-                    assert isinstance(elt[0][0], tuple)
-                except:
-                    raise ValueError('Unrecognised scene format')
+                if not is_mesh(elt):
+                    try:
+                        assert isinstance(elt, list)
+                        assert isinstance(elt[0], list)
+                        assert isinstance(elt[0][0], tuple)
+                    except:
+                        raise ValueError('Unrecognised scene format')
                 self.scene = scene
             elif isinstance(scene, str):
-                self.scene = read_can(scene)
+                if is_canb(scene):
+                    self.scene = read_canb(scene)
+                else:
+                    self.scene = read_can(scene)
             elif isinstance(scene, MTG):
-                self.scene = mtg_to_cscene(scene)
+                self.scene = mtg_to_meshes(scene)
             elif isinstance(scene, pglScene):
-                self.scene = scene_to_cscene(scene)
+                self.scene = scene_to_meshes(scene)
             else:
                 raise ValueError('Unrecognised scene format')
 
@@ -265,6 +235,8 @@ class CaribuScene(object):
             else:
                 raise ValueError('Unrecognised opt format')
 
+        self.exposure = None
+        self.results = None
         self.soil = None
         if soil_mesh is not None:
             if soil_mesh != -1:
@@ -272,31 +244,41 @@ class CaribuScene(object):
                     raise ValueError(
                         'Adding a soil needs the scene domain to be defined')
                 if z_soil is None:
-                    if self.scene is None:
+                    if self.geometry is None:
                         z_soil = 0
                     else:
-                        triangles = reduce(lambda x, y: x + y,
-                                           self.scene.values())
-                        z = (pt[2] for tri in triangles for pt in tri)
-                        z_soil = min(z)
+                        z_soil = self.geometry.bbox()[0][2]
                 self.soil = domain_mesh(self.pattern, z_soil, soil_mesh)
 
+    @property
+    def scene(self):
+        """ The {primitive_id: [triangles,]} dict of the scene, as a read-only
+        view of the triangle store (geometry), or None
+
+        The scene can be set with primitives given as lists of triangles, or as
+        indexed meshes: (points, indices) tuples of a (n, 3) array of points and
+        a (m, 3) array of the indices of the points of the triangles (or
+        scene_store.IndexedMesh instances)."""
+        if self.geometry is None:
+            return None
+        return self.geometry.view()
+
+    @scene.setter
+    def scene(self, cscene):
+        if cscene is None:
+            self.geometry = None
+        else:
+            self.geometry = TriangleStore.from_dict(cscene)
+
     def triangle_areas(self, convert=True):
         """ compute mean area of elementary triangles in the scene
 
         If convert is true, area is xpressed in meter (scene unit otherwise)"""
 
-        def _surf(triangle):
-            a, b, c = map(numpy.array, triangle)
-            x, y, z = numpy.cross(b - a, c - a).tolist()
-            if convert:
-                return self.conv_unit**2 * numpy.sqrt(x ** 2 + y ** 2 + z ** 2) / 2.0
-            else:
-                return numpy.sqrt(x ** 2 + y ** 2 + z ** 2) / 2.0
-
-        return numpy.array(
-            map(_surf, reduce(lambda x, y: x + y, self.scene.values())))
-
+        areas = self.geometry.areas()
+        if convert:
+            areas *= self.conv_unit ** 2
+        return areas
 
     def bbox(self):
         """ Scene bounding box opposite corner points
@@ -305,10 +287,75 @@ class CaribuScene(object):
             two tuples: (xmin, ymin, zmin), (xmax, ymax, zmax)
         """
 
-        x, y, z = map(numpy.array, zip(*map(lambda x: zip(*x),
-                                            reduce(lambda x, y: x + y,
-                                                   self.scene.values()))))
-        return (x.min(), y.min(), z.min()), (x.max(), y.max(), z.max())
+        return self.geometry.bbox()
+
+    @property
+    def dirty(self):
+        """ The set of the primitives updated, added or removed since the last
+        call to clean"""
+        if self.geometry is None:
+            return set()
+        return self.geometry.dirty
+
+    def clean(self):
+        """ Empty the dirty set, returning it"""
+        if self.geometry is None:
+            return set()
+        return self.geometry.clean()
+
+    def update_primitives(self, primitives):
+        """ Replace the triangles of some primitives of the scene
+
+        Args:
+            primitives: a {primitive_id: [triangles,]} dict, with triangles
+            given as in scene
+        """
+        if self.geometry is None:
+            raise ValueError('update_primitives needs a scene to be defined')
+        self.geometry.update(primitives)
+        self.exposure = None
+
+    def add_primitives(self, primitives, opt=None):
+        """ Add primitives to the scene
+
+        Args:
+            primitives: a {primitive_id: [triangles,]} dict, with triangles
+            given as in scene
+            opt: the optical properties of the new primitives, as a
+            {band_name: material} dict (same material for all primitives) or
+            a {band_name: {primitive_id: material}} dict.
+                    If None (default), the default material of the class is used
+        """
+        if self.material is None:
+            self.material = {band: {} for band in self.soil_reflectance}
+        if opt is None:
+            opt = {band: self.default_material for band in self.material}
+        if sorted(opt) != sorted(self.material):
+            raise ValueError('opt should give the materials of all the bands of the scene')
+        if self.geometry is None:
+            self.scene = primitives
+            self.geometry.dirty.update(primitives)
+        else:
+            self.geometry.add(primitives)
+        for band, mat in opt.iteritems():
+            for pid in primitives:
+                self.material[band][pid] = mat[pid] if isinstance(mat, dict) else mat
+        self.exposure = None
+
+    def remove_primitives(self, pids):
+        """ Remove primitives from the scene
+
+        Args:
+            pids: the ids of the primitives to remove
+        """
+        if self.geometry is None:
+            raise ValueError('remove_primitives needs a scene to be defined')
+        pids = list(pids)
+        self.geometry.remove(pids)
+        for band in self.material:
+            for pid in pids:
+                self.material[band].pop(pid, None)
+        self.exposure = None
 
     def auto_screen(self, screen_resolution):
         pix = screen_resolution * self.conv_unit
@@ -361,8 +408,9 @@ class CaribuScene(object):
                     for i in range(len(v)):
                         color_property[k].append(colors.pop(0))
                 else:
-                    color_property[k] = [colors.pop(0)] * len(self.scene[k])
-        scene = generate_scene(self.scene, color_property)
+                    color_property[k] = [colors.pop(0)] * self.geometry.count(k)
+        meshes = {pid: self.geometry.mesh(pid) for pid in self.geometry.ids}
+        scene = generate_scene(meshes, color_property)
         if display:
             Viewer.display(scene)
         return scene, values
@@ -423,41 +471,46 @@ class CaribuScene(object):
         """  Transform scene and materials into simpler python objects
 
         Returns:
-
+            - triangles: the N triangles of the scene (and soil), as a
+            scene_store.IndexedMesh (numpy.asarray gives their (N, 3, 3) vertices)
+            - groups: the list of the primitive ids of the triangles
+            - materials: the materials of the triangles, as a caribu.MaterialIndex (a
+            {band: MaterialIndex} dict if the scene has several bands)
+            - bands: the list of band names
+            - albedo: the soil reflectance (a {band: reflectance} dict if the scene has several bands)
         """
         triangles, groups, materials, bands, albedo = None, None, None, None, None
-        if self.scene is not None:
-            triangles = reduce(lambda x, y: x + y, self.scene.values())
-            groups = [[pid] * len(self.scene[pid]) for pid in self.scene]
-            groups = reduce(lambda x, y: x + y, groups)
+        if self.geometry is not None:
+            geometry = self.geometry
+            triangles = geometry.as_mesh()
+            groups = geometry.groups()
             if self.soil is not None:
-                triangles += self.soil
+                triangles = IndexedMesh.concatenate(
+                    [triangles, IndexedMesh.from_triangles(self.soil)])
                 groups = groups + ['soil'] * len(self.soil)
             bands = self.material.keys()
+            materials = {}
+            for band in bands:
+                # one material per primitive, indexed by triangles
+                table = [self.material[band][pid] for pid in geometry.ids]
+                index = geometry.group_index
+                if self.soil is not None:
+                    table.append((self.soil_reflectance[band],))
+                    index = numpy.concatenate(
+                        (index, [len(table) - 1] * len(self.soil)))
+                materials[band] = MaterialIndex(table, index)
             if len(bands) == 1:
-                materials = [
-                    [self.material[bands[0]][pid]] * len(self.scene[pid]) for
-                    pid in self.scene]
-                materials = reduce(lambda x, y: x + y, materials)
+                materials = materials[bands[0]]
                 albedo = self.soil_reflectance[bands[0]]
-                if self.soil is not None:
-                    materials = materials + [(albedo,)] * len(self.soil)
             else:
-                materials = {}
-                for band in bands:
-                    mat = [[self.material[band][pid]] * len(self.scene[pid]) for
-                           pid in self.scene]
-                    materials[band] = reduce(lambda x, y: x + y, mat)
-                    if self.soil is not None:
-                        materials = materials + [(self.soil_reflectance[
-                                                      band],)] * len(self.soil)
                 albedo = self.soil_reflectance
 
         return triangles, groups, materials, bands, albedo
 
     def run(self, direct=True, infinite=False, d_sphere=0.5, layers=10,
             height=None, screen_size=1536, screen_resolution=None,
-            split_face=False, simplify=False):
+            split_face=False, simplify=False, ff_cache=None, backend=None,
+            lazy=False, threads=1):
         """ Compute illumination using the appropriate caribu algorithm
 
         Args:
@@ -481,6 +534,18 @@ class CaribuScene(object):
             simplify: (bool)  Whether results per band should be simplified to
             a {result_name: property} dict
                     in the case of a monochromatic simulation
+            ff_cache: (FormFactorCache or str) a cache (or the directory of a
+            cache) where the form factors of radiosity runs are kept across
+            runs. If None (default), form factors are computed at each run
+            backend: (str) the name of the backend (see backends module) used
+            to compute illumination, or 'auto' to use the cheapest available
+            backend. If None (default), backends.default_backend is used
+            lazy: (bool) If True, raw and aggregated dicts (and soil_raw,
+            soil_aggregated) are not built: None, None is returned, and the
+            properties needed are computed on demand from self.results.
+            Default is False
+            threads: (int) the number of threads projecting the light sources
+            in canestra. Default is 1
 
         Returns:
             - raw (dict of dict) a {band_name: {result_name: property}} dict of dict.
@@ -498,49 +563,21 @@ class CaribuScene(object):
                       on the inferior face (m-2)
                       - Ei_sup (float): the surfacic density of energy incoming
                        on the superior face (m-2)
+            The per-triangle results are kept in self.results (a
+             GroupedResults), that converts and aggregates single properties
+             on demand, e.g. self.results.aggregated('par', 'Eabs')
         """
 
         raw, aggregated = {}, {}
         self.soil_raw, self.soil_aggregated = {}, {}
-        results = ['Eabs', 'Ei', 'area']
-        if split_face:
-            results.extend(['Ei_inf', 'Ei_sup'])
 
         # convert lights to scene_unit
         lights = self.light
         if self.conv_unit != 1:
             lights = [(e * self.conv_unit ** 2, vect) for e, vect in self.light]
 
-        if self.scene is not None:
-            triangles = reduce(lambda x, y: x + y, self.scene.values())
-            groups = [[pid] * len(self.scene[pid]) for pid in self.scene]
-            groups = reduce(lambda x, y: x + y, groups)
-            if self.soil is not None:
-                triangles += self.soil
-                groups = groups + ['soil'] * len(self.soil)
-            bands = self.material.keys()
-            if len(bands) == 1:
-                materials = [
-                    [self.material[bands[0]][pid]] * len(self.scene[pid]) for
-                    pid in self.scene]
-                materials = reduce(lambda x, y: x + y, materials)
-                albedo = self.soil_reflectance[bands[0]]
-                if self.soil is not None:
-                    materials = materials + [(albedo,)] * len(self.soil)
-                algos = {'raycasting': raycasting, 'radiosity': radiosity,
-                         'mixed_radiosity': mixed_radiosity}
-            else:
-                materials = {}
-                for band in bands:
-                    mat = [[self.material[band][pid]] * len(self.scene[pid]) for
-                           pid in self.scene]
-                    materials[band] = reduce(lambda x, y: x + y, mat)
-                    if self.soil is not None:
-                        materials = materials + [(self.soil_reflectance[
-                                                      band],)] * len(self.soil)
-                albedo = self.soil_reflectance
-                algos = {'raycasting': x_raycasting, 'radiosity': x_radiosity,
-                         'mixed_radiosity': x_mixed_radiosity}
+        if self.geometry is not None:
+            triangles, groups, materials, bands, albedo = self.as_primitive()
 
             if not direct and infinite:  # mixed radiosity will be used
                 if d_sphere < 0:
@@ -548,8 +585,7 @@ class CaribuScene(object):
                         'calling radiosity should be done using direct=False and infinite=False')
                 d_sphere /= self.conv_unit
                 if height is None:
-                    z = (pt[2] for tri in triangles for pt in tri)
-                    height = max(z)
+                    height = triangles.points[triangles.indices, 2].max()
                 else:
                     height /= self.conv_unit
 
@@ -561,53 +597,156 @@ class CaribuScene(object):
                 screen_size = self.auto_screen(screen_resolution)
                 print 'adjusted projection screen size: ' + str(screen_size)
 
-            if not direct and infinite:  # mixed radiosity
-                out = algos['mixed_radiosity'](triangles, materials,
-                                               lights=lights,
-                                               domain=self.pattern,
-                                               soil_reflectance=albedo,
-                                               diameter=d_sphere, layers=layers,
-                                               height=height,
-                                               screen_size=screen_size)
-            elif not direct:  # pure radiosity
-                out = algos['radiosity'](triangles, materials, lights=lights,
-                                         screen_size=screen_size)
-            else:  # ray_casting
+            if not direct and infinite:
+                algorithm = 'mixed_radiosity'
+            elif not direct:
+                algorithm = 'radiosity'
+            else:
+                algorithm = 'raycasting'
+            desc = problem(algorithm, len(triangles), lights=len(lights),
+                           bands=len(bands), screen_size=screen_size,
+                           infinite=infinite, ff_cache=ff_cache)
+            algo = select_backend(backend, desc)
+
+            if algorithm == 'mixed_radiosity':
+                out = algo.mixed_radiosity(triangles, materials,
+                                           lights=lights,
+                                           domain=self.pattern,
+                                           soil_reflectance=albedo,
+                                           diameter=d_sphere, layers=layers,
+                                           height=height,
+                                           screen_size=screen_size,
+                                           ff_cache=ff_cache, threads=threads)
+            elif algorithm == 'radiosity':
+                out = algo.radiosity(triangles, materials, lights=lights,
+                                     screen_size=screen_size,
+                                     ff_cache=ff_cache, threads=threads)
+            else:
                 if infinite:
-                    out = algos['raycasting'](triangles, materials,
-                                              lights=lights,
-                                              domain=self.pattern,
-                                              screen_size=screen_size)
+                    out = algo.raycasting(triangles, materials,
+                                          lights=lights,
+                                          domain=self.pattern,
+                                          screen_size=screen_size,
+                                          threads=threads)
                 else:
-                    out = algos['raycasting'](triangles, materials,
-                                              lights=lights, domain=None,
-                                              screen_size=screen_size)
+                    out = algo.raycasting(triangles, materials,
+                                          lights=lights, domain=None,
+                                          screen_size=screen_size,
+                                          threads=threads)
 
             if len(bands) == 1:
                 out = {bands[0]: out}
-            for band in bands:
-                output = _convert(out[band], self.conv_unit)
-                raw[band] = {}
-                aggregated[band] = {}
-                for k in results:
-                    raw[band][k] = _agregate(output[k], groups, list)
-                    if k is 'area':
-                        aggregated[band][k] = _agregate(output[k], groups, sum)
-                    else:
-                        aggregated[band][k] = _agregate(
-                            izip(output[k], output['area']), groups, _wsum)
-                if self.soil is not None:
-                    self.soil_raw[band] = {k: raw[band][k].pop('soil') for k in
-                                           results}
-                    self.soil_aggregated[band] = {
-                        k: aggregated[band][k].pop('soil') for k in results}
+            raw, aggregated = self._outputs(out, bands, groups, split_face,
+                                            simplify, lazy)
+
+        return raw, aggregated
 
-            if simplify and len(bands) == 1:
-                raw = raw[bands[0]]
-                aggregated = aggregated[bands[0]]
+    def _outputs(self, out, bands, groups, split_face=False, simplify=False,
+                 lazy=False):
+        """ Convert and aggregate per-band caribu outputs (see run)
+
+        Results are converted, split and aggregated by primitive with numpy.
+        """
+        results = ['Eabs', 'Ei', 'area']
+        if split_face:
+            results.extend(['Ei_inf', 'Ei_sup'])
+
+        self.results = GroupedResults(out, groups, self.conv_unit)
+        self.soil_raw, self.soil_aggregated = {}, {}
+        if lazy:
+            return None, None
+        raw = self.results.nested(self.results.raw, bands, results)
+        aggregated = self.results.nested(self.results.aggregated, bands, results)
+        if self.soil is not None:
+            self.soil_raw = self.results.nested(self.results.soil_raw, bands,
+                                                results)
+            self.soil_aggregated = self.results.nested(
+                self.results.soil_aggregated, bands, results)
+
+        if simplify and len(bands) == 1:
+            raw = raw[bands[0]]
+            aggregated = aggregated[bands[0]]
 
         return raw, aggregated
 
+    def exposure_matrix(self, infinite=False, screen_size=1536,
+                        screen_resolution=None, threads=1):
+        """ Compute the direct irradiance of the triangles of the scene per
+        unit energy of each light source
+
+        The matrix is kept by the scene, for apply_sky to compute the
+        illumination of the scene under any sky built on the same light
+        directions, without running caribu again.
+
+        Args:
+            infinite: (bool) Whether the scene should be considered as infinite
+                    Default is False (non infinite canopy)
+            screen_size: (int) size of the screen_size x screen_size square
+                    projection screen (pixels)
+            screen_resolution: (float) real world size (meter) of a pixel of the
+             projection screen. If None(default), screen_size is used.
+            threads: (int) the number of threads projecting the light sources
+            in canestra. Default is 1
+
+        Returns:
+            (dict) the exposure matrix (see caribu.exposure_matrix), in scene
+            units
+        """
+        if self.geometry is None:
+            raise ValueError('exposure matrix needs a scene to be defined')
+        if infinite and self.pattern is None:
+            raise ValueError(
+                'infinite canopy illumination needs a pattern to be defined')
+
+        triangles, groups, materials, bands, albedo = self.as_primitive()
+        if len(bands) > 1:
+            # exposure only depends on the opacity of materials
+            materials = materials[bands[0]]
+        lights = self.light
+        if self.conv_unit != 1:
+            lights = [(e * self.conv_unit ** 2, vect) for e, vect in self.light]
+        if screen_resolution is not None:
+            screen_size = self.auto_screen(screen_resolution)
+        domain = self.pattern if infinite else None
+
+        self.exposure = exposure_matrix(triangles, materials, lights=lights,
+                                        domain=domain, screen_size=screen_size,
+                                        threads=threads)
+        return self.exposure
+
+    def apply_sky(self, weights=None, split_face=False, simplify=False,
+                  lazy=False):
+        """ Compute the direct illumination of the scene under a sky built
+        on the light directions of the exposure matrix
+
+        Args:
+            weights: (list of float) the energies (m-2) of the light
+            sources of the exposure matrix. If None (default), the energies of
+            the lights used to compute the exposure matrix are used.
+            split_face: (bool) Whether results of incidence on individual faces
+            of triangle should be outputed. Default is False
+            simplify: (bool)  Whether results per band should be simplified to
+            a {result_name: property} dict
+                    in the case of a monochromatic simulation
+            lazy: (bool) If True, only self.results is filled (see run).
+            Default is False
+
+        Returns:
+            raw, aggregated results, as returned by run
+        """
+        if self.exposure is None:
+            raise ValueError('exposure_matrix should be computed before applying a sky')
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=float) * self.conv_unit ** 2
+
+        triangles, groups, materials, bands, albedo = self.as_primitive()
+        if len(bands) == 1:
+            materials = {bands[0]: materials}
+        out = {band: apply_sky(self.exposure, materials[band], weights) for band
+               in bands}
+
+        return self._outputs(out, bands, groups, split_face, simplify, lazy)
+
     def runPeriodise(self):
         """ Call periodise and modify position of triangle in the scene to fit inside pattern"""
         triangles, groups, materials, bands, albedo = self.as_primitive()
@@ -6,7 +6,8 @@ They generally have an additional copyscene argument, that pass caribuscene by c
 
 from alinea.caribu.CaribuScene import CaribuScene
 from alinea.caribu.display import generate_scene
-from alinea.caribu.caribu import opt_string_and_labels, triangles_string
+from alinea.caribu.caribu import opt_string_and_labels
+from alinea.caribu.file_adaptor import write_can
 
 
 # caribuscene instance used to access doc strings of class methods
@@ -121,9 +122,7 @@ def WriteCan(caribuscene, filename):
     triangles, groups, materials, bands, albedo = caribuscene.as_primitive()
     if len(bands) == 1:
         o_string, labels = opt_string_and_labels(materials)
-        can_string = triangles_string(triangles, labels)
-        with open(filename, 'w') as output:
-            output.write(can_string)
+        write_can(filename, triangles, labels)
     return filename
 
 
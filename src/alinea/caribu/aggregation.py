@@ -0,0 +1,238 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" Group-by aggregation of per-triangle caribu results
+
+A GroupBy sorts the triangles by group once, and then reduces any number of
+result columns per group with numpy (reduceat on the sorted columns).
+Reducers are looked up by name in the reducers registry, that can be extended
+with register_reducer, or given as plain functions of the list of the values
+of a group.
+
+GroupedResults holds the per-band result columns of a scene and computes their
+unit conversion, split and aggregation by group when they are first needed,
+and builds the nested dicts returned by CaribuScene.run.
+"""
+
+import numpy
+
+
+def _sum(grouped, values, weights):
+    return numpy.add.reduceat(values, grouped.starts)
+
+
+def _mean(grouped, values, weights):
+    return numpy.true_divide(numpy.add.reduceat(values, grouped.starts), grouped.counts)
+
+
+def _weighted_mean(grouped, values, weights):
+    """ mean of values weighted by (positive) weights, 0 for groups with no weight"""
+    if weights is None:
+        raise ValueError('weighted_mean reducer needs weights')
+    with numpy.errstate(invalid='ignore'):
+        weighted = numpy.where(weights > 0, values * weights, 0)
+    total = numpy.add.reduceat(weights, grouped.starts)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(total == 0, 0., numpy.add.reduceat(weighted, grouped.starts) / total)
+
+
+def _min(grouped, values, weights):
+    return numpy.minimum.reduceat(values, grouped.starts)
+
+
+def _max(grouped, values, weights):
+    return numpy.maximum.reduceat(values, grouped.starts)
+
+
+def _list(grouped, values, weights):
+    return [v.tolist() for v in numpy.split(values, grouped.starts[1:])]
+
+
+# reducers are f(grouped, values, weights) functions of a GroupBy and of values (and weights) sorted by
+# group, returning one value per group
+reducers = {'sum': _sum, 'mean': _mean, 'weighted_mean': _weighted_mean, 'min': _min, 'max': _max,
+            'list': _list}
+
+
+def register_reducer(name, reducer):
+    """ Register a reducer
+
+    Args:
+        name: (str) the name of the reducer
+        reducer: a f(grouped, values, weights) function of a GroupBy and of numpy arrays of
+            values (and weights, or None) sorted by group, returning one value per group.
+            Groups start at grouped.starts and hold grouped.counts values.
+    """
+    reducers[name] = reducer
+
+
+class GroupBy(object):
+    """ Groups of items, computed once for the aggregation of several columns of values
+    """
+
+    def __init__(self, groups, ids=None):
+        """ Args:
+            groups: (list) the group of each item, or, if ids is given, the index (in ids) of
+                the group of each item
+            ids: (list) the group ids
+        """
+        if ids is None:
+            position = {}
+            codes = numpy.fromiter((position.setdefault(g, len(position)) for g in groups),
+                                   dtype=numpy.intp, count=len(groups))
+            ids = sorted(position, key=position.get)
+        else:
+            codes = numpy.asarray(groups, dtype=numpy.intp)
+        counts = numpy.bincount(codes, minlength=len(ids))
+        present = numpy.flatnonzero(counts)
+        self.keys = [ids[i] for i in present.tolist()]
+        self.counts = counts[present]
+        self.starts = numpy.concatenate(([0], numpy.cumsum(self.counts)[:-1])).astype(numpy.intp)
+        self.size = len(codes)
+        # stable sort, so that items keep their order within groups
+        if self.size > 0 and numpy.any(numpy.diff(codes) < 0):
+            self.order = numpy.argsort(codes, kind='mergesort')
+        else:
+            self.order = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sort(self, values):
+        """ values (array-like) sorted by group"""
+        values = numpy.asarray(values)
+        if len(values) != self.size:
+            raise ValueError('The number of values and of grouped items should match')
+        if self.order is None:
+            return values
+        return values[self.order]
+
+    def reduce(self, values, reducer='sum', weights=None):
+        """ Reduce values per group
+
+        Args:
+            values: (array-like) the values of the items
+            reducer: the name of a registered reducer, or a function of the list of the values of a group
+            weights: (array-like) the weights of the items, for reducers that use them
+
+        Returns:
+            a {group_id: value} dict
+        """
+        if len(self.keys) == 0:
+            return {}
+        if reducer in reducers:
+            values = self.sort(values)
+            if weights is not None:
+                weights = self.sort(weights).astype(numpy.float64)
+            result = reducers[reducer](self, values, weights)
+        elif callable(reducer):
+            result = [reducer(v) for v in reducers['list'](self, self.sort(values), None)]
+        else:
+            raise ValueError('unknown reducer: %s' % reducer)
+        if isinstance(result, numpy.ndarray):
+            result = result.tolist()
+        return dict(zip(self.keys, result))
+
+    def split(self, values):
+        """ The {group_id: [values,]} dict of the values of each group"""
+        return self.reduce(values, 'list')
+
+    def aggregate(self, columns, reducers=('sum',), weights=None):
+        """ Reduce several columns with several reducers
+
+        Args:
+            columns: (dict of array-like) a {name: values} dict
+            reducers: (list) the reducers (names or functions) applied to all columns, or a
+                {name: [reducers]} dict of the reducers to apply to each column
+            weights: (array-like) the weights of the items, for reducers that use them
+
+        Returns:
+            a {name: {reducer: {group_id: value}}} dict of dict, functions being keyed by their name
+        """
+        if weights is not None:
+            weights = numpy.asarray(weights, dtype=numpy.float64)
+        result = {}
+        for name, values in columns.iteritems():
+            todo = reducers[name] if isinstance(reducers, dict) else reducers
+            values = numpy.asarray(values)
+            result[name] = {}
+            for reducer in todo:
+                key = reducer if isinstance(reducer, basestring) else reducer.__name__
+                result[name][key] = self.reduce(values, reducer, weights)
+        return result
+
+
+class GroupedResults(object):
+    """ Per-band caribu results of the triangles of a scene, aggregated by group when needed
+    """
+
+    # results converted to meter units: areas are multiplied, surfacic energies divided, by conv_unit ** 2
+    areas = ('area',)
+    densities = ('Eabs', 'Ei', 'Ei_sup', 'Ei_inf')
+
+    def __init__(self, outputs, groups, conv_unit=1, soil='soil'):
+        """ Args:
+            outputs: (dict of dict) a {band: {result_name: values}} dict of the results of the triangles
+            groups: (list or GroupBy) the group of each triangle
+            conv_unit: (float) the length (m) of the scene unit
+            soil: the group of soil triangles, whose results are set apart
+        """
+        self.outputs = outputs
+        self.grouper = groups if isinstance(groups, GroupBy) else GroupBy(groups)
+        self.conv_unit = conv_unit
+        self.soil = soil
+        self._columns = {}
+        self._splits = {}
+
+    def column(self, band, name):
+        """ The (converted) numpy array of result name of band"""
+        key = (band, name)
+        if key not in self._columns:
+            values = numpy.asarray(self.outputs[band][name], dtype=numpy.float64)
+            if self.conv_unit != 1:
+                if name in self.areas:
+                    values = values * self.conv_unit ** 2
+                elif name in self.densities:
+                    values = values / self.conv_unit ** 2
+            self._columns[key] = values
+        return self._columns[key]
+
+    def _split(self, band, name, reducer):
+        key = (band, name, reducer)
+        if key not in self._splits:
+            if reducer == 'list':
+                values = self.grouper.split(self.column(band, name))
+            elif name == 'area':
+                values = self.grouper.reduce(self.column(band, name), 'sum')
+            else:
+                values = self.grouper.reduce(self.column(band, name), reducer,
+                                             weights=self.column(band, 'area'))
+            soil = values.pop(self.soil, None)
+            self._splits[key] = values, soil
+        return self._splits[key]
+
+    def raw(self, band, name):
+        """ A {group: [values,]} dict of result name of band"""
+        return self._split(band, name, 'list')[0]
+
+    def aggregated(self, band, name, reducer='weighted_mean'):
+        """ A {group: value} dict of result name of band, aggregated with reducer (areas are summed)"""
+        return self._split(band, name, reducer)[0]
+
+    def soil_raw(self, band, name):
+        return self._split(band, name, 'list')[1]
+
+    def soil_aggregated(self, band, name, reducer='weighted_mean'):
+        return self._split(band, name, reducer)[1]
+
+    def nested(self, method, bands, names):
+        """ A {band: {name: method(band, name)}} dict of dict"""
+        return {band: {name: method(band, name) for name in names} for band in bands}
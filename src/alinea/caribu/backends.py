@@ -0,0 +1,241 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" Backends computing the illumination of caribu scenes
+
+A backend implements the raycasting, radiosity and mixed_radiosity algorithms
+with the arguments of the functions of the caribu module, materials being given
+for one band (a list or MaterialIndex) or as a {band: materials} dict.
+Backends are registered by name, and selected by name by CaribuScene.run. The
+'auto' policy picks, among the available backends supporting a problem and
+eligible to automatic selection, the one with the lowest estimated cost.
+"""
+import abc
+import multiprocessing
+
+from alinea.caribu import canestra_engine
+from alinea.caribu.caribu import raycasting, radiosity, mixed_radiosity, \
+    x_raycasting, x_radiosity, x_mixed_radiosity
+
+algorithms = ('raycasting', 'radiosity', 'mixed_radiosity')
+
+
+def problem(algorithm, triangles, lights=1, bands=1, screen_size=1536, **options):
+    """ The description of an illumination problem, used to select a backend
+
+    Args:
+        algorithm: (str) one of algorithms
+        triangles: (int) the number of triangles of the scene
+        lights: (int) the number of light sources
+        bands: (int) the number of bands
+        screen_size: (int) the size (pixels) of the projection screen
+        options: other options of the run (e.g. ff_cache)
+
+    Returns:
+        a dict
+    """
+    if algorithm not in algorithms:
+        raise ValueError('unknown algorithm: %s' % algorithm)
+    desc = dict(options)
+    desc.update(algorithm=algorithm, triangles=triangles, lights=lights,
+                bands=bands, screen_size=screen_size)
+    return desc
+
+
+class Backend(object):
+    """ Base class of backends
+
+    Subclasses implement the three algorithms (backends not supporting one of them tell it in
+    supports).
+    """
+
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+
+    # can the backend be picked by the 'auto' policy ?
+    auto = True
+
+    # rough timings (s) used by cost: start of a canestra run, scene transfer per
+    # triangle and band, projection per triangle and per pixel for each light
+    startup = 0.
+    transfer = 0.
+    projection = 1e-6
+    pixel = 2e-9
+
+    def available(self):
+        """ Can the backend be used here ?"""
+        return True
+
+    def supports(self, desc):
+        """ Can the backend solve problem desc (see problem) ?"""
+        return True
+
+    def cost(self, desc):
+        """ An estimate of the time (s) needed to solve problem desc (see problem)"""
+        bands = desc['bands']
+        work = desc['lights'] * bands * (desc['triangles'] * self.projection +
+                                         desc['screen_size'] ** 2 * self.pixel)
+        return self.startup + desc['triangles'] * bands * self.transfer + work
+
+    @abc.abstractmethod
+    def raycasting(self, triangles, materials, lights, domain=None, screen_size=1536, threads=1):
+        pass
+
+    @abc.abstractmethod
+    def radiosity(self, triangles, materials, lights, screen_size=1536, ff_cache=None, threads=1):
+        pass
+
+    @abc.abstractmethod
+    def mixed_radiosity(self, triangles, materials, lights, domain, soil_reflectance, diameter,
+                        layers, height, screen_size=1536, ff_cache=None, threads=1):
+        pass
+
+
+class CanestraBackend(Backend):
+    """ The canestra functions of the caribu module, run by canestrad processes or in-process
+    """
+
+    def __init__(self, name, inprocess=False, shards=1):
+        """ Args:
+            name: (str) the name of the backend
+            inprocess: (bool) run canestra in-process (needs the canestra2py extension)
+            shards: (int) the number of groups of lights cast concurrently in raycasting (None
+                for the number of cpus). Ignored in-process, where canestra runs one call at a time.
+        """
+        self.name = name
+        self.inprocess = inprocess
+        self.shards = shards
+        # canestra runs in-process are only used when asked for by name
+        self.auto = not inprocess
+        if inprocess:
+            self.startup = 0.
+            self.transfer = 2e-7
+        else:
+            self.startup = 0.05
+            self.transfer = 2e-6
+
+    def available(self):
+        return not self.inprocess or canestra_engine.is_available()
+
+    def nshards(self, lights=None):
+        if self.inprocess:
+            return 1
+        shards = self.shards
+        if shards is None:
+            shards = multiprocessing.cpu_count()
+        if lights is not None:
+            shards = min(shards, lights)
+        return max(1, shards)
+
+    def supports(self, desc):
+        if self.shards == 1 or self.inprocess:
+            return True
+        # sharded backends only make sense for raycasting several lights with several cpus
+        return desc['algorithm'] == 'raycasting' and self.nshards(desc['lights']) > 1
+
+    def cost(self, desc):
+        cost = super(CanestraBackend, self).cost(desc)
+        shards = self.nshards(desc['lights'])
+        if shards == 1:
+            return cost
+        # shards run concurrently, each one starting canestra and transferring the scene
+        overhead = self.startup + desc['triangles'] * desc['bands'] * self.transfer
+        return shards * overhead + (cost - overhead) / shards
+
+    def raycasting(self, triangles, materials, lights, domain=None, screen_size=1536, threads=1):
+        fun = x_raycasting if isinstance(materials, dict) else raycasting
+        return fun(triangles, materials, lights=lights, domain=domain, screen_size=screen_size,
+                   inprocess=self.inprocess, shards=self.nshards(len(lights)), threads=threads)
+
+    def radiosity(self, triangles, materials, lights, screen_size=1536, ff_cache=None, threads=1):
+        fun = x_radiosity if isinstance(materials, dict) else radiosity
+        return fun(triangles, materials, lights=lights, screen_size=screen_size,
+                   inprocess=self.inprocess, ff_cache=ff_cache, threads=threads)
+
+    def mixed_radiosity(self, triangles, materials, lights, domain, soil_reflectance, diameter,
+                        layers, height, screen_size=1536, ff_cache=None, threads=1):
+        fun = x_mixed_radiosity if isinstance(materials, dict) else mixed_radiosity
+        return fun(triangles, materials, lights, domain, soil_reflectance, diameter, layers, height,
+                   screen_size=screen_size, inprocess=self.inprocess, ff_cache=ff_cache,
+                   threads=threads)
+
+
+backends = {}
+
+# the backend used by CaribuScene.run when none is given
+default_backend = 'auto'
+
+
+def register_backend(backend):
+    """ Register a backend (an instance of a subclass of Backend) under its name"""
+    if not isinstance(backend, Backend):
+        raise TypeError('backends should be instances of Backend: %r' % (backend,))
+    missing = [a for a in algorithms if not callable(getattr(backend, a, None)) or
+               getattr(getattr(backend, a), '__isabstractmethod__', False)]
+    if missing:
+        raise TypeError('backend %s does not implement %s' % (backend.name, ', '.join(missing)))
+    if backend.name in (None, 'auto'):
+        raise ValueError('invalid backend name: %s' % backend.name)
+    backends[backend.name] = backend
+
+
+def set_default_backend(name):
+    """ Set the name of the backend used by default ('auto' for automatic selection)
+
+    Returns:
+        the previous default backend
+    """
+    global default_backend
+    if name != 'auto' and name not in backends:
+        raise ValueError('unknown backend: %s' % name)
+    previous, default_backend = default_backend, name
+    return previous
+
+
+def available_backends():
+    """ The names of the registered backends that can be used here"""
+    return sorted(name for name, backend in backends.iteritems() if backend.available())
+
+
+def select_backend(name, desc):
+    """ The backend solving problem desc
+
+    Args:
+        name: (str) the name of a registered backend, 'auto' for the cheapest backend
+            supporting desc among those eligible to automatic selection, or None for
+            default_backend
+        desc: a problem description (see problem)
+
+    Returns:
+        a Backend instance
+    """
+    if name is None:
+        name = default_backend
+    if name != 'auto':
+        if name not in backends:
+            raise ValueError('unknown backend: %s' % name)
+        backend = backends[name]
+        if not backend.available():
+            raise ValueError('backend %s is not available' % name)
+        if not backend.supports(desc):
+            raise ValueError('backend %s does not support %s' % (name, desc['algorithm']))
+        return backend
+    candidates = [backends[n] for n in available_backends()
+                  if backends[n].auto and backends[n].supports(desc)]
+    if not candidates:
+        raise ValueError('no available backend supports %s' % desc['algorithm'])
+    return min(candidates, key=lambda b: b.cost(desc))
+
+
+register_backend(CanestraBackend('subprocess'))
+register_backend(CanestraBackend('sharded', shards=None))
+register_backend(CanestraBackend('inprocess', inprocess=True))
@@ -0,0 +1,185 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" In-process canestra engine, driven by numpy buffers (canestra2py module)
+
+The scene and the light sources are passed to canestra as contiguous numpy
+arrays, and results come back as an array holding the columns of Etri.vec0,
+without going through the .can, .light and Etri.vec0 files.
+"""
+import threading
+
+import numpy
+
+from alinea.caribu.file_adaptor import can_chunks, is_canb, load_canb
+from alinea.caribu.label import label_strings
+from alinea.caribu.scene_store import IndexedMesh
+
+try:
+    from alinea.caribu import canestra2py
+except ImportError:
+    canestra2py = None
+
+# memory layout of the canestra Patch struct (transf.h): signed char t; float P[3][3]
+patch_dtype = numpy.dtype([('t', 'i1'), ('P', 'f4', (3, 3))], align=True)
+
+result_columns = ('index', 'label', 'area', 'Eabs', 'Ei_sup', 'Ei_inf')
+
+# canestra uses static state: one in-process run at a time
+_lock = threading.Lock()
+
+
+def is_available():
+    """ Is the in-process engine (canestra2py extension) available ?"""
+    return canestra2py is not None
+
+
+def material_index(labels):
+    """ Encode can labels as canestra patch types
+
+    Args:
+        labels: (array-like of str or int) can labels
+
+    Returns:
+        (int8 array) patch types: -i for an opaque primitive of specie i,
+        i for a translucent primitive of specie i, 0 for the soil
+    """
+    labels = numpy.asarray(labels).astype(numpy.int64)
+    specie = labels // 10 ** 11
+    if len(specie) > 0 and specie.max() > 127:
+        raise ValueError('in-process canestra supports at most 127 optical species')
+    transparent = (labels // 1000) % 1000 != 0
+    return numpy.where(transparent, specie, -specie).astype(numpy.int8)
+
+
+def patch_array(triangles, labels):
+    """ Build a canestra patch array from triangles and can labels
+
+    Args:
+        triangles: (array-like) a (N, 3, 3) array (or list of list of tuples, or IndexedMesh) of triangles vertices
+        labels: (array-like of str or int) the N can labels of the triangles
+
+    Returns:
+        a (N,) numpy array with patch_dtype
+    """
+    if isinstance(triangles, IndexedMesh):
+        # shared points are converted once, then expanded per triangle
+        triangles = triangles.points.astype(numpy.float32)[triangles.indices]
+    else:
+        triangles = numpy.asarray(triangles, dtype=numpy.float32).reshape((-1, 3, 3))
+    if len(triangles) != len(labels):
+        raise ValueError('The number of triangles and labels should match')
+    patches = numpy.empty(len(triangles), dtype=patch_dtype)
+    patches['t'] = material_index(labels)
+    patches['P'] = triangles
+    return patches
+
+
+def patch_area(patches):
+    """ Areas (float64) of the triangles of a patch array"""
+    p = patches['P'].astype(numpy.float64)
+    cross = numpy.cross(p[:, 1] - p[:, 0], p[:, 2] - p[:, 0])
+    return 0.5 * numpy.sqrt((cross ** 2).sum(axis=1))
+
+
+def light_array(lights):
+    """ Build a canestra light array
+
+    Args:
+        lights: (list of tuples) a list of (Energy, (vx, vy, vz)) tuples
+
+    Returns:
+        a contiguous (N, 4) float64 array of (Energy, vx, vy, vz) rows
+    """
+    return numpy.ascontiguousarray([(e,) + tuple(v) for e, v in lights],
+                                   dtype=numpy.float64).reshape((-1, 4))
+
+
+def read_light_array(file_path):
+    """ Read a *.light file as a canestra light array"""
+    return numpy.loadtxt(file_path, dtype=numpy.float64, ndmin=2).reshape((-1, 4))
+
+
+class PatchScene(object):
+    """ A caribu scene held in memory as canestra patches and can labels
+    """
+
+    def __init__(self, triangles, labels):
+        if isinstance(labels, numpy.ndarray) and labels.dtype.kind in 'iu':
+            self.labels = label_strings(labels)
+        else:
+            self.labels = [str(lab) for lab in labels]
+        self.patches = patch_array(triangles, self.labels)
+
+    @staticmethod
+    def from_can(file_path):
+        """ Read a (triangle only) *.can file as a PatchScene"""
+        labels = []
+        triangles = []
+        with open(file_path, 'r') as infile:
+            for line in infile:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split()
+                labels.append(fields[2])
+                triangles.append(map(float, fields[-9:]))
+        return PatchScene(triangles, labels)
+
+    @staticmethod
+    def from_canb(file_path):
+        """ Read a *.canb (binary canopy) file as a PatchScene"""
+        vertices, labels = load_canb(file_path)
+        return PatchScene(vertices, ['%012d' % lab for lab in labels])
+
+    @staticmethod
+    def from_file(file_path):
+        """ Read a *.can or *.canb file as a PatchScene"""
+        if is_canb(file_path):
+            return PatchScene.from_canb(file_path)
+        return PatchScene.from_can(file_path)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __str__(self):
+        return 'PatchScene (%d triangles)' % len(self)
+
+    def can_string(self):
+        """ format the scene as caribu canopy string content"""
+        return ''.join(can_chunks(self.patches['P'], self.labels))
+
+
+def run(args, patches, lights, workdir):
+    """ Run canestra in-process
+
+    Args:
+        args: (list of str) canestrad command line options, without -M/-m (and -l if lights are given)
+        patches: (numpy array) the scene as a patch_dtype array
+        lights: (numpy array) a (N, 4) float64 array of light sources, or None to use the -l option
+        workdir: (str) the directory where canestra reads opt/env files and writes its logs and
+            form factors files. The current directory of the process is left unchanged.
+
+    Returns:
+        - status (int) : the canestra return code
+        - res (numpy array) : a (N, 6) float64 array with the columns of Etri.vec0
+          (see result_columns). Rejected triangles hold NaN.
+    """
+    if canestra2py is None:
+        raise ImportError('canestra2py extension is not available')
+    patches = numpy.ascontiguousarray(patches, dtype=patch_dtype)
+    if lights is not None:
+        lights = numpy.ascontiguousarray(lights, dtype=numpy.float64)
+    argv = ['canestrad'] + [str(a) for a in args]
+    with _lock:
+        status, data = canestra2py.canestra_arrays(argv, patches, lights, str(workdir))
+    res = numpy.frombuffer(data, dtype=numpy.float64).reshape((-1, 6))
+    return status, res
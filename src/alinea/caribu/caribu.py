@@ -13,8 +13,14 @@
 Core pythonic functions to call caribu shell.
 """
 
-from alinea.caribu.label import Label
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from alinea.caribu.label import encode
 from alinea.caribu.caribu_shell import Caribu
+from alinea.caribu.canestra_engine import PatchScene
+from alinea.caribu.file_adaptor import can_chunks, CanScene
 
 green_leaf_PAR = (0.06, 0.07)
 green_stem_PAR = (0.13,)
@@ -68,31 +74,84 @@ def opt_string(species, soil_reflectance=-1):
     return o_string
 
 
+class MaterialIndex(object):
+    """ Materials of triangles given as a table of materials and, for each triangle, the index of its material
+    in the table. A MaterialIndex behaves as the list of the materials of the triangles.
+    """
+
+    def __init__(self, table, index):
+        """ Args:
+            table: (list of tuple) a list of materials
+            index: (array-like of int) for each triangle, the index of its material in table
+        """
+        self.table = list(table)
+        self.index = numpy.asarray(index, dtype=numpy.intp)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        table = self.table
+        return (table[i] for i in self.index.tolist())
+
+    def __getitem__(self, i):
+        return self.table[self.index[i]]
+
+    def per_triangle(self, fun):
+        """ An array of fun(material) for all triangles, fun being evaluated once per material of the table"""
+        values = numpy.array([fun(m) for m in self.table])
+        return values[self.index]
+
+
+def material_table(materials):
+    """ The list of distinct materials and the index of the material of each triangle in that list
+
+    Args:
+        materials: (list of tuple or MaterialIndex) the materials of the triangles
+
+    Returns:
+        a (table, index) tuple
+    """
+    if isinstance(materials, MaterialIndex):
+        table, index = materials.table, materials.index
+    else:
+        table, index = list(materials), numpy.arange(len(materials))
+    position = {}
+    remap = numpy.fromiter((position.setdefault(m, len(position)) for m in table), dtype=numpy.intp,
+                           count=len(table))
+    distinct = sorted(position, key=position.get)
+    return distinct, remap[index]
+
+
+def _per_triangle(materials, fun):
+    """ An array of fun(material) for the materials of all triangles"""
+    if isinstance(materials, MaterialIndex):
+        return materials.per_triangle(fun)
+    return numpy.array([fun(m) for m in materials])
+
+
 def encode_labels(materials, species, x_mat=False):
+    """ encode the can labels of materials as an int64 array, species being a {optical_id: material} dict
+    """
     mapping = {v: k for k, v in species.iteritems()}
-
-    def _label(material):
-        lab = Label()
-        lab.plant_id = 1
-        lab.optical_id = mapping[material]
+    optical_id = numpy.fromiter((mapping[m] for m in materials), dtype=numpy.int64, count=len(materials))
+    # leaf_id (1 for translucent species) indexed by optical_id
+    leaf_id = numpy.zeros(max(species.keys() + [0]) + 1, dtype=numpy.int64)
+    for k, material in species.iteritems():
         if x_mat:
-            transparent = len(material[0]) > 1
-        else:
-            transparent = len(material) > 1
-        if transparent:
-            lab.leaf_id = 1
-        return str(lab)
-
-    return [_label(m) for m in materials]
+            material = material[0]
+        leaf_id[k] = len(material) > 1
+    return encode(optical_id, plant_id=1, leaf_id=leaf_id[optical_id], elt_id=0)
 
 
 def opt_string_and_labels(materials, soil_reflectance=-1):
     """ format materials as caribu opt file string content and encode label
     """
 
-    species = {i + 1: po for i, po in enumerate(list(set(materials)))}
+    table, index = material_table(materials)
+    species = {i + 1: po for i, po in enumerate(table)}
     o_string = opt_string(species, soil_reflectance)
-    labels = encode_labels(materials, species)
+    labels = encode_labels(table, species)[index]
 
     return o_string, labels
 
@@ -101,13 +160,21 @@ def x_opt_strings_and_labels(x_materials, x_soil_reflectance):
     """ format multispectral materials as caribu opt file strings content
     """
 
-    x_opts = zip(*x_materials.values())
-    x_species = {i + 1: po for i, po in enumerate(list(set(x_opts)))}
+    bands = x_materials.keys()
+    tables, indices = zip(*[material_table(x_materials[band]) for band in bands])
+    indices = numpy.array(indices, dtype=numpy.intp).reshape((len(bands), -1))
+    # distinct combinations of band materials
+    if indices.shape[1] > 0:
+        combinations, index = numpy.unique(indices, axis=1, return_inverse=True)
+    else:
+        combinations, index = indices, numpy.zeros(0, dtype=numpy.intp)
+    x_opts = [tuple(tables[b][i] for b, i in enumerate(col)) for col in combinations.T.tolist()]
+    x_species = {i + 1: po for i, po in enumerate(x_opts)}
 
-    labels = encode_labels(x_opts, x_species, x_mat=True)
+    labels = encode_labels(x_opts, x_species, x_mat=True)[index]
 
     opt_strings = {}
-    for i, k in enumerate(x_materials.keys()):
+    for i, k in enumerate(bands):
         species = {k: v[i] for k, v in x_species.iteritems()}
         opt_strings[k] = opt_string(species, x_soil_reflectance[k])
 
@@ -119,16 +186,18 @@ def triangles_string(triangles, labels):
     """
     if len(triangles) != len(labels):
         raise ValueError('The number of triangles and materials should match')
+    return ''.join(can_chunks(triangles, labels))
 
-    def _can_string(triangle, label):
-        s = "p 1 %s 3" % str(label)
-        for pt in triangle:
-            s += " %.6f %.6f %.6f" % pt
-        return s + '\n'
-
-    lines = [_can_string(t, l) for t, l in zip(triangles, labels)]
 
-    return ''.join(lines)
+def scene_input(triangles, labels, inprocess=False):
+    """ format triangles and associated labels as a caribu scene: a CanScene, streamed
+    to a canopy file in the working directory, or numpy buffers for the in-process engine
+    """
+    if len(triangles) != len(labels):
+        raise ValueError('The number of triangles and materials should match')
+    if inprocess:
+        return PatchScene(triangles, labels)
+    return CanScene(triangles, labels)
 
 
 def _absorptance(material):
@@ -146,13 +215,46 @@ def get_incident(eabs, materials):
     # check for integrity of caribu output
     if len(eabs) != len(materials):
         raise ValueError("The number of caribu outputs doesn't match the number of inputs")
-    alpha = (_absorptance(m) for m in materials)
+    alpha = _per_triangle(materials, _absorptance)
+    eabs = numpy.asarray(eabs, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(alpha != 0, eabs / numpy.where(alpha != 0, alpha, 1), eabs).tolist()
 
-    return [float(e) / a if a != 0 else e for e, a in zip(eabs, alpha)]
+
+def shard_lights(lights, shards):
+    """ Split a list of lights into (at most) shards contiguous groups of nearly equal size
+    """
+    lights = list(lights)
+    shards = max(1, min(int(shards), len(lights)))
+    size, extra = divmod(len(lights), shards)
+    groups = []
+    start = 0
+    for i in range(shards):
+        stop = start + size + (1 if i < extra else 0)
+        groups.append(lights[start:stop])
+        start = stop
+    return groups
+
+
+def sum_direct_outputs(outputs, materials):
+    """ Sum the outputs of raycasting runs of the same scene lit by distinct groups of lights
+
+    Eabs, Ei_sup and Ei_inf are summed triangle by triangle, the conventional Ei_inf (-1) of opaque
+    triangles being kept as is. Other properties are taken from the first output.
+    """
+    out = dict(outputs[0])
+    opaque = _per_triangle(materials, len) == 1
+    for var in ('Eabs', 'Ei_sup', 'Ei_inf'):
+        columns = numpy.array([output[var] for output in outputs], dtype=numpy.float64)
+        values = columns.sum(axis=0)
+        if var == 'Ei_inf':
+            values = numpy.where(opaque, columns[0], values)
+        out[var] = values.tolist()
+    return out
 
 
 def raycasting(triangles, materials, lights=(default_light,), domain=None,
-               screen_size=1536):
+               screen_size=1536, inprocess=False, shards=1, threads=1):
     """Compute monochrome illumination of triangles using caribu raycasting mode.
 
     Args:
@@ -171,6 +273,12 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
                  (xmin, ymin, xmax, ymax) scene is not bounded along z axis
                  if None (default), scene is not repeated
         screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        shards: (int) split lights into (at most) shards groups, that are cast concurrently (by
+                distinct canestrad processes) and whose results are summed. The in-process engine
+                runs one canestra at a time, hence does not accept shards > 1.
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
         (dict of str:property) properties computed:
@@ -183,9 +291,11 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
           - Ei_sup (float): the surfacic density of energy incoming on the superior face of the triangle
     """
 
+    if inprocess and shards > 1:
+        raise ValueError('The in-process engine runs one canestra at a time: shards should be 1')
+
     o_string, labels = opt_string_and_labels(materials)
-    can_string = triangles_string(triangles, labels)
-    sky_string = light_string(lights)
+    scene = scene_input(triangles, labels, inprocess)
 
     if domain is None:
         infinite = False
@@ -194,23 +304,40 @@ def raycasting(triangles, materials, lights=(default_light,), domain=None,
         infinite = True
         pattern_str = pattern_string(domain)
 
-    algo = Caribu(canfile=can_string,
-                  skyfile=sky_string,
-                  optfiles=o_string,
-                  patternfile=pattern_str,
-                  direct=True,
-                  infinitise=infinite,
-                  projection_image_size=screen_size,
-                  resdir=None, resfile=None)
-    algo.run()
-    out = algo.nrj['band0']['data']
+    def _cast(group):
+        algo = Caribu(canfile=scene,
+                      skyfile=light_string(group),
+                      optfiles=o_string,
+                      patternfile=pattern_str,
+                      direct=True,
+                      infinitise=infinite,
+                      projection_image_size=screen_size,
+                      resdir=None, resfile=None, inprocess=inprocess, threads=threads)
+        try:
+            algo.run()
+        finally:
+            algo.close()
+        return algo.nrj['band0']['data']
+
+    groups = shard_lights(lights, shards)
+    if len(groups) > 1:
+        pool = ThreadPool(len(groups))
+        try:
+            # each group is cast by its own canestrad process
+            outputs = pool.map(_cast, groups)
+        finally:
+            pool.close()
+            pool.join()
+        out = sum_direct_outputs(outputs, materials)
+    else:
+        out = _cast(lights)
     out['Ei'] = get_incident(out['Eabs'], materials)
 
     return out
 
 
 def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
-                 screen_size=1536):
+                 screen_size=1536, inprocess=False, shards=1, threads=1):
     """Compute monochrome illumination of triangles using caribu raycasting mode.
 
     Args:
@@ -230,6 +357,11 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
                  (xmin, ymin, xmax, ymax) scene is not bounded along z axis
                  if None (default), scene is not repeated
         screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        shards: (int) split lights into (at most) shards groups, that are cast concurrently and
+                whose results are summed (1 with the in-process engine)
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
         a ({band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -245,12 +377,12 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
     x_out = {}
     band, materials = x_materials.popitem()
     out = raycasting(triangles, materials, lights=lights, domain=domain,
-                     screen_size=screen_size)
+                     screen_size=screen_size, inprocess=inprocess, shards=shards, threads=threads)
     x_out[band] = out
 
     for band in x_materials:
         x_out[band] = {}
-        absorptance = (_absorptance(m) for m in x_materials[band])
+        absorptance = _per_triangle(x_materials[band], _absorptance).tolist()
         for var in out:
             if var != 'Eabs':
                 x_out[band][var] = out[var]
@@ -260,7 +392,111 @@ def x_raycasting(triangles, x_materials, lights=(default_light,), domain=None,
     return x_out
 
 
-def radiosity(triangles, materials, lights=(default_light,), screen_size=1536):
+def exposure_matrix(triangles, materials, lights=(default_light,), domain=None,
+                    screen_size=1536, inprocess=False, threads=1):
+    """Compute the direct irradiance of triangles faces per unit energy of each light source
+
+    Args:
+        triangles: (list of list of tuples) a list of triangles, each being defined
+                    by an ordered triplet of 3-tuple points coordinates.
+        materials: (list of tuple) a list of materials defining optical properties of triangles
+                    (see raycasting). Only the opacity of materials matters.
+        lights: (list of tuples) a list of (Energy, (vx, vy, vz)) tuples defining ligh sources
+        domain: (tuple of floats) 2D Coordinates of the domain bounding the scene for its replication.
+                 (xmin, ymin, xmax, ymax) scene is not bounded along z axis
+                 if None (default), scene is not repeated
+        screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        threads: (int) the number of threads projecting the light sources in canestra
+
+    Returns:
+        (dict of str:property) properties computed:
+          - index(int), label(str), area(float): as returned by raycasting
+          - energy (array): the (nsrc,) energies of light sources
+          - direction (array): the (nsrc, 3) directions of light sources
+          - Ei_sup (array): a (nsrc, ntri) float32 array of the surfacic density of energy incoming on the
+            superior face of triangles per unit energy of each light source
+          - Ei_inf (array): same as Ei_sup, for the inferior face of triangles
+    """
+
+    o_string, labels = opt_string_and_labels(materials)
+    scene = scene_input(triangles, labels, inprocess)
+
+    if domain is None:
+        infinite = False
+        pattern_str = None
+    else:
+        infinite = True
+        pattern_str = pattern_string(domain)
+
+    algo = Caribu(canfile=scene,
+                  skyfile=light_string(lights),
+                  optfiles=o_string,
+                  patternfile=pattern_str,
+                  direct=True,
+                  infinitise=infinite,
+                  projection_image_size=screen_size,
+                  resdir=None, resfile=None, inprocess=inprocess, exposure=True,
+                  threads=threads)
+    try:
+        algo.run()
+    finally:
+        algo.close()
+    out = algo.nrj['band0']['data']
+    sources, exposure = algo.exposure_data
+
+    return {'index': out['index'], 'label': out['label'], 'area': out['area'],
+            'energy': sources[:, 0], 'direction': sources[:, 1:],
+            'Ei_sup': exposure[:, 0], 'Ei_inf': exposure[:, 1]}
+
+
+def _face_absorptances(material):
+    if len(material) <= 2:
+        a = 1 - sum(material)
+        return a, a
+    else:
+        r0, t0, r1, t1 = material
+        return 1 - r0 - t0, 1 - r1 - t1
+
+
+def apply_sky(exposure, materials, weights=None):
+    """Compute direct illumination of triangles lit by a sky built on the light directions of an exposure matrix
+
+    Args:
+        exposure: (dict) an exposure matrix, as returned by exposure_matrix
+        materials: (list of tuple) a list of materials defining optical properties of triangles
+                    (see raycasting)
+        weights: (array-like of float) the energies of the light sources of the exposure matrix.
+                 If None (default), the energies used to compute the exposure matrix are used.
+
+    Returns:
+        (dict of str:property) properties computed, as returned by raycasting
+    """
+
+    if weights is None:
+        weights = exposure['energy']
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+    if weights.shape != exposure['energy'].shape:
+        raise ValueError('The number of weights and light sources of the exposure matrix should match')
+    ei_sup = weights.dot(exposure['Ei_sup'])
+    ei_inf = weights.dot(exposure['Ei_inf'])
+    if len(ei_sup) != len(materials):
+        raise ValueError("The number of materials doesn't match the number of triangles of the exposure matrix")
+    absorptances = _per_triangle(materials, _face_absorptances).reshape((-1, 2))
+    eabs = absorptances[:, 0] * ei_sup + absorptances[:, 1] * ei_inf
+    opaque = _per_triangle(materials, len) == 1
+    ei_inf[opaque & ~numpy.isnan(ei_inf)] = -1
+
+    out = {'index': exposure['index'], 'label': exposure['label'], 'area': exposure['area'],
+           'Eabs': eabs.tolist(), 'Ei_sup': ei_sup.tolist(), 'Ei_inf': ei_inf.tolist()}
+    out['Ei'] = get_incident(out['Eabs'], materials)
+
+    return out
+
+
+def radiosity(triangles, materials, lights=(default_light,), screen_size=1536, inprocess=False,
+              ff_cache=None, threads=1):
     """Compute monochromatic illumination of triangles using radiosity method.
 
     Args:
@@ -276,6 +512,11 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536):
                 By default a normalised zenital light is used.
                 Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
         screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        ff_cache: (FormFactorCache or str) a cache (or the directory of a cache) where form factors
+                  are kept across runs. If None (default), form factors are computed at each call
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
         (dict of str:property) properties computed:
@@ -292,10 +533,10 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536):
         raise ValueError('Radiosity method needs at least two primitives')
 
     o_string, labels = opt_string_and_labels(materials)
-    can_string = triangles_string(triangles, labels)
+    scene = scene_input(triangles, labels, inprocess)
     sky_string = light_string(lights)
 
-    algo = Caribu(canfile=can_string,
+    algo = Caribu(canfile=scene,
                   skyfile=sky_string,
                   optfiles=o_string,
                   patternfile=None,
@@ -303,15 +544,20 @@ def radiosity(triangles, materials, lights=(default_light,), screen_size=1536):
                   infinitise=False,
                   sphere_diameter=-1,
                   projection_image_size=screen_size,
-                  resdir=None, resfile=None)
-    algo.run()
+                  resdir=None, resfile=None, inprocess=inprocess,
+                  ff_cache=ff_cache, threads=threads)
+    try:
+        algo.run()
+    finally:
+        algo.close()
     out = algo.nrj['band0']['data']
     out['Ei'] = get_incident(out['Eabs'], materials)
 
     return out
 
 
-def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=1536):
+def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=1536, inprocess=False,
+                ff_cache=None, threads=1):
     """Compute multi-chromatic illumination of triangles using radiosity method.
 
     Args:
@@ -328,6 +574,11 @@ def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=153
                 By default a normalised zenital light is used.
                 Energy is ligth flux passing throuh a unit area (scene unit) horizontal plane.
         screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        ff_cache: (FormFactorCache or str) a cache (or the directory of a cache) where form factors
+                  are kept across runs. If None (default), form factors are computed at each call
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
         a {band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -345,10 +596,10 @@ def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=153
 
     no_soil = {band:-1 for band in x_materials}
     opt_strings, labels = x_opt_strings_and_labels(x_materials, no_soil)
-    can_string = triangles_string(triangles, labels)
+    scene = scene_input(triangles, labels, inprocess)
     sky_string = light_string(lights)
 
-    caribu = Caribu(canfile=can_string,
+    caribu = Caribu(canfile=scene,
                     skyfile=sky_string,
                     optfiles=opt_strings.values(),
                     optnames=opt_strings.keys(),
@@ -357,8 +608,12 @@ def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=153
                     infinitise=False,
                     sphere_diameter=-1,
                     projection_image_size=screen_size,
-                    resdir=None, resfile=None)
-    caribu.run()
+                    resdir=None, resfile=None, inprocess=inprocess,
+                    ff_cache=ff_cache, threads=threads)
+    try:
+        caribu.run()
+    finally:
+        caribu.close()
     out = {k: v['data'] for k, v in caribu.nrj.iteritems()}
     for band in out:
         out[band]['Ei'] = get_incident(out[band]['Eabs'], x_materials[band])
@@ -367,7 +622,8 @@ def x_radiosity(triangles, x_materials, lights=(default_light,), screen_size=153
 
 
 def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
-                    diameter, layers, height, screen_size=1536, debug=False):
+                    diameter, layers, height, screen_size=1536, debug=False, inprocess=False,
+                    ff_cache=None, threads=1):
     """Compute monochrome illumination of triangles using mixed-radiosity model.
 
     Args:
@@ -389,6 +645,11 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         height: upper limit of canopy layers (scene unit)
         screen_size: (int) buffer size for projection images (pixels)
         debug: (bool) Whether Caribu should be called in debug mode
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        ff_cache: (FormFactorCache or str) a cache (or the directory of a cache) where form factors
+                  are kept across runs. If None (default), form factors are computed at each call
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
         (dict of str:property) properties computed:
@@ -405,11 +666,11 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         raise ValueError('Radiosity method needs at least two primitives')
 
     o_string, labels = opt_string_and_labels(materials, soil_reflectance)
-    can_string = triangles_string(triangles, labels)
+    scene = scene_input(triangles, labels, inprocess)
     sky_string = light_string(lights)
     pattern_str = pattern_string(domain)
 
-    algo = Caribu(canfile=can_string,
+    algo = Caribu(canfile=scene,
                   skyfile=sky_string,
                   optfiles=o_string,
                   patternfile=pattern_str,
@@ -419,8 +680,12 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
                   can_height=height,
                   sphere_diameter=diameter,
                   projection_image_size=screen_size,
-                  resdir=None, resfile=None, debug=debug)
-    algo.run()
+                  resdir=None, resfile=None, debug=debug, inprocess=inprocess,
+                  ff_cache=ff_cache, threads=threads)
+    try:
+        algo.run()
+    finally:
+        algo.close()
     out = algo.nrj['band0']['data']
     out['Ei'] = get_incident(out['Eabs'], materials)
 
@@ -428,7 +693,8 @@ def mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
 
 
 def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
-                      diameter, layers, height, screen_size=1536):
+                      diameter, layers, height, screen_size=1536, inprocess=False,
+                      ff_cache=None, threads=1):
     """Compute multi-chromatic illumination of triangles using mixed-radiosity model.
 
     Args:
@@ -450,6 +716,11 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         layers: vertical subdivisions of scene used for approximation of far contribution
         height: upper limit of canopy layers (scene unit)
         screen_size: (int) buffer size for projection images (pixels)
+        inprocess: (bool) run canestra in-process on numpy buffers (needs the canestra2py extension)
+                   instead of calling canestrad on temporary files
+        ff_cache: (FormFactorCache or str) a cache (or the directory of a cache) where form factors
+                  are kept across runs. If None (default), form factors are computed at each call
+        threads: (int) the number of threads projecting the light sources in canestra
 
     Returns:
        a ({band_name: {property_name:property_values} } dict of dict) with  properties:
@@ -466,11 +737,11 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
         raise ValueError('Radiosity method needs at least two primitives')
 
     opt_strings, labels = x_opt_strings_and_labels(materials, soil_reflectance)
-    can_string = triangles_string(triangles, labels)
+    scene = scene_input(triangles, labels, inprocess)
     sky_string = light_string(lights)
     pattern_str = pattern_string(domain)
 
-    caribu = Caribu(canfile=can_string,
+    caribu = Caribu(canfile=scene,
                     skyfile=sky_string,
                     optfiles=opt_strings.values(),
                     optnames=opt_strings.keys(),
@@ -481,8 +752,12 @@ def x_mixed_radiosity(triangles, materials, lights, domain, soil_reflectance,
                     can_height=height,
                     sphere_diameter=diameter,
                     projection_image_size=screen_size,
-                    resdir=None, resfile=None)
-    caribu.run()
+                    resdir=None, resfile=None, inprocess=inprocess,
+                    ff_cache=ff_cache, threads=threads)
+    try:
+        caribu.run()
+    finally:
+        caribu.close()
     out = {k: v['data'] for k, v in caribu.nrj.iteritems()}
     for band in out:
         out[band]['Ei'] = get_incident(out[band]['Eabs'], materials[band])
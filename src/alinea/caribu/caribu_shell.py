@@ -22,9 +22,15 @@
   INRA - INRIA - CIRAD
 """
 import os
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, STDOUT, PIPE
 import tempfile
 import platform
+import numpy
+from alinea.caribu import canestra_engine, sysv_shm, workdir
+from alinea.caribu.ff_cache import FormFactorCache, scene_key, ff_name
+from alinea.caribu.file_adaptor import (is_canb, is_vec0b, load_vec0b, read_exposure, read_vec0,
+                                        result_records, result_data, CanScene)
 try:
     from path import Path
 except ImportError:
@@ -76,7 +82,7 @@ def _abrev(fnc, maxlg=1):
     abreviate a text string containing a path or a file content to the first maxlg lines,
     addind '...' when the number of libnes is greater than maxlg
     """
-    if fnc is None or os.path.exists(fnc):
+    if fnc is None or not isinstance(fnc, basestring) or os.path.exists(fnc):
         return str(fnc)
     lines = fnc.splitlines()
     if maxlg <= 1:
@@ -118,12 +124,21 @@ class Caribu(object):
                  debug=False,
                  resdir="./Run",
                  resfile=None,
-                 projection_image_size=1536
+                 projection_image_size=1536,
+                 inprocess=False,
+                 transport='file',
+                 binary_result=False,
+                 processes=1,
+                 ff_cache=None,
+                 exposure=False,
+                 workdir_pool=None,
+                 threads=1
                  ):
         """
         Class fo Nested radiosity illumination on a 3D scene.
 
-        canfile: file '.can' (or file content) representing 3d scene
+        canfile: file '.can' or '.canb' (or file content) representing 3d scene, or a canestra_engine.PatchScene or a
+        file_adaptor.CanScene
         skyfile: file/file content containing all the light description
         optfiles: list of files/files contents defining optical property
         optnames: list of name to be used as keys for output dict (if None use the name of the opt files or
@@ -140,6 +155,22 @@ class Caribu(object):
         store nothing otherwise
         projection_image_size : the size (pixel) of the projection image used to compute the first order lighting
         of the scene
+        inprocess : run canestra in-process (canestra2py) on numpy buffers instead of calling canestrad
+        transport : the way the scene and results are exchanged with canestrad: 'file' (.can and Etri.vec0 files)
+        or 'shm' (SysV shared memory segments, canestrad -m option)
+        binary_result : with the 'file' transport, let canestrad write its results as a single binary file
+        (Etri.vec0b, canestrad -b option) instead of Etri.vec0 text
+        processes : the number of bands that are processed (mcsail and canestrad) concurrently, each one in its own
+        sub-directory of the working directory. Bands are processed one after the other if processes is 1 or if the
+        scene is passed in memory (inprocess or shm transport)
+        ff_cache : a ff_cache.FormFactorCache (or the path of its directory) where the form factors of radiosity runs
+        are kept across runs, or None (form factors are computed at each run)
+        exposure : let canestrad also compute the direct irradiance of triangles faces per unit energy of each light
+        source (canestrad -x option), stored in exposure_data as returned by file_adaptor.read_exposure
+        workdir_pool : a workdir.WorkdirPool providing the working directory. If None, workdir.default_pool is used
+        if set, otherwise a new temporary directory is created. The working directory is released (emptied and given
+        back to the pool, or removed) by close()
+        threads : the number of threads projecting the light sources in canestra (canestrad -j option)
         """
         if debug:
             print "\n >>>> Caribu.__init__ starts...\n"
@@ -148,6 +179,8 @@ class Caribu(object):
         # print "my_dbg = ",   self.my_dbg
         # tempdir (initialised to allow testing of  existence in del)
         self.tempdir = Path('')
+        self.workdir_pool = workdir_pool
+        self.pool = None
 
         # Input files
         self.scene = canfile
@@ -173,16 +206,40 @@ class Caribu(object):
         self.s2v_name = "s2v"
         self.ready = True
         self.img_size = projection_image_size
+        self.inprocess = inprocess
+        self.transport = transport
+        self.binary_result = binary_result
+        self.processes = processes
+        self.ff_cache = ff_cache
+        self.ff_dir = None
+        self.ff_pending = None
+        self.exposure = exposure
+        self.exposure_data = None
+        self.threads = threads
+        self.shm = None
         if debug:
             print "\n <<<< Caribu.__init__ ends...\n"
 
     def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """ Release shared memory and the working directory (kept in debug mode)"""
+        self.release_shm()
         if self.my_dbg and self.tempdir.exists():
-            print "Caribu.__del__ called, tmp dir kept: %s" % self.tempdir
-        else:
-            if self.tempdir.exists():
-                # print 'Remove tempfile %s'%self.tempdir
-                self.tempdir.rmtree()
+            print "Caribu.close called, tmp dir kept: %s" % self.tempdir
+        elif self.pool is not None:
+            self.pool.release(self.tempdir)
+        elif self.tempdir.exists():
+            self.tempdir.rmtree()
+        self.pool = None
+        self.tempdir = Path('')
 
     def __str__(self):
         s = """
@@ -197,6 +254,8 @@ class Caribu(object):
             can_height %s
             sphere_diameter %s
             form_factor %s
+            inprocess %s
+            transport %s
             ------------
             canestrad: %s
             mcsail: %s
@@ -204,7 +263,8 @@ class Caribu(object):
             s2v: %s
         """ % (_abrev(self.scene), _abrev(self.sky), ' '.join(map(str, _safe_iter(self.optnames))),
                ''.join(map(_abrev, _safe_iter(self.opticals))), self.pattern, self.infinity, self.direct,
-               self.nb_layers, self.can_height, self.sphere_diameter, self.form_factor, self.canestra_name,
+               self.nb_layers, self.can_height, self.sphere_diameter, self.form_factor, self.inprocess,
+               self.transport, self.canestra_name,
                self.sail_name, self.periodise_name, self.s2v_name)
         if self.my_dbg:
             sopt = """
@@ -243,7 +303,21 @@ class Caribu(object):
         if self.pattern == None and self.infinity:
             raise CaribuOptionError('pattern not specified => Caribu canot infinitise the scene')
 
+        if self.inprocess and not canestra_engine.is_available():
+            raise CaribuOptionError('inprocess mode needs the canestra2py extension, that is not available')
+
+        if self.threads < 1:
+            raise CaribuOptionError('threads should be at least 1')
+
+        if self.transport not in ('file', 'shm'):
+            raise CaribuOptionError("unknown transport '%s' (should be 'file' or 'shm')" % self.transport)
+        if self.transport == 'shm' and not sysv_shm.is_available():
+            raise CaribuOptionError('shm transport needs SysV shared memory, that is not available')
+
         self.form_factor = True
+        if self.ff_cache is not None and not isinstance(self.ff_cache, FormFactorCache):
+            self.ff_cache = FormFactorCache(self.ff_cache)
+        self.ff_dir = None
         # self.canestra_1st = True # Boolean that indicates the first or not times, canestra is called thus form factors computed...
 
         # nrj is a dictionary of dictionary, each containing one simulation outputs. There will be as much dictionaries as optical files given as input
@@ -266,7 +340,7 @@ class Caribu(object):
         # Working directory
         self.setup_working_dir()
 
-        # Copy the files (or file content) in the tempdir
+        # Link the files (or write file content) in the tempdir
         self.copyfiles()
 
     def init_periodise(self):
@@ -285,8 +359,14 @@ class Caribu(object):
                 if not self.tempdir.exists():
                     self.tempdir.mkdir()
             else:
-                # build a temporary directory
-                self.tempdir = Path(tempfile.mkdtemp())
+                # a previous run may still hold a working directory
+                self.close()
+                self.pool = self.workdir_pool if self.workdir_pool is not None else workdir.default_pool
+                if self.pool is not None:
+                    self.tempdir = Path(self.pool.acquire())
+                else:
+                    # build a temporary directory
+                    self.tempdir = Path(tempfile.mkdtemp())
 
             # Result directory (if specified)
             if self.resdir is not None:
@@ -300,18 +380,41 @@ class Caribu(object):
     def copyfiles(self, skip_sky=False, skip_pattern=False, skip_opt=False):
         d = self.tempdir
 
-        if os.path.exists(self.scene):
+        if isinstance(self.scene, canestra_engine.PatchScene):
+            if self.in_memory() and not self.infinity:
+                # scene stays in memory
+                self.patch_scene = self.scene
+            else:
+                fn = d / 'cscene.can'
+                fn.write_text(self.scene.can_string())
+                self.scene = Path(fn.basename())
+        elif isinstance(self.scene, CanScene):
+            if self.in_memory() and not self.infinity:
+                # scene stays in memory
+                self.patch_scene = canestra_engine.PatchScene(self.scene.triangles, self.scene.labels)
+            else:
+                fn = d / 'cscene.can'
+                self.scene.write(fn)
+                self.scene = Path(fn.basename())
+        elif os.path.exists(self.scene):
             fn = Path(self.scene)
-            fn.copy(d / fn.basename())
+            if self.infinity and is_canb(fn):
+                # periodise and s2v only read text canopy files
+                can = canestra_engine.PatchScene.from_canb(fn).can_string()
+                fn = d / 'cscene.can'
+                fn.write_text(can)
+            else:
+                workdir.link(fn, d / fn.basename())
+            self.scene = Path(fn.basename())
         else:
             fn = d / 'cscene.can'
             fn.write_text(self.scene)
-        self.scene = Path(fn.basename())
+            self.scene = Path(fn.basename())
 
         if not skip_sky:
             if os.path.exists(self.sky):
                 fn = Path(self.sky)
-                fn.copy(d / fn.basename())
+                workdir.link(fn, d / fn.basename())
             else:
                 fn = d / 'sky.light'
                 fn.write_text(self.sky)
@@ -321,7 +424,7 @@ class Caribu(object):
             if self.infinity:
                 if os.path.exists(self.pattern):
                     fn = Path(self.pattern)
-                    fn.copy(d / fn.basename())
+                    workdir.link(fn, d / fn.basename())
                 else:
                     fn = d / 'pattern.8'
                     fn.write_text(self.pattern)
@@ -335,7 +438,7 @@ class Caribu(object):
                     if os.path.exists(opt):
                         # print opt
                         fn = Path(opt)
-                        fn.copy(d / optn[i])
+                        workdir.link(fn, d / optn[i])
                     else:
                         fn = d / optn[i]
                         fn.write_text(opt)
@@ -350,38 +453,29 @@ class Caribu(object):
             - doc : the first line of filename, that contains informations on the simulation
             - data : a dictionary of vectors, each containing a column of filename
             Columns are:
-                - index (float): the polygon index
+                - index (int): the polygon index
                 - label (str): its can label
                 - area (float): its area
                 - Eabs,Ei_sup and Ei_inf (float): surfacic density (energy/s/m2) of, respectively, absorbed energy, irradiance on the adaxial side and irradiance on the abaxial side of polygons
+        filename may also be a binary result file (Etri.vec0b), that is memory-mapped rather than parsed.
         """
 
-        f = open(filename)
-        doc = f.readline()  # elimine la ligne de commentaire
-        f.readline()  # elimine la ligne de commentaire
-        idx = []
-        label = []
-        area = []
-        Eabs = []
-        Ei_sup = []
-        Ei_inf = []
-        for line in f:
-            elements = line.split()  # tu split ta chaine en fonction d'une string de separation: par defaut c'est ' ', '\t', mais tu peux faire split(','), ...
-            floats = [float(el) for el in
-                      elements]  # tu convertis toutes les strings du tableau elements en float. floats est un tableau
-            idx.append(floats[0])
-            lab = elements[1]
-            if len(lab) < 11:
-                lab = (12 - len(lab)) * '0' + lab
-            label.append(lab)
-            area.append(floats[2])
-            Eabs.append(floats[3])
-            Ei_sup.append(floats[4])
-            Ei_inf.append(floats[5])
-
-        f.close()
-        data = {'index': idx, 'label': label, 'area': area, 'Eabs': Eabs, 'Ei_sup': Ei_sup, 'Ei_inf': Ei_inf}
-        self.nrj[band_name] = {'doc': doc, 'data': data}
+        if is_vec0b(filename):
+            records = result_records(load_vec0b(filename))
+            doc = "# canestrad: Etri.vec0b (binary result)\n"
+        else:
+            doc, records = read_vec0(filename)
+        self.nrj[band_name] = {'doc': doc, 'data': result_data(records)}
+
+    def store_result_array(self, res, labels, band_name, doc=''):
+        """
+        Add a new entry to the nrj dictionnary from the (N, 6) array returned by the in-process engine.
+        The entry is organised as with store_result, labels being taken from the scene (labels) rather than
+        from canestra.
+        """
+        records = result_records(res.T)
+        labels = numpy.asarray(labels)[records['index']]
+        self.nrj[band_name] = {'doc': doc, 'data': result_data(records, labels.tolist())}
 
     def run(self):
         """
@@ -397,12 +491,22 @@ class Caribu(object):
         self.init()
         if self.infinity:
             self.periodise()
-        if self.infinity and not self.direct:
-            self.s2v()
-            for opt in self.opticals:
-                self.mcsail(opt)
-        for opt in self.opticals:
-            self.canestra(opt)
+        try:
+            if self.in_memory():
+                self.load_arrays()
+            if self.infinity and not self.direct:
+                self.s2v()
+            if self.processes > 1 and len(self.opticals) > 1 and not self.in_memory():
+                self.run_bands()
+            else:
+                if self.infinity and not self.direct:
+                    for opt in self.opticals:
+                        self.mcsail(opt)
+                for opt in self.opticals:
+                    self.canestra(opt)
+        finally:
+            self.release_shm()
+            self.store_form_factors(False)
         if self.resfile is not None:
             import pickle
             file = open(self.resfile, 'w')
@@ -418,6 +522,64 @@ class Caribu(object):
         if self.my_dbg:
             print "\n <<<< Caribu.run() ends...\n"
 
+    def run_bands(self):
+        """ Process the bands concurrently, each one in its own sub-directory of the working directory
+
+        For radiosity runs, the first band is processed alone, as it computes the form factors used by the others.
+        """
+        todo = list(self.opticals)
+        if not self.direct:
+            self.run_band(todo.pop(0))
+        pool = ThreadPool(min(self.processes, len(todo)))
+        try:
+            # mcsail and canestrad run as external processes, threads are enough to drive them
+            pool.map(self.run_band, todo)
+        finally:
+            pool.close()
+            pool.join()
+
+    def run_band(self, opt):
+        """ Run mcsail and canestrad for one band in the sub-directory optname of the working directory"""
+        optname = str(Path(opt.basename()).stripext())
+        d = self.tempdir / optname
+        if not d.exists():
+            d.mkdir()
+        inputs = [self.scene, self.sky, opt]
+        if self.infinity:
+            inputs.append(self.pattern)
+            if not self.direct:
+                inputs += ['leafarea', 'cropchar', optname + '.spec']
+        for fn in inputs:
+            if not (d / fn).exists():
+                workdir.link(self.tempdir / fn, d / fn)
+        if self.infinity and not self.direct:
+            self.mcsail(opt, d)
+        self.canestra(opt, d)
+
+    def in_memory(self):
+        """ Is the scene passed to canestra as numpy buffers (in-process engine or shared memory) ?"""
+        return self.inprocess or self.transport == 'shm'
+
+    def load_arrays(self):
+        """ Load the scene and sky as numpy buffers for the in-process engine, or in shared memory"""
+        d = self.tempdir
+        if not isinstance(self.scene, canestra_engine.PatchScene):
+            self.patch_scene = canestra_engine.PatchScene.from_file(d / self.scene)
+        if self.inprocess:
+            self.light_array = canestra_engine.read_light_array(d / self.sky)
+        else:
+            patches = self.patch_scene.patches
+            key, scene_seg, result_seg = sysv_shm.scene_segments(len(patches), patches.dtype.itemsize)
+            self.shm = (key, scene_seg, result_seg)
+            scene_seg.array(patches.dtype, patches.shape)[:] = patches
+
+    def release_shm(self):
+        """ Detach and remove the shared memory segments"""
+        if getattr(self, 'shm', None) is not None:
+            for seg in self.shm[1:]:
+                seg.close()
+            self.shm = None
+
     def run_periodise(self):
         """ Run Periodise as a standalone program
         """
@@ -463,8 +625,8 @@ class Caribu(object):
             print(">>>  s2v has not finished properly => STOP")
             raise CaribuRunError(''.join(msg))
 
-    def mcsail(self, opt):
-        d = self.tempdir
+    def mcsail(self, opt, directory=None):
+        d = self.tempdir if directory is None else directory
         optname, ext = Path(opt.basename()).splitext()
         (d / optname + '.spec').copy(d / 'spectral')
 
@@ -486,10 +648,10 @@ class Caribu(object):
             print(">>>  mcsail has not finished properly => STOP")
             raise CaribuRunError(''.join(msg))
 
-    def canestra(self, opt):
+    def canestra(self, opt, directory=None):
         """Fonction d'appel de l'executable canestrad, code C++ compilee de la radiosite mixte  - MC09"""
         # canestrad -M $Sc -8 $argv[6] -l $argv[2] -p $po.opt -e $po.env -s -r  $argv[1] -1
-        d = self.tempdir
+        d = self.tempdir if directory is None else directory
         optname, ext = Path(opt.basename()).splitext()
         if self.my_dbg:
             print optname
@@ -506,23 +668,72 @@ class Caribu(object):
             if self.form_factor:
                 # compute formfactor
                 self.form_factor = False
-                self.FF_name = tempfile.mktemp(prefix="", suffix="", dir="")
-                str_FF = " -f %s " % (self.FF_name)
+                if self.ff_cache is not None:
+                    str_FF = self.cached_form_factors()
+                else:
+                    self.FF_name = tempfile.mktemp(prefix="", suffix="", dir="")
+                    str_FF = " -f %s " % (self.FF_name)
             else:
                 str_FF = " -w " + self.FF_name
             if self.sphere_diameter >= 0:
                 str_env = " -e %s.env " % (optname)
+            if self.ff_dir is not None:
+                str_FF += " -t %s%s " % (self.ff_dir, os.sep)
+            elif d != self.tempdir:
+                # form factors are shared by the bands sub-directories
+                str_FF += " -t ../ "
 
         str_img = "-L %d" % (self.img_size)
-
-        cmd = "%s -M %s -l %s -p %s -A %s %s %s %s %s %s " % (
-            self.canestra_name, self.scene, self.sky, opt, str_pattern, str_direct, str_diam, str_FF, str_env, str_img)
+        if self.exposure and self.exposure_data is None and opt == self.opticals[0]:
+            # exposure does not depend on the band: only the first one computes (and stores) it,
+            # the others may run concurrently (run_bands)
+            str_img += " -x "
+        if self.threads > 1:
+            str_img += " -j %d " % self.threads
+
+        if self.inprocess:
+            self.canestra_inprocess(optname, ' '.join([opt, str_pattern, str_direct, str_diam, str_FF, str_env,
+                                                       str_img]))
+            return
+
+        if self.transport == 'shm':
+            key = sysv_shm.canestra_key(self.shm[0], len(self.patch_scene))
+            str_scene = "-m %d" % key
+        else:
+            str_scene = "-M %s" % self.scene
+        str_bin = ""
+        if self.binary_result and self.transport == 'file':
+            str_bin = " -b "
+        cmd = "%s %s -l %s -p %s -A %s %s %s %s %s %s %s " % (
+            self.canestra_name, str_scene, self.sky, opt, str_pattern, str_direct, str_diam, str_FF, str_env, str_img,
+            str_bin)
         if self.my_dbg:
             print(">>> Canestrad(): %s" % (cmd))
-        status = _process(cmd, self.tempdir, d / "nr.log")
+        status = _process(cmd, d, d / "nr.log")
+        self.store_form_factors(status == 0)
+        self.store_exposure(d)
 
         ficres = d / 'Etri.vec0'
-        if ficres.exists():
+        if str_bin:
+            ficres = d / 'Etri.vec0b'
+        if self.transport == 'shm':
+            if status != 0:
+                f = open(d / "nr.log")
+                msg = f.readlines()
+                f.close()
+                print(">>>  canestra has not finished properly => STOP")
+                raise CaribuRunError(''.join(msg))
+            res = self.shm_result()
+            doc = "# canestrad: shm=%d opt=%s light=%s\n" % (key, opt, self.sky)
+            self.store_result_array(res, self.patch_scene.labels, str(optname), doc)
+            if self.resdir is not None:
+                self.write_result_array(res, optname, doc)
+        elif ficres.exists() and str_bin:
+            self.store_result(ficres, str(optname))
+            if self.resdir is not None:
+                self.write_result_array(load_vec0b(ficres).T, optname, self.nrj[optname]['doc'])
+            ficres.remove()
+        elif ficres.exists():
             self.store_result(ficres, str(optname))
 
             if self.resdir is not None:
@@ -547,6 +758,100 @@ class Caribu(object):
             print ">>> caribu.py: Caribu::canestra (%s) finished !" % (optname)
 
 
+    def canestra_inprocess(self, optname, options):
+        """ Run canestra in-process on the scene and sky numpy buffers"""
+        d = self.tempdir
+        args = ['-p'] + options.split() + ['-A']
+        if self.my_dbg:
+            print(">>> Canestra(inprocess): %s" % (' '.join(args)))
+        status, res = canestra_engine.run(args, self.patch_scene.patches, self.light_array, d)
+        self.store_form_factors(status == 0 and len(res) > 0)
+        self.store_exposure(d)
+        if status != 0 or len(res) == 0:
+            msg = ''
+            if (d / 'canestra.log').exists():
+                msg = (d / 'canestra.log').text()
+            print(">>>  canestra has not finished properly => STOP")
+            raise CaribuRunError(msg)
+        doc = "# canestra2py: opt=%s.opt : %s\n" % (optname, options)
+        self.store_result_array(res, self.patch_scene.labels, str(optname), doc)
+
+        if self.resdir is not None:
+            self.write_result_array(res, optname, doc)
+
+    def cached_form_factors(self):
+        """ Look for the form factors of the scene in ff_cache
+
+        Returns:
+            the canestrad option reading them (-w) if they are cached, or computing them (-f) in a reserved
+            directory of the cache otherwise
+        """
+        d = self.tempdir
+        if self.in_memory():
+            patches = self.patch_scene.patches
+        else:
+            patches = canestra_engine.PatchScene.from_file(d / self.scene).patches
+        pattern = None
+        parameters = dict(sphere_diameter=self.sphere_diameter, infinity=self.infinity)
+        if self.infinity:
+            pattern = (d / self.pattern).text()
+            parameters.update(nb_layers=self.nb_layers, can_height=self.can_height)
+        key = scene_key(patches, pattern, **parameters)
+        self.FF_name = ff_name
+        self.ff_dir = self.ff_cache.lookup(key)
+        if self.ff_dir is not None:
+            return " -w %s " % self.FF_name
+        self.ff_pending = key
+        self.ff_dir = self.ff_cache.reserve(key)
+        return " -f %s " % self.FF_name
+
+    def store_form_factors(self, ok):
+        """ Commit (if ok) or discard the form factors computed in a reserved directory of ff_cache"""
+        if self.ff_pending is None:
+            return
+        key, self.ff_pending = self.ff_pending, None
+        if ok:
+            self.ff_dir = self.ff_cache.commit(key, self.ff_dir)
+        else:
+            self.ff_cache.discard(self.ff_dir)
+            self.ff_dir = None
+
+    def store_exposure(self, directory):
+        """ Load the exposure matrix written by canestrad -x in directory"""
+        fn = directory / 'Exposure.mat'
+        if self.exposure and self.exposure_data is None and fn.exists():
+            self.exposure_data = read_exposure(fn)
+            fn.remove()
+
+    def shm_result(self):
+        """ Convert the canestrad shared memory result block into a (N, 6) array with the columns of Etri.vec0
+        """
+        n = len(self.patch_scene)
+        te = self.shm[2].array('f8', (3, n))
+        area = canestra_engine.patch_area(self.patch_scene.patches)
+        res = numpy.empty((n, 6))
+        res[:, 0] = numpy.arange(n)
+        res[:, 1] = 0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            res[:, 3] = te[0] / area
+            res[:, 4] = te[1] / area
+            # canestrad stores -area for the lower face of opaque triangles
+            res[:, 5] = numpy.where(self.patch_scene.patches['t'] <= 0, -1, te[2] / area)
+        # rejected triangles
+        res[:, 2] = numpy.where(numpy.isnan(te[0]), 0, area)
+        res[numpy.isnan(te[0]), 5] = numpy.nan
+        return res
+
+    def write_result_array(self, res, optname, doc):
+        """ Write a (N, 6) result array in resdir, as canestrad does with Etri.vec0"""
+        fdest = self.resdir / Path(optname + ".vec")
+        with open(fdest, 'w') as f:
+            f.write(doc)
+            f.write("# No Label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n")
+            for row, label in zip(res, self.nrj[optname]['data']['label']):
+                f.write("%d %s %f  %f  %f %f\n" % (row[0], label, row[2], row[3], row[4], row[5]))
+
+
 def vcaribu(canopy, lightsource, optics, pattern, options):
     """
     low level interface to Caribu class call
@@ -564,6 +869,7 @@ def vcaribu(canopy, lightsource, optics, pattern, options):
                  for output dict (if None use the name of the opt files
                  or the generic names band0,band1 if optfiles are given
                  as content)
+         processes: number of bands processed concurrently
     """
 
     sim = Caribu(resdir=None, resfile=None)  # no output on disk
@@ -601,8 +907,14 @@ def vcaribu(canopy, lightsource, optics, pattern, options):
         # size of the projection image for first order
         if 'projection_image_size' in options.keys():
             sim.img_size = options['projection_image_size']
+        # number of bands processed concurrently
+        if 'processes' in options.keys():
+            sim.processes = options['processes']
     status = str(sim)
-    sim.run()
+    try:
+        sim.run()
+    finally:
+        sim.close()
     irradiances = sim.nrj
 
     # return outputs
@@ -616,7 +928,10 @@ def vperiodise(canopy, pattern):
     sim.scene = canopy
     # --pattern
     sim.pattern = pattern
-    periodic_scene = sim.run_periodise()
+    try:
+        periodic_scene = sim.run_periodise()
+    finally:
+        sim.close()
 
     return periodic_scene
 
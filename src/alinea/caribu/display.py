@@ -25,6 +25,7 @@ except ImportError:
 
 import openalea.plantgl.all as pgl
 from alinea.caribu.colormap import ColorMap
+from alinea.caribu.scene_store import as_mesh
 
 
 def nan_to_zero(values):
@@ -73,12 +74,23 @@ def jet_colors(values, minval=None, maxval=None):
     return map(lambda x: cmap(x, minval, maxval, 250., 20.), values)
 
 
+def _triangle_set(primitive, colors):
+    """ A plantGL TriangleSet, colored per face, of a primitive given as a list of triangles or as a mesh"""
+    mesh = as_mesh(primitive)
+    shape = pgl.TriangleSet(pgl.Point3Array([pgl.Vector3(*p) for p in mesh.points.tolist()]),
+                            pgl.Index3Array([pgl.Index3(*i) for i in mesh.indices.tolist()]))
+    shape.colorList = pgl.Color4Array([pgl.Color4(r, g, b, 0) for r, g, b in colors])
+    shape.colorPerVertex = False
+    return shape
+
+
 def generate_scene(triangle_scene, colors=None, soil=None, soil_colors=None):
     """ Build a colored PlantGL scene
 
     Args:
         triangle_scene: (dict of list of list of tuples) a {primitive_id: [triangles, ]} dict,
                 each triangle being defined by an ordered triplet of 3-tuple points coordinates.
+                Primitives can also be given as indexed meshes (see scene_store.as_mesh)
         colors: (dict of list of tuples) : a {primitive_id: [colors,]} dict
                 defining colors of primitives in the scene. A color is a (r, g, b) tuple.
         soil: (list of triangles) : a list of triangles of the soil
@@ -92,42 +104,22 @@ def generate_scene(triangle_scene, colors=None, soil=None, soil_colors=None):
     scene = pgl.Scene()
 
     if colors is None:
-        colors = {k: [plant_color] * len(triangle_scene[k]) for k in triangle_scene}
+        colors = {k: [plant_color] * len(as_mesh(triangle_scene[k])) for k in triangle_scene}
     else:
         if len(triangle_scene) != len(colors):
             raise ValueError('length of triangle_scene and of color should match')
 
     for k, triangles in triangle_scene.iteritems():
-        shape = pgl.TriangleSet([], [])
-        shape.colorList = []
-        shape.colorPerVertex = False
+        shape = _triangle_set(triangles, colors[k])
         shape.id = k
-        for i, triangle in enumerate(triangles):
-            shape.pointList.append(pgl.Vector3(triangle[0]))
-            shape.pointList.append(pgl.Vector3(triangle[1]))
-            shape.pointList.append(pgl.Vector3(triangle[2]))
-            shape.indexList.append(pgl.Index3(3 * i, 3 * i + 1, 3 * i + 2))
-            r, g, b = colors[k][i]
-            shape.colorList.append(pgl.Color4(r, g, b, 0))
-
         scene += shape
 
     if soil is not None:
         if soil_colors is None:
             soil_colors = [soil_color] * len(soil)
         sid = max([sh.id for sh in scene])
-        shape = pgl.TriangleSet([], [])
-        shape.colorList = []
-        shape.colorPerVertex = False
+        shape = _triangle_set(soil, soil_colors)
         shape.id = sid
-        for i, triangle in enumerate(soil):
-            shape.pointList.append(pgl.Vector3(triangle[0]))
-            shape.pointList.append(pgl.Vector3(triangle[1]))
-            shape.pointList.append(pgl.Vector3(triangle[2]))
-            shape.indexList.append(pgl.Index3(3 * i, 3 * i + 1, 3 * i + 2))
-            r, g, b = soil_colors[i]
-            shape.colorList.append(pgl.Color4(r, g, b, 0))
-
         scene += shape
 
 
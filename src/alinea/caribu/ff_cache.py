@@ -0,0 +1,142 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" Persistent, content-addressed cache of canestra form factor matrices
+
+canestrad -f name stores the form factors (and far contribution coefficients) of a
+scene in the files diag_name, nz_name and Bfar_name of the -t directory, that
+canestrad -w name reads back. The cache keeps these files in one directory per
+scene, keyed by a hash of the geometry, the optical type (opaque, translucent or
+soil) of the triangles, the pattern and the radiosity parameters, and evicts the
+least recently used entries when its size exceeds a bound.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy
+
+ff_name = 'ff'
+
+# canestrad stores the matrices path in char[128] buffers
+_max_path = 100
+
+
+def default_root():
+    """ The cache directory used if none is given ($CARIBU_FF_CACHE or ~/.caribu/ff_cache)"""
+    root = os.environ.get('CARIBU_FF_CACHE')
+    if root is None:
+        root = os.path.join(os.path.expanduser('~'), '.caribu', 'ff_cache')
+    return root
+
+
+def scene_key(patches, pattern=None, **parameters):
+    """ Hash a scene and the parameters of the form factor computation
+
+    Args:
+        patches: (numpy array) the scene as a canestra_engine.patch_dtype array
+        pattern: (str) the content of the pattern file, if the scene is infinitised
+        parameters: (float or int) parameters of the computation (sphere diameter, layers, ...)
+
+    Returns:
+        (str) an hexadecimal digest
+    """
+    sha = hashlib.sha1()
+    sha.update(numpy.ascontiguousarray(patches['P'], dtype=numpy.float32).tobytes())
+    # form factors depend on the optical type of the triangles, not on their optical properties
+    sha.update(numpy.sign(patches['t']).astype(numpy.int8).tobytes())
+    sha.update(repr(pattern))
+    sha.update(repr(sorted(parameters.items())))
+    return sha.hexdigest()
+
+
+def _size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class FormFactorCache(object):
+    """ A size-bounded (LRU) directory of canestra form factor matrices
+    """
+
+    def __init__(self, root=None, max_size=2 * 1024 ** 3):
+        """ Args:
+            root: (str) the cache directory. If None, default_root() is used
+            max_size: (int) the maximal size (bytes) of the cache
+        """
+        if root is None:
+            root = default_root()
+        self.root = os.path.abspath(root)
+        self.max_size = max_size
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        if len(os.path.join(self.root, 'x' * 40, 'Bfar_' + ff_name)) > _max_path:
+            raise ValueError('form factor cache path is too long for canestrad: %s' % self.root)
+
+    def __str__(self):
+        return 'FormFactorCache(%s, %d entries)' % (self.root, len(self.entries()))
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def entries(self):
+        """ The (key, path) of the complete entries of the cache"""
+        return [(k, self.path(k)) for k in os.listdir(self.root) if '.' not in k]
+
+    def lookup(self, key):
+        """ The directory holding the form factors of key (marked as recently used), or None"""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        now = time.time()
+        os.utime(path, (now, now))
+        return path
+
+    def reserve(self, key):
+        """ A private directory where canestrad can compute the form factors of key"""
+        return tempfile.mkdtemp(prefix=key + '.', dir=self.root)
+
+    def commit(self, key, tmpdir):
+        """ Store the form factors computed in tmpdir as the entry of key
+
+        Returns:
+            the directory holding the form factors of key
+        """
+        path = self.path(key)
+        try:
+            os.rename(tmpdir, path)
+        except OSError:
+            # already stored (concurrent run)
+            self.discard(tmpdir)
+        self.evict(keep=key)
+        return self.lookup(key)
+
+    def discard(self, tmpdir):
+        """ Remove a reserved directory"""
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def evict(self, keep=None):
+        """ Remove the least recently used entries until the cache fits in max_size"""
+        entries = [(os.path.getmtime(p), _size(p), k, p) for k, p in self.entries()]
+        total = sum(e[1] for e in entries)
+        for mtime, size, key, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Remove all entries"""
+        for key, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -12,7 +12,41 @@
 """ Adaptors for historical caribu input files
 """
 
-from alinea.caribu.label import Label
+import numpy
+
+from alinea.caribu.label import decode, label_strings
+from alinea.caribu.scene_store import IndexedMesh
+
+# number of triangles formatted at once when writing *.can files
+can_chunk_size = 16384
+
+# binary canopy file (*.canb): a 24 bytes header, a (n, 3, 3) float32 or float64
+# block of vertices padded to a multiple of 8 bytes, and a block of n int64 labels.
+# Labels are stored as int64, as can labels (up to 12 digits) overflow int32.
+canb_magic = 'CANB'
+canb_version = 1
+canb_header = numpy.dtype([('magic', 'S4'), ('version', '<u4'), ('float_size', '<u4'),
+                           ('reserved', '<u4'), ('n', '<u8')])
+
+# binary result file written by canestrad -b (Etri.vec0b): a 24 bytes header and the
+# ncol float64 columns of Etri.vec0 (No, label, area, Eabs, Ei_sup, Ei_inf), one after the other.
+vec0b_magic = 'ETRI'
+vec0b_version = 1
+vec0b_header = numpy.dtype([('magic', 'S4'), ('version', '<u4'), ('ncol', '<u4'),
+                            ('reserved', '<u4'), ('n', '<u8')])
+
+# canestra results, one record per triangle of the input scene (rejected triangles
+# have a null area and NaN irradiances)
+result_dtype = numpy.dtype([('index', '<i8'), ('label', '<i8'), ('area', '<f8'), ('Eabs', '<f8'),
+                            ('Ei_sup', '<f8'), ('Ei_inf', '<f8')])
+
+# exposure matrix written by canestrad -x (Exposure.mat): a 32 bytes header, nsrc float64
+# (E, vx, vy, vz) light sources and a (nsrc, 2, ntri) float32 block of the direct irradiance
+# of the upper and lower face of triangles per unit source energy.
+exposure_magic = 'EXPO'
+exposure_version = 1
+exposure_header = numpy.dtype([('magic', 'S4'), ('version', '<u4'), ('nface', '<u4'),
+                               ('reserved', '<u4'), ('nsrc', '<u8'), ('ntri', '<u8')])
 
 
 def read_light(file_path):
@@ -123,6 +157,300 @@ def read_can(file_path):
     return cscene
 
 
+def is_canb(file_path):
+    """Test if file_path is a binary canopy (*.canb) file"""
+    try:
+        with open(file_path, 'rb') as infile:
+            return infile.read(4) == canb_magic
+    except IOError:
+        return False
+
+
+def _vertices(triangles):
+    """ A (n, 3, 3) float64 array of triangles vertices (triangles may be lists of iterables),
+    or triangles if given as an IndexedMesh"""
+    if isinstance(triangles, IndexedMesh):
+        return triangles
+    if not isinstance(triangles, numpy.ndarray):
+        triangles = [tuple(tri) for tri in triangles]
+    return numpy.asarray(triangles, dtype=numpy.float64).reshape((-1, 3, 3))
+
+
+def can_chunks(triangles, labels, chunk_size=can_chunk_size):
+    """Format triangles as *.can file content, by chunks
+
+    Each chunk is formatted by a single string formatting operation on the coordinates
+    of chunk_size triangles. Triangles given as an IndexedMesh are expanded chunk by chunk.
+
+    Args:
+        triangles: (array-like) a (n, 3, 3) array (or list of list of tuples, or IndexedMesh) of triangles vertices
+        labels: (list of str or int64 array) the n can labels of the triangles
+        chunk_size: (int) the number of triangles per chunk
+
+    Returns:
+        a generator of strings
+    """
+
+    vertices = _vertices(triangles)
+    if len(vertices) != len(labels):
+        raise ValueError('The number of triangles and labels should match')
+    line = 'p 1 %s 3' + ' %.6f' * 9 + '\n'
+    for start in range(0, len(vertices), chunk_size):
+        chunk = vertices[start:start + chunk_size].reshape((-1, 9))
+        rows = numpy.empty((len(chunk), 10), dtype=object)
+        chunk_labels = labels[start:start + chunk_size]
+        if isinstance(chunk_labels, numpy.ndarray) and chunk_labels.dtype.kind in 'iu':
+            rows[:, 0] = label_strings(chunk_labels)
+        else:
+            rows[:, 0] = [str(lab) for lab in chunk_labels]
+        rows[:, 1:] = chunk
+        yield (line * len(chunk)) % tuple(rows.ravel().tolist())
+
+
+def write_can(file_path, triangles, labels, chunk_size=can_chunk_size):
+    """Writer for *.can file format, streaming triangles by chunks
+
+    Args:
+        file_path: (str or file) a path to the file, or a file object open for writing
+        triangles: (array-like) a (n, 3, 3) array (or list of list of tuples) of triangles vertices
+        labels: (list of str or int64 array) the n can labels of the triangles
+        chunk_size: (int) the number of triangles formatted at once
+    """
+
+    if hasattr(file_path, 'write'):
+        for chunk in can_chunks(triangles, labels, chunk_size):
+            file_path.write(chunk)
+    else:
+        with open(file_path, 'w') as outfile:
+            write_can(outfile, triangles, labels, chunk_size)
+
+
+class CanScene(object):
+    """ A caribu scene made of triangles and can labels, written as a *.can file when needed
+    """
+
+    def __init__(self, triangles, labels):
+        self.triangles = _vertices(triangles)
+        self.labels = labels
+        if len(self.triangles) != len(self.labels):
+            raise ValueError('The number of triangles and labels should match')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __str__(self):
+        return 'CanScene (%d triangles)' % len(self)
+
+    def write(self, file_path, chunk_size=can_chunk_size):
+        """ write the scene as a *.can file"""
+        write_can(file_path, self.triangles, self.labels, chunk_size)
+
+    def can_string(self):
+        """ format the scene as caribu canopy string content"""
+        return ''.join(can_chunks(self.triangles, self.labels))
+
+
+def write_canb(file_path, triangles, labels, dtype='f4'):
+    """Writer for *.canb (binary canopy) file format used by canestra
+
+    Args:
+        file_path: (str) a path to the file
+        triangles: (array-like) a (n, 3, 3) array (or list of list of tuples) of triangles vertices
+        labels: (list of str or int) the n can labels of the triangles
+        dtype: (str) 'f4' or 'f8', the precision of vertices coordinates
+    """
+
+    dtype = numpy.dtype(dtype).newbyteorder('<')
+    if dtype.itemsize not in (4, 8):
+        raise ValueError('canb vertices should be float32 or float64')
+    vertices = numpy.asarray(triangles, dtype=dtype).reshape((-1, 3, 3))
+    labels = numpy.asarray([int(lab) for lab in labels], dtype='<i8')
+    if len(vertices) != len(labels):
+        raise ValueError('The number of triangles and labels should match')
+    header = numpy.zeros(1, dtype=canb_header)
+    header['magic'] = canb_magic
+    header['version'] = canb_version
+    header['float_size'] = dtype.itemsize
+    header['n'] = len(labels)
+    with open(file_path, 'wb') as outfile:
+        outfile.write(header.tobytes())
+        outfile.write(vertices.tobytes())
+        outfile.write('\0' * (-vertices.nbytes % 8))
+        outfile.write(labels.tobytes())
+
+
+def load_canb(file_path):
+    """Memory-map a *.canb (binary canopy) file
+
+    Args:
+        file_path: (str) a path to the file
+
+    Returns:
+        - vertices: a read-only (n, 3, 3) array (memmap) of triangles vertices
+        - labels: a read-only (n,) int64 array (memmap) of can labels
+    """
+
+    header = numpy.fromfile(file_path, dtype=canb_header, count=1)
+    if len(header) == 0 or header['magic'][0] != canb_magic:
+        raise ValueError('%s is not a canb file' % file_path)
+    if header['version'][0] != canb_version:
+        raise ValueError('unsupported canb version: %d' % header['version'][0])
+    n = int(header['n'][0])
+    fsize = int(header['float_size'][0])
+    if n == 0:
+        return numpy.zeros((0, 3, 3), dtype='<f%d' % fsize), numpy.zeros(0, dtype='<i8')
+    offset = canb_header.itemsize
+    vertices = numpy.memmap(file_path, dtype='<f%d' % fsize, mode='r', offset=offset,
+                            shape=(n, 3, 3))
+    offset += (n * 9 * fsize + 7) // 8 * 8
+    labels = numpy.memmap(file_path, dtype='<i8', mode='r', offset=offset, shape=(n,))
+    return vertices, labels
+
+
+def is_vec0b(file_path):
+    """Test if file_path is a binary canestra result (Etri.vec0b) file"""
+    try:
+        with open(file_path, 'rb') as infile:
+            return infile.read(4) == vec0b_magic
+    except IOError:
+        return False
+
+
+def load_vec0b(file_path):
+    """Memory-map a binary canestra result (Etri.vec0b) file
+
+    Args:
+        file_path: (str) a path to the file
+
+    Returns:
+        a read-only (ncol, n) float64 array (memmap) holding the columns of Etri.vec0
+    """
+
+    header = numpy.fromfile(file_path, dtype=vec0b_header, count=1)
+    if len(header) == 0 or header['magic'][0] != vec0b_magic:
+        raise ValueError('%s is not a binary canestra result file' % file_path)
+    if header['version'][0] != vec0b_version:
+        raise ValueError('unsupported Etri.vec0b version: %d' % header['version'][0])
+    n = int(header['n'][0])
+    ncol = int(header['ncol'][0])
+    if n == 0:
+        return numpy.zeros((ncol, 0), dtype='<f8')
+    return numpy.memmap(file_path, dtype='<f8', mode='r', offset=vec0b_header.itemsize,
+                        shape=(ncol, n))
+
+
+def result_records(columns):
+    """Convert the columns of Etri.vec0 into a result array
+
+    Args:
+        columns: (array-like) a (6, n) array holding the columns of Etri.vec0
+
+    Returns:
+        a (n,) numpy array with result_dtype
+    """
+    columns = numpy.asarray(columns, dtype=numpy.float64).reshape((len(result_dtype.names), -1))
+    records = numpy.empty(columns.shape[1], dtype=result_dtype)
+    for name, col in zip(result_dtype.names, columns):
+        records[name] = col
+    return records
+
+
+def read_vec0(file_path):
+    """Reader for the canestra result (Etri.vec0) text file
+
+    Args:
+        file_path: (str) a path to the file
+
+    Returns:
+        - doc: (str) the first line of the file, that documents the simulation
+        - records: a (n,) numpy array with result_dtype
+    """
+
+    with open(file_path) as infile:
+        doc = infile.readline()
+        infile.readline()
+        values = numpy.fromstring(infile.read(), dtype=numpy.float64, sep=' ')
+    ncol = len(result_dtype.names)
+    if len(values) % ncol != 0:
+        raise ValueError('%s is not a valid canestra result file' % file_path)
+    return doc, result_records(values.reshape((-1, ncol)).T)
+
+
+def format_labels(labels):
+    """Format int64 can labels as strings, padding them to 12 digits if they have less than 11"""
+    labels = numpy.asarray(labels, dtype=numpy.int64)
+    return numpy.where(labels < 10 ** 10, numpy.char.mod('%012d', labels), labels.astype('S')).tolist()
+
+
+def result_data(records, labels=None):
+    """Convert a canestra result array into a dict of lists
+
+    Args:
+        records: a (n,) numpy array with result_dtype
+        labels: (list of str) labels to use instead of the formatted label column
+
+    Returns:
+        a {column: list} dict, with the fields of result_dtype as keys (labels as strings)
+    """
+    data = dict((name, records[name].tolist()) for name in records.dtype.names)
+    if labels is None:
+        data['label'] = format_labels(records['label'])
+    else:
+        data['label'] = list(labels)
+    return data
+
+
+def read_exposure(file_path):
+    """Reader for the exposure matrix (Exposure.mat) written by canestrad -x
+
+    Args:
+        file_path: (str) a path to the file
+
+    Returns:
+        - lights: a (nsrc, 4) float64 array of (Energy, vx, vy, vz) light sources
+        - exposure: a (nsrc, 2, ntri) float32 array of the direct irradiance of the upper (exposure[:, 0])
+          and lower (exposure[:, 1]) face of triangles per unit energy of each source.
+          Triangles rejected by canestra hold NaN.
+    """
+
+    header = numpy.fromfile(file_path, dtype=exposure_header, count=1)
+    if len(header) == 0 or header['magic'][0] != exposure_magic:
+        raise ValueError('%s is not an exposure matrix file' % file_path)
+    if header['version'][0] != exposure_version:
+        raise ValueError('unsupported Exposure.mat version: %d' % header['version'][0])
+    nsrc = int(header['nsrc'][0])
+    nface = int(header['nface'][0])
+    ntri = int(header['ntri'][0])
+    with open(file_path, 'rb') as infile:
+        infile.seek(exposure_header.itemsize)
+        lights = numpy.fromfile(infile, dtype='<f8', count=4 * nsrc).reshape((nsrc, 4))
+        exposure = numpy.fromfile(infile, dtype='<f4', count=nsrc * nface * ntri)
+    return lights, exposure.reshape((nsrc, nface, ntri))
+
+
+def read_canb(file_path):
+    """Reader for *.canb (binary canopy) file format used by canestra
+
+    Args:
+        file_path: (str) a path to the file
+
+    Returns:
+        a {label: [triangles,]} dict of list of list of tuple, as read_can does.
+            - label (str): the barcode associated to a primitive
+            - triangles (list of tuple) an ordered triplet of 3-tuple points coordinates.
+    """
+
+    vertices, labels = load_canb(file_path)
+    cscene = {}
+    for label, tri in zip(labels, vertices.tolist()):
+        label = '%012d' % label
+        if label not in cscene:
+            cscene[label] = []
+        cscene[label].append(map(tuple, tri))
+
+    return cscene
+
+
 def build_materials(labels, opticals, soil_reflectance):
     """build a list of material from a list of labels and a dict of optical properties
 
@@ -143,18 +471,19 @@ def build_materials(labels, opticals, soil_reflectance):
     """
 
     materials = {}
-    for label in labels:
-        if label not in materials:
-            lab = Label(label)
-            opt_id = lab.optical_id
-            if lab.is_stem():
-                materials[label] = (opticals[opt_id][0],)
-            elif lab.is_soil():
-                materials[label] = (soil_reflectance,)
+    labels = list(set(labels))
+    if len(labels) == 0:
+        return materials
+    optical_ids, plant_ids, leaf_ids, elt_ids = decode(labels)
+    for label, opt_id, leaf_id in zip(labels, optical_ids.tolist(), leaf_ids.tolist()):
+        if leaf_id == 0 and opt_id != 0:  # stem
+            materials[label] = (opticals[opt_id][0],)
+        elif leaf_id == 0:  # soil
+            materials[label] = (soil_reflectance,)
+        else:
+            rinf, tinf, rsup, tsup = opticals[opt_id][1:]
+            if rinf == rsup and tinf == tsup:
+                materials[label] = (rinf, tinf)
             else:
-                rinf, tinf, rsup, tsup = opticals[opt_id][1:]
-                if rinf == rsup and tinf == tsup:
-                    materials[label] = (rinf, tinf)
-                else:
-                    materials[label] = (rinf, tinf, rsup, tsup)
+                materials[label] = (rinf, tinf, rsup, tsup)
     return materials
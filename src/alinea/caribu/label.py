@@ -11,7 +11,17 @@
 # ==============================================================================
 """
 Labels for the canestra file management.
+
+A can label is a 12 digits barcode: optical_id (1 digit, or more), plant_id (5),
+leaf_id (3, non null for translucent elements) and elt_id (3). Besides the Label
+class, that manipulates one label string, the module provides array functions
+encoding and decoding labels as int64 numbers with integer arithmetic.
 """
+import numpy
+
+_plant_factor = 10 ** 6
+_leaf_factor = 10 ** 3
+_optical_factor = 10 ** 11
 
 
 class Label(object):
@@ -104,6 +114,50 @@ class Label(object):
     elt_id = property(_get_elt_id, _set_elt_id)
 
 
+def label_array(labels):
+    """ Convert can labels (strings or numbers) into an int64 array"""
+    return numpy.asarray(labels).astype(numpy.int64)
+
+
+def label_strings(labels):
+    """ Format int64 can labels as 12 digits strings"""
+    labels = numpy.asarray(labels, dtype=numpy.int64)
+    return numpy.char.mod('%012d', labels).tolist()
+
+
+def encode(optical_id=1, plant_id=1, leaf_id=0, elt_id=1):
+    """ Encode ids into can labels (the inverse of decode)
+
+    Args:
+        optical_id, plant_id, leaf_id, elt_id: (int or array-like of int) ids columns,
+            broadcasted against each other
+
+    Returns:
+        an int64 array of can labels
+    """
+    optical_id, plant_id, leaf_id, elt_id = numpy.broadcast_arrays(
+        *[numpy.asarray(x, dtype=numpy.int64) for x in (optical_id, plant_id, leaf_id, elt_id)])
+    for name, ids, maxval in (('optical', optical_id, 10 ** 7), ('plant', plant_id, 10 ** 5),
+                              ('leaf', leaf_id, 10 ** 3), ('element', elt_id, 10 ** 3)):
+        if ids.size > 0 and (ids.min() < 0 or ids.max() >= maxval):
+            raise ValueError('Unable to encode %s ids outside [0, %d[' % (name, maxval))
+    return optical_id * _optical_factor + plant_id * _plant_factor + leaf_id * _leaf_factor + elt_id
+
+
+def decode(labels):
+    """ Decode can labels into ids
+
+    Args:
+        labels: (array-like of str or int) can labels
+
+    Returns:
+        optical_id, plant_id, leaf_id, elt_id int64 arrays, in the order of the arguments of encode
+    """
+    labels = label_array(labels)
+    return (labels // _optical_factor, labels // _plant_factor % 10 ** 5,
+            labels // _leaf_factor % 10 ** 3, labels % 10 ** 3)
+
+
 def _complete(l, length):
     if len(l) < length:
         l = l * (length / len(l)) + [l[i] for i in range(length % len(l))]
@@ -141,23 +195,12 @@ def encode_label(opt_id=1, opak=0, plant_id=1, elt_id=1, minlength=1):
     
     """
 
-    if not isinstance(opt_id, list):
-        opt_id = [opt_id]
-
-    if not isinstance(opak, list):
-        opak = [opak]
-
-    if not isinstance(plant_id, list):
-        plant_id = [plant_id]
-
-    if not isinstance(elt_id, list):
-        elt_id = [elt_id]
-
-    maxlen = max([max(map(len, [opt_id, opak, plant_id, elt_id])), minlength])
-
-    opt_id, opak, plant_id, elt_id = map(lambda (x): _complete(x, maxlen), [opt_id, opak, plant_id, elt_id])
+    columns = [x if isinstance(x, list) else [x] for x in (opt_id, opak, plant_id, elt_id)]
+    maxlen = max([max(map(len, columns)), minlength])
+    # numpy.resize re-cycles the values
+    opt_id, opak, plant_id, elt_id = [numpy.resize(numpy.asarray(x, dtype=numpy.int64), maxlen) for x in columns]
 
-    return [canlabel_string(opt_id[i], opak[i], plant_id[i], elt_id[i]) for i in range(maxlen)]
+    return label_strings(encode(opt_id, plant_id, opak, elt_id))
 
 
 def decode_label(label):
@@ -165,8 +208,10 @@ def decode_label(label):
 
     if not isinstance(label, list):
         label = [label]
+    if len(label) == 0:
+        return []
 
-    properties = [(lab.optical_id, lab.transparency, lab.plant_id, lab.elt_id) for lab in
-                  (Label(labstring) for labstring in label)]
+    optical_id, plant_id, leaf_id, elt_id = decode(label)
+    transparency = (leaf_id != 0).astype(numpy.int64)
 
-    return zip(*properties)
+    return [tuple(x.tolist()) for x in (optical_id, transparency, plant_id, elt_id)]
@@ -10,61 +10,282 @@
 #
 # ==============================================================================
 """ Adaptor for PlantGL object and derived
+
+Geometries are tessellated into indexed meshes, i.e. a (n, 3) array of points
+and a (m, 3) array of the indices of the points of the triangles. Meshes can be
+kept in a TessellationCache (LRU), so that geometries unchanged between calls,
+or shared by several shapes, are tessellated once, and independent geometries
+can be tessellated in a pool of processes.
+
+Geometries are cached by the id of their plantGL object: a cached geometry
+modified in place (e.g. the cylinder of a growing organ) keeps its former mesh
+until it is discarded from the cache.
 """
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+
 import numpy
 import openalea.plantgl.all as pgl
 
+# cache used when none is given (None: no caching)
+default_cache = None
+
+
+def set_default_cache(cache):
+    """ Set the TessellationCache used by default (None to disable caching)
+
+    Returns:
+        the previous default cache
+    """
+    global default_cache
+    previous, default_cache = default_cache, cache
+    return previous
+
+
+def _geometry(pgl_object):
+    if isinstance(pgl_object, pgl.Shape):
+        return pgl_object.geometry
+    return pgl_object
+
+
+def geometry_key(pgl_object):
+    """ The key of a plantGL object in a TessellationCache
+
+    Objects are keyed by the id of their C++ object (shapes by the one of their geometry), that,
+    unlike the python wrappers, persists across accesses: objects modified in place should be
+    discarded from the cache (see TessellationCache.discard), or replaced by new objects.
+    """
+    pgl_object = _geometry(pgl_object)
+    get_id = getattr(pgl_object, 'getId', None) or pgl_object.getObjectId
+    return get_id()
+
+
+class TessellationCache(object):
+    """ A least recently used cache of the meshes of plantGL objects
+    """
+
+    def __init__(self, maxsize=4096):
+        """ Args:
+            maxsize: (int) the maximal number of meshes kept
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __str__(self):
+        return 'TessellationCache(%d meshes, %d hits, %d misses)' % (len(self), self.hits, self.misses)
+
+    def get(self, key, pgl_object):
+        """ The (points, indices) mesh cached for pgl_object, or None"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, pgl_object, mesh):
+        with self._lock:
+            self._entries.pop(key, None)
+            # cached objects are kept alive, so that their ids are not reused
+            self._entries[key] = (_geometry(pgl_object), mesh)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, pgl_object):
+        """ Remove the mesh of pgl_object (e.g. a parametric object modified in place) from the cache"""
+        key = geometry_key(pgl_object)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+def _tessellate(pgl_object, tesselator):
+    pgl_object.apply(tesselator)
+    mesh = tesselator.triangulation
+    points = numpy.array(mesh.pointList, dtype=numpy.float64).reshape((-1, 3))
+    indices = numpy.array(mesh.indexList, dtype=numpy.intp).reshape((-1, 3))
+    # meshes may be shared (cache), they are read-only
+    points.flags.writeable = False
+    indices.flags.writeable = False
+    return points, indices
+
+
+# objects tessellated by a worker of the pool of processes, set in the worker only
+_worker_objects = None
+_worker_tesselator = None
+
+
+def _init_worker(pgl_objects):
+    global _worker_objects, _worker_tesselator
+    _worker_objects = pgl_objects
+    _worker_tesselator = pgl.Tesselator()
+
+
+def _tessellate_pending(i):
+    return _tessellate(_worker_objects[i], _worker_tesselator)
+
 
-def _triangle(index, pts):
-    return tuple([tuple([x for x in pts[i]]) for i in index])
+def _tessellate_all(pgl_objects, processes=None):
+    # plantGL objects cannot be pickled: workers are forked with the objects to tessellate, given
+    # to the initializer of each pool, so that concurrent calls do not share them
+    if processes is None or processes < 2 or len(pgl_objects) < 2 or not hasattr(os, 'fork'):
+        tesselator = pgl.Tesselator()
+        return [_tessellate(pgl_object, tesselator) for pgl_object in pgl_objects]
+    pool = multiprocessing.Pool(min(processes, len(pgl_objects)), _init_worker, (pgl_objects,))
+    try:
+        meshes = pool.map(_tessellate_pending, range(len(pgl_objects)))
+    finally:
+        pool.close()
+        pool.join()
+    for points, indices in meshes:
+        points.flags.writeable = False
+        indices.flags.writeable = False
+    return meshes
+
+
+def tessellate(pgl_objects, cache=None, processes=None):
+    """ Tessellate plantGL objects
+
+    Args:
+        pgl_objects: (list) plantGL geometries or shapes
+        cache: (TessellationCache) the cache of the meshes. If None (default), default_cache is used
+        processes: (int) the number of processes tessellating the objects missing in the cache.
+                If None (default), objects are tessellated in the calling process
+
+    Returns:
+        the list of the (points, indices) meshes of the objects: a (n, 3) array of points and
+        a (m, 3) array of the indices of the points of the triangles
+    """
+    if cache is None:
+        cache = default_cache
+    pgl_objects = list(pgl_objects)
+    if cache is None:
+        return _tessellate_all(pgl_objects, processes)
+
+    meshes = [None] * len(pgl_objects)
+    keys = [geometry_key(pgl_object) for pgl_object in pgl_objects]
+    missing = OrderedDict()
+    for i, (key, pgl_object) in enumerate(zip(keys, pgl_objects)):
+        if key in missing:
+            # another instance of a geometry to tessellate
+            missing[key].append(i)
+            continue
+        meshes[i] = cache.get(key, pgl_object)
+        if meshes[i] is None:
+            missing[key] = [i]
+    todo = [positions[0] for positions in missing.itervalues()]
+    computed = _tessellate_all([pgl_objects[i] for i in todo], processes)
+    for first, mesh in zip(todo, computed):
+        cache.put(keys[first], pgl_objects[first], mesh)
+        for i in missing[keys[first]]:
+            meshes[i] = mesh
+    return meshes
+
+
+def merge_meshes(meshes):
+    """ Merge a list of (points, indices) meshes into one"""
+    if len(meshes) == 1:
+        return meshes[0]
+    if len(meshes) == 0:
+        return numpy.zeros((0, 3)), numpy.zeros((0, 3), dtype=numpy.intp)
+    offsets = numpy.cumsum([0] + [len(points) for points, _ in meshes[:-1]])
+    points = numpy.concatenate([points for points, _ in meshes])
+    indices = numpy.concatenate([indices + offset for (_, indices), offset in zip(meshes, offsets)])
+    return points, indices
+
+
+def mesh_to_triangles(points, indices):
+    """ The list of the triangles (3-tuples of 3-tuples points coordinates) of a mesh"""
+    return [tuple(map(tuple, tri)) for tri in points[indices].tolist()]
 
 
 def pgl_to_triangles(pgl_object, tesselator=None):
     if tesselator is None:
         tesselator = pgl.Tesselator()
-    pgl_object.apply(tesselator)
-    mesh = tesselator.triangulation
-    pts = numpy.array(mesh.pointList, ndmin=2)
-    indices = numpy.array(mesh.indexList, ndmin=2)
-    return [_triangle(itri, pts) for itri in indices]
+    return mesh_to_triangles(*_tessellate(pgl_object, tesselator))
+
 
+def scene_to_meshes(scene, cache=None, processes=None):
+    """ Tessellate a PlantGl scene
 
-def scene_to_cscene(scene):
+    Args:
+        scene: an openalea.plantgl.all.Scene instance
+        cache: (TessellationCache) the cache of the meshes. If None (default), default_cache is used
+        processes: (int) the number of processes tessellating the shapes (see tessellate)
+
+    Returns:
+        a {primitive_id: (points, indices)} dict of the meshes of the shapes (see tessellate).
+        primitive_id is taken as the index of the shape in the scene shape list.
+    """
+    shapes = scene.todict()
+    pids = list(shapes)
+    pgl_objects = [list(shapes[pid]) for pid in pids]
+    meshes = iter(tessellate([o for objects in pgl_objects for o in objects], cache, processes))
+    return {pid: merge_meshes([next(meshes) for _ in objects]) for pid, objects in zip(pids, pgl_objects)}
+
+
+def scene_to_cscene(scene, cache=None, processes=None):
     """ Build a caribu-compatible scene from a PlantGl scene
 
     Args:
         scene: an openalea.plantgl.all.Scene instance
+        cache: (TessellationCache) the cache of the meshes. If None (default), default_cache is used
+        processes: (int) the number of processes tessellating the shapes (see tessellate)
 
     Returns:
         a {primitive_id: [triangles,]} dict.A triangle is a 3-tuple of 3-tuples points coordinates
         primitive_id is taken as the index of the shape in the scene shape list.
 
     """
+    meshes = scene_to_meshes(scene, cache, processes)
+    return {pid: mesh_to_triangles(*mesh) for pid, mesh in meshes.iteritems()}
 
-    cscene = {}
-    tesselator = pgl.Tesselator()
-    for pid, pgl_objects in scene.todict().iteritems():
-        cscene[pid] = sum([pgl_to_triangles(pgl_object, tesselator) for pgl_object in pgl_objects],[])
 
-    return cscene
+def mtg_to_meshes(g, property_name='geometry', cache=None, processes=None):
+    """ Tessellate the geometries encoded in a mtg
 
+    Args:
+        g: an openalea.mtg.mtg.MTG instance
+        property_name: (str) the name of the property in g where plantGL geometries are encoded
+        cache: (TessellationCache) the cache of the meshes. If None (default), default_cache is used
+        processes: (int) the number of processes tessellating the geometries (see tessellate)
 
-def mtg_to_cscene(g, property_name='geometry'):
+    Returns:
+        a {primitive_id: (points, indices)} dict of the meshes of the geometries (see tessellate).
+        primitive_id is the vertex id.
+    """
+    geometry = g.property(property_name)
+    pids = list(geometry)
+    return dict(zip(pids, tessellate([geometry[pid] for pid in pids], cache, processes)))
+
+
+def mtg_to_cscene(g, property_name='geometry', cache=None, processes=None):
     """Build a caribu-compatible scene from a mtg encoding geometries
 
     Args:
         g: an openalea.mtg.mtg.MTG instance
         property_name: (str) the name of the property in g where plantGL geometries are encoded
+        cache: (TessellationCache) the cache of the meshes. If None (default), default_cache is used
+        processes: (int) the number of processes tessellating the geometries (see tessellate)
 
     Returns:
         a {primitive_id: [triangles,]} dict.A triangle is a 3-tuple of 3-tuples points coordinates
         primitive_id is the vertex id.
 
     """
-    geometry = g.property(property_name)
-    tesselator = pgl.Tesselator()
-    cscene = {}
-    for pid in geometry:
-        cscene[pid] = pgl_to_triangles(geometry[pid], tesselator)
-
-    return cscene
+    meshes = mtg_to_meshes(g, property_name, cache, processes)
+    return {pid: mesh_to_triangles(*mesh) for pid, mesh in meshes.iteritems()}
@@ -0,0 +1,356 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" Array storage of the triangles of a caribu scene
+
+A TriangleStore holds the primitives of a scene as one indexed mesh: a
+contiguous (V, 3) float64 array of points, and a (N, 3) array of the indices
+(in points) of the vertices of the triangles. Points and triangles of a
+primitive are consecutive, offset tables giving the first point and the first
+triangle of each primitive, and a group index the primitive of each triangle.
+Primitives given as indexed meshes (e.g. tessellations) keep their shared
+vertices, triangle lists being stored as meshes with three points per triangle.
+SceneView presents a store as the {primitive_id: [triangles,]} dict used by the
+CaribuScene API.
+
+Primitives can be updated, added or removed in place. The store records them in
+its dirty set, and patches its caches (triangle areas, primitive bounds, groups)
+for these primitives only.
+"""
+from collections import Mapping
+
+import numpy
+
+
+def _object_array(values):
+    """ A 1D object array holding values (that may be tuples)"""
+    a = numpy.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        a[i] = v
+    return a
+
+
+class IndexedMesh(object):
+    """ Triangles defined by an array of points and an array of the indices of their vertices
+
+    An IndexedMesh behaves as the (read-only) sequence of its triangles: indexing or slicing it gives
+    the (3, 3) (or (n, 3, 3)) array of the vertices of the triangles, and numpy.asarray the (N, 3, 3)
+    array of all of them.
+    """
+
+    def __init__(self, points, indices):
+        """ Args:
+            points: (array-like) a (n, 3) array of points coordinates
+            indices: (array-like of int) a (N, 3) array of the indices of the vertices of the triangles
+        """
+        self.points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 3))
+        self.indices = numpy.asarray(indices, dtype=numpy.intp).reshape((-1, 3))
+
+    @staticmethod
+    def from_triangles(triangles):
+        """ A mesh of triangles (array-like of triangle vertices), each having its own points"""
+        points = numpy.asarray(triangles, dtype=numpy.float64).reshape((-1, 3))
+        return IndexedMesh(points, numpy.arange(len(points)).reshape((-1, 3)))
+
+    @staticmethod
+    def concatenate(meshes):
+        """ Merge a list of meshes into one"""
+        offsets = numpy.cumsum([0] + [len(m.points) for m in meshes[:-1]])
+        return IndexedMesh(numpy.concatenate([m.points for m in meshes] + [numpy.zeros((0, 3))]),
+                           numpy.concatenate([m.indices + o for m, o in zip(meshes, offsets)] +
+                                             [numpy.zeros((0, 3), dtype=numpy.intp)]))
+
+    @property
+    def shape(self):
+        return len(self.indices), 3, 3
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        return self.points[self.indices[item]]
+
+    def __iter__(self):
+        for tri in self.indices:
+            yield self.points[tri]
+
+    def __array__(self, dtype=None):
+        vertices = self.points[self.indices]
+        if dtype is not None:
+            return vertices.astype(dtype)
+        return vertices
+
+    def __str__(self):
+        return 'IndexedMesh (%d triangles, %d points)' % (len(self.indices), len(self.points))
+
+
+def is_mesh(primitive):
+    """ Is primitive given as an indexed mesh (an IndexedMesh or a (points, indices) tuple of arrays) ?"""
+    return isinstance(primitive, IndexedMesh) or (
+        isinstance(primitive, tuple) and len(primitive) == 2 and isinstance(primitive[0], numpy.ndarray))
+
+
+def as_mesh(primitive):
+    """ The IndexedMesh of a primitive given as a mesh or as a list of triangles"""
+    if isinstance(primitive, IndexedMesh):
+        return primitive
+    if is_mesh(primitive):
+        return IndexedMesh(*primitive)
+    if len(primitive) == 0:
+        return IndexedMesh(numpy.zeros((0, 3)), numpy.zeros((0, 3)))
+    return IndexedMesh.from_triangles([tuple(tri) for tri in primitive])
+
+
+def _triangle_areas(points, indices):
+    p0, p1, p2 = points[indices[:, 0]], points[indices[:, 1]], points[indices[:, 2]]
+    cross = numpy.cross(p1 - p0, p2 - p0)
+    return 0.5 * numpy.sqrt((cross ** 2).sum(axis=1))
+
+
+def _bounds(points, indices):
+    """ The (2, 3) array of the corners of the bounding box of the triangles of a mesh (nan if empty)"""
+    if len(indices) == 0:
+        return numpy.full((2, 3), numpy.nan)
+    used = points[indices.ravel()]
+    return numpy.array((used.min(axis=0), used.max(axis=0)))
+
+
+class TriangleStore(object):
+    """ Triangles of a scene, grouped by primitive
+    """
+
+    def __init__(self, vertices, group_index, ids, indices=None, point_offsets=None):
+        """ Args:
+            vertices: (array-like) a (N, 3, 3) array of triangles vertices, or, if indices is given,
+                the (V, 3) array of the points of the triangles
+            group_index: (array-like of int) the N indices (in ids) of the primitive of each triangle.
+                Triangles of a primitive should be consecutive and primitives in the order of ids
+            ids: (list) the primitive ids
+            indices: (array-like of int) the (N, 3) indices (in points) of the vertices of the triangles
+            point_offsets: (array-like of int) the index of the first point of each primitive (and
+                the number of points), if indices is given
+        """
+        if indices is None:
+            mesh = IndexedMesh.from_triangles(numpy.asarray(vertices, dtype=numpy.float64).reshape((-1, 3, 3)))
+            self.points, self.indices = mesh.points, mesh.indices
+        else:
+            self.points = numpy.ascontiguousarray(vertices, dtype=numpy.float64).reshape((-1, 3))
+            self.indices = numpy.ascontiguousarray(indices, dtype=numpy.intp).reshape((-1, 3))
+        self.group_index = numpy.asarray(group_index, dtype=numpy.intp)
+        self.ids = list(ids)
+        if len(self.group_index) != len(self.indices):
+            raise ValueError('The number of triangles and group indices should match')
+        if len(self.group_index) > 0 and numpy.any(numpy.diff(self.group_index) < 0):
+            raise ValueError('Triangles of a primitive should be consecutive, in the order of ids')
+        counts = numpy.bincount(self.group_index, minlength=len(self.ids))
+        if len(counts) > len(self.ids):
+            raise ValueError('group index out of the range of ids')
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.intp)
+        if point_offsets is None:
+            point_offsets = 3 * self.offsets
+        self.point_offsets = numpy.asarray(point_offsets, dtype=numpy.intp)
+        self.position = {pid: g for g, pid in enumerate(self.ids)}
+        # primitives updated, added or removed since the last call to clean
+        self.dirty = set()
+        # caches, computed when first needed
+        self._areas = None
+        self._bounds = None
+        self._groups = None
+
+    @staticmethod
+    def from_dict(cscene):
+        """ Build a store from a {primitive_id: primitive} dict, primitives being lists of triangles
+        or indexed meshes (see as_mesh)"""
+        ids = list(cscene.keys())
+        meshes = [as_mesh(cscene[pid]) for pid in ids]
+        mesh = IndexedMesh.concatenate(meshes)
+        group_index = numpy.repeat(numpy.arange(len(ids)), numpy.array([len(m) for m in meshes], dtype=numpy.intp))
+        point_offsets = numpy.cumsum([0] + [len(m.points) for m in meshes])
+        return TriangleStore(mesh.points, group_index, ids, mesh.indices, point_offsets)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __str__(self):
+        return 'TriangleStore (%d triangles, %d primitives)' % (len(self), len(self.ids))
+
+    @property
+    def vertices(self):
+        """ The (N, 3, 3) array of the vertices of the triangles (a copy)"""
+        return self.points[self.indices]
+
+    def as_mesh(self):
+        """ The IndexedMesh of all the triangles of the store (sharing the store arrays)"""
+        return IndexedMesh(self.points, self.indices)
+
+    def mesh(self, pid):
+        """ The IndexedMesh of primitive pid"""
+        g = self.position[pid]
+        return IndexedMesh(self.points[self.point_offsets[g]:self.point_offsets[g + 1]],
+                           self.indices[self.offsets[g]:self.offsets[g + 1]] - self.point_offsets[g])
+
+    def count(self, pid):
+        """ The number of triangles of primitive pid"""
+        g = self.position[pid]
+        return int(self.offsets[g + 1] - self.offsets[g])
+
+    def triangles(self, pid):
+        """ The (n, 3, 3) array of the triangles of primitive pid"""
+        g = self.position[pid]
+        return self.points[self.indices[self.offsets[g]:self.offsets[g + 1]]]
+
+    def per_triangle(self, values):
+        """ Expand a list of values given per primitive (in the order of ids) into a list of values per triangle"""
+        if len(values) != len(self.ids):
+            raise ValueError('The number of values and primitives should match')
+        return _object_array(values)[self.group_index].tolist()
+
+    def groups(self):
+        """ The list of primitive ids of the triangles"""
+        if self._groups is None:
+            self._groups = self.per_triangle(self.ids)
+        return list(self._groups)
+
+    def areas(self):
+        """ The areas of the triangles"""
+        if self._areas is None:
+            self._areas = _triangle_areas(self.points, self.indices)
+        return self._areas.copy()
+
+    def bounds(self):
+        """ The (P, 2, 3) array of the corners of the bounding boxes of the primitives (nan for empty ones)"""
+        if self._bounds is None:
+            self._bounds = numpy.array([_bounds(self.points, self.indices[self.offsets[g]:self.offsets[g + 1]])
+                                        for g in range(len(self.ids))]).reshape((-1, 2, 3))
+        return self._bounds
+
+    def bbox(self):
+        """ The (xmin, ymin, zmin), (xmax, ymax, zmax) corners of the bounding box of the triangles"""
+        if len(self.indices) == 0:
+            raise ValueError('empty store has no bounding box')
+        bounds = self.bounds()
+        return tuple(numpy.nanmin(bounds[:, 0], axis=0)), tuple(numpy.nanmax(bounds[:, 1], axis=0))
+
+    def clean(self):
+        """ Empty the dirty set
+
+        Returns:
+            the set of the primitives updated, added or removed since the last call
+        """
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+    def update(self, primitives):
+        """ Replace the triangles of existing primitives
+
+        Args:
+            primitives: a {primitive_id: primitive} dict, primitives being lists of triangles
+                or indexed meshes (see as_mesh)
+        """
+        unknown = [pid for pid in primitives if pid not in self.position]
+        if unknown:
+            raise KeyError('unknown primitives: %s' % unknown)
+        resized = {}
+        for pid, primitive in primitives.iteritems():
+            mesh = as_mesh(primitive)
+            g = self.position[pid]
+            start, stop = self.offsets[g], self.offsets[g + 1]
+            first, last = self.point_offsets[g], self.point_offsets[g + 1]
+            if len(mesh) == stop - start and len(mesh.points) == last - first:
+                # patched in place
+                self.points[first:last] = mesh.points
+                self.indices[start:stop] = mesh.indices + first
+                if self._areas is not None:
+                    self._areas[start:stop] = _triangle_areas(mesh.points, mesh.indices)
+                if self._bounds is not None:
+                    self._bounds[g] = _bounds(mesh.points, mesh.indices)
+            else:
+                resized[pid] = mesh
+        if resized:
+            self._rebuild(self.ids, resized)
+        self.dirty.update(primitives)
+
+    def add(self, primitives):
+        """ Add new primitives, after the existing ones
+
+        Args:
+            primitives: a {primitive_id: primitive} dict, primitives being lists of triangles
+                or indexed meshes (see as_mesh)
+        """
+        existing = [pid for pid in primitives if pid in self.position]
+        if existing:
+            raise ValueError('primitives already in the store: %s' % existing)
+        added = {pid: as_mesh(primitive) for pid, primitive in primitives.iteritems()}
+        self._rebuild(self.ids + list(added), added)
+        self.dirty.update(added)
+
+    def remove(self, pids):
+        """ Remove primitives
+
+        Args:
+            pids: the ids of the primitives to remove
+        """
+        pids = set(pids)
+        unknown = [pid for pid in pids if pid not in self.position]
+        if unknown:
+            raise KeyError('unknown primitives: %s' % unknown)
+        self._rebuild([pid for pid in self.ids if pid not in pids], {})
+        self.dirty.update(pids)
+
+    def _rebuild(self, ids, new):
+        """ Re-assemble the arrays for primitives ids, taking the meshes of the primitives
+        in new from it and those of the other ones (and their cached values) from the store"""
+        old = [self.position.get(pid) if pid not in new else None for pid in ids]
+        meshes = [new[pid] if g is None else self.mesh(pid) for pid, g in zip(ids, old)]
+        if self._areas is not None:
+            self._areas = numpy.concatenate(
+                [_triangle_areas(m.points, m.indices) if g is None else self._areas[self.offsets[g]:self.offsets[g + 1]]
+                 for m, g in zip(meshes, old)] + [numpy.zeros(0)])
+        if self._bounds is not None:
+            self._bounds = numpy.array([_bounds(m.points, m.indices) if g is None else self._bounds[g]
+                                        for m, g in zip(meshes, old)]).reshape((-1, 2, 3))
+        mesh = IndexedMesh.concatenate(meshes)
+        counts = numpy.array([len(m) for m in meshes], dtype=numpy.intp)
+        self.points, self.indices = mesh.points, mesh.indices
+        self.group_index = numpy.repeat(numpy.arange(len(ids)), counts)
+        self.ids = list(ids)
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(counts))).astype(numpy.intp)
+        self.point_offsets = numpy.cumsum([0] + [len(m.points) for m in meshes]).astype(numpy.intp)
+        self.position = {pid: g for g, pid in enumerate(self.ids)}
+        self._groups = None
+
+    def view(self):
+        return SceneView(self)
+
+
+class SceneView(Mapping):
+    """ A read-only {primitive_id: [triangles,]} view of a TriangleStore
+
+    Triangles of a primitive are converted to lists of 3-tuples points coordinates when accessed.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, pid):
+        return [map(tuple, tri) for tri in self.store.triangles(pid).tolist()]
+
+    def __contains__(self, pid):
+        return pid in self.store.position
+
+    def __iter__(self):
+        return iter(self.store.ids)
+
+    def __len__(self):
+        return len(self.store.ids)
+
+    def __repr__(self):
+        return 'SceneView(%s)' % self.store
@@ -0,0 +1,137 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" SysV shared memory segments (ctypes), as used by canestrad -m shm_key
+
+The scene segment (key k) holds Nt canestra Patch records. canestrad writes
+its results in the segment of key k + OFFS: three blocks of Nt float64,
+Eabs * area, Ei_sup * area and Ei_inf * area (-area for opaque triangles).
+The key passed to canestrad encodes the scene size: (Nt + 1) * 100 + k.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+
+import numpy
+
+IPC_CREAT = 0o1000
+IPC_EXCL = 0o2000
+IPC_RMID = 0
+
+OFFS = 1900  # transf.h
+MAX_KEY = 100  # canestrad keys are encoded on two digits
+
+_libc = None
+
+
+def _lib():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+        libc.shmget.restype = ctypes.c_int
+        libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+        libc.shmat.restype = ctypes.c_void_p
+        libc.shmdt.argtypes = [ctypes.c_void_p]
+        libc.shmdt.restype = ctypes.c_int
+        libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+        libc.shmctl.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+def _raise_errno(msg):
+    err = ctypes.get_errno()
+    raise OSError(err, '%s: %s' % (msg, os.strerror(err)))
+
+
+class SharedSegment(object):
+    """ A SysV shared memory segment created (exclusively) by the caller
+    """
+
+    def __init__(self, key, size):
+        libc = _lib()
+        self.key = key
+        self.size = max(int(size), 1)
+        self.addr = None
+        self.shmid = libc.shmget(key, self.size, IPC_CREAT | IPC_EXCL | 0o666)
+        if self.shmid == -1:
+            _raise_errno('shmget(%d)' % key)
+
+    def attach(self):
+        if self.addr is None:
+            addr = _lib().shmat(self.shmid, None, 0)
+            if addr is None or addr == ctypes.c_void_p(-1).value:
+                _raise_errno('shmat(%d)' % self.key)
+            self.addr = addr
+        return self.addr
+
+    def array(self, dtype, shape):
+        """ A numpy view on the segment (valid until close)"""
+        dtype = numpy.dtype(dtype)
+        count = int(numpy.prod(shape))
+        buf = (ctypes.c_char * (count * dtype.itemsize)).from_address(self.attach())
+        return numpy.frombuffer(buf, dtype=dtype, count=count).reshape(shape)
+
+    def close(self):
+        """ Detach and remove the segment"""
+        libc = _lib()
+        if self.addr is not None:
+            libc.shmdt(self.addr)
+            self.addr = None
+        if self.shmid != -1:
+            libc.shmctl(self.shmid, IPC_RMID, None)
+            self.shmid = -1
+
+
+def is_available():
+    """ SysV shared memory is only available on posix platforms"""
+    if os.name != 'posix':
+        return False
+    try:
+        _lib()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+def scene_segments(nb_triangles, patch_size):
+    """ Allocate a free key for a canestrad scene and its result segment
+
+    Args:
+        nb_triangles: (int) the number of triangles of the scene
+        patch_size: (int) the size (bytes) of a Patch record
+
+    Returns:
+        (key, scene_segment, result_segment)
+    """
+    for key in range(1, MAX_KEY):
+        try:
+            scene = SharedSegment(key, nb_triangles * patch_size)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        try:
+            result = SharedSegment(key + OFFS, 3 * nb_triangles * 8)
+        except OSError as e:
+            scene.close()
+            if e.errno == errno.EEXIST:
+                continue
+            raise
+        return key, scene, result
+    raise OSError(errno.EEXIST, 'no free shared memory key for canestrad')
+
+
+def canestra_key(key, nb_triangles):
+    """ The -m argument of canestrad for a scene of nb_triangles in segment key"""
+    return (nb_triangles + 1) * 100 + key
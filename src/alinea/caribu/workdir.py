@@ -0,0 +1,130 @@
+# -*- python -*-
+#
+#       Copyright 2015 INRIA - CIRAD - INRA
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       WebSite : https://github.com/openalea-incubator/caribu
+#
+# ==============================================================================
+""" Reusable scratch directories for Caribu runs
+
+A WorkdirPool hands out empty working directories created under a configurable
+root (e.g. a tmpfs such as /dev/shm) and takes them back once a run is over:
+their content is removed, but the directories themselves are kept for the next
+runs, up to max_idle of them.
+"""
+import os
+import shutil
+import tempfile
+import threading
+
+# pool used by Caribu instances that are not given one (None: a new temporary
+# directory is created, and removed, for each run)
+default_pool = None
+
+
+def set_default_pool(pool):
+    """ Set the WorkdirPool used by default by Caribu (None to disable pooling)
+
+    Returns:
+        the previous default pool
+    """
+    global default_pool
+    previous, default_pool = default_pool, pool
+    return previous
+
+
+def link(src, dest):
+    """ Make src available as dest, by a hard link, a symbolic link or a copy (in that order of preference)"""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+        return
+    except (AttributeError, OSError):
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dest)
+        return
+    except (AttributeError, OSError):
+        pass
+    shutil.copy(src, dest)
+
+
+def clear(path):
+    """ Remove the content of directory path"""
+    for name in os.listdir(path):
+        fn = os.path.join(path, name)
+        if os.path.isdir(fn) and not os.path.islink(fn):
+            shutil.rmtree(fn, ignore_errors=True)
+        else:
+            os.remove(fn)
+
+
+class WorkdirPool(object):
+    """ A pool of reusable working directories
+    """
+
+    def __init__(self, root=None, max_idle=16):
+        """ Args:
+            root: (str) the directory where working directories are created. If None, the system
+                temporary directory is used
+            max_idle: (int) the maximal number of (empty) directories kept for reuse
+        """
+        if root is None:
+            root = tempfile.gettempdir()
+        self.root = os.path.abspath(root)
+        if not os.path.exists(self.root):
+            os.makedirs(self.root)
+        self.max_idle = max_idle
+        self.idle = []
+        self.busy = set()
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return 'WorkdirPool(%s, %d busy, %d idle)' % (self.root, len(self.busy), len(self.idle))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def acquire(self):
+        """ An empty working directory"""
+        with self._lock:
+            if self.closed:
+                raise ValueError('WorkdirPool is closed')
+            if self.idle:
+                path = self.idle.pop()
+            else:
+                path = tempfile.mkdtemp(prefix='caribu_', dir=self.root)
+            self.busy.add(path)
+        return path
+
+    def release(self, path):
+        """ Give back a working directory acquired from the pool"""
+        path = str(path)
+        with self._lock:
+            self.busy.discard(path)
+            keep = not self.closed and len(self.idle) < self.max_idle
+        if not os.path.exists(path):
+            return
+        if keep:
+            clear(path)
+            with self._lock:
+                self.idle.append(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def close(self):
+        """ Remove the idle directories. Busy ones are removed when released."""
+        with self._lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for path in idle:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,117 @@
+/*        bench_raster.cpp - micro-benchmark de la projection (canestrad)
+   Compare le debit en pixels de colorie_triangle() (demi-triangles, balayage
+   par lignes, zproj_id() appelee par pointeur) et de colorie_aretes()
+   (fonctions d'aretes en virgule fixe) sur des triangles aleatoires.
+
+   usage : bench_raster [nb_triangles [Timg [cote_pixels [passes]]]]
+   construit par : scons rasterbench=1
+*/
+
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <cmath>
+#include <stdint.h>
+using namespace std;
+
+#include "infini.h"
+#include "chrono.h"
+
+typedef double Punkt[3];
+
+void colorie_triangle( void *,void *,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double, void (*f)(void *, int, int, void*));
+void colorie_aretes(int32_t,int32_t **,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double);
+void zproj_id(void *, int, int, void*);
+
+// decoupe un triangle en demis (sommet, gauche, droite) comme Canopy::projplan()
+static void colorie_demis(int32_t id,int32_t **Zid,REELLE **Zbuf,Punkt *P,int T){
+  int lo=0,mi=1,hi=2,t;
+  Punkt D;
+  double *g,*d;
+
+  if(P[mi][1]<P[lo][1]) {t=lo; lo=mi; mi=t;}
+  if(P[hi][1]<P[mi][1]) {t=mi; mi=hi; hi=t;}
+  if(P[mi][1]<P[lo][1]) {t=lo; lo=mi; mi=t;}
+  if(P[lo][1]==P[hi][1] || (P[0][0]==P[1][0] && P[1][0]==P[2][0]))
+    return; // triangle plat
+  if(P[lo][1]==P[mi][1]) { // up
+    g=(P[lo][0]<P[mi][0])? P[lo] : P[mi];
+    d=(g==P[lo])? P[mi] : P[lo];
+    colorie_triangle(&id,Zid,Zbuf,P[hi],g,d,T,T,1.0,1.0,zproj_id);
+  }
+  else if(P[mi][1]==P[hi][1]) { // down
+    g=(P[mi][0]<P[hi][0])? P[mi] : P[hi];
+    d=(g==P[mi])? P[hi] : P[mi];
+    colorie_triangle(&id,Zid,Zbuf,P[lo],g,d,T,T,1.0,1.0,zproj_id);
+  }
+  else {
+    D[1]=P[mi][1];
+    D[0]=P[lo][0]+(D[1]-P[lo][1])/(P[hi][1]-P[lo][1])*(P[hi][0]-P[lo][0]);
+    D[2]=P[lo][2]+(D[1]-P[lo][1])/(P[hi][1]-P[lo][1])*(P[hi][2]-P[lo][2]);
+    if(D[0]==P[mi][0])
+      return;
+    g=(D[0]>P[mi][0])? P[mi] : D;
+    d=(g==D)? P[mi] : D;
+    colorie_triangle(&id,Zid,Zbuf,P[hi],g,d,T,T,1.0,1.0,zproj_id);
+    colorie_triangle(&id,Zid,Zbuf,P[lo],g,d,T,T,1.0,1.0,zproj_id);
+  }
+}// colorie_demis()
+
+static void efface(REELLE *Zdata,int32_t *Iddata,int T){
+  for(int p=0;p<T*T;p++)
+    Zdata[p]=(REELLE)99999999999.9;
+  memset(Iddata,0,(size_t)T*T*sizeof(int32_t));
+}// efface()
+
+int main(int argc,char **argv){
+  int N=(argc>1)? atoi(argv[1]) : 200000;
+  int T=(argc>2)? atoi(argv[2]) : 1536;
+  double cote=(argc>3)? atof(argv[3]) : 8.0;
+  int passes=(argc>4)? atoi(argv[4]) : 5;
+  int n,m,p,nd;
+  double K=(T-1)/1.0,aire=0,t[2];
+  Punkt (*tri)[3]=new Punkt[N][3];
+  REELLE *Zdata=new REELLE[(size_t)T*T],**Zbuf=new REELLE*[T];
+  int32_t *Iddata=new int32_t[(size_t)T*T],**Zid=new int32_t*[T],*Idref=new int32_t[(size_t)T*T];
+  Chrono clock;
+
+  for(p=0;p<T;p++) {
+    Zbuf[p]=Zdata+(size_t)p*T;
+    Zid[p]=Iddata+(size_t)p*T;
+  }
+  // triangles aleatoires de cote ~cote pixels dans l'ecran unite
+  srand(1);
+  for(n=0;n<N;n++) {
+    double x=rand()/(double)RAND_MAX,y=rand()/(double)RAND_MAX;
+    for(m=0;m<3;m++) {
+      tri[n][m][0]=x+(rand()/(double)RAND_MAX-0.5)*cote/K;
+      tri[n][m][1]=y+(rand()/(double)RAND_MAX-0.5)*cote/K;
+      tri[n][m][2]=rand()/(double)RAND_MAX;
+    }
+    aire+=0.5*K*K*fabs((tri[n][1][0]-tri[n][0][0])*(tri[n][2][1]-tri[n][0][1])
+			-(tri[n][1][1]-tri[n][0][1])*(tri[n][2][0]-tri[n][0][0]));
+  }
+  for(m=0;m<2;m++) {
+    efface(Zdata,Iddata,T);
+    clock.Start();
+    for(p=0;p<passes;p++)
+      for(n=0;n<N;n++)
+	if(m==0)
+	  colorie_demis(n+1,Zid,Zbuf,tri[n],T);
+	else
+	  colorie_aretes(n+1,Zid,Zbuf,tri[n][0],tri[n][1],tri[n][2],T,T,1.0,1.0);
+    clock.Stop();
+    t[m]=clock.Seconds();
+    if(m==0)
+      memcpy(Idref,Iddata,(size_t)T*T*sizeof(int32_t));
+  }
+  for(nd=0,p=0;p<T*T;p++)
+    if(Iddata[p]!=Idref[p])
+      nd++;
+  printf("%d triangles (%.1f pixels en moyenne), ecran %d x %d, %d passes\n",N,aire/N,T,T,passes);
+  printf("colorie_triangle : %8.3f s  %8.1f Mpixels/s\n",t[0],passes*aire/t[0]*1e-6);
+  printf("colorie_aretes   : %8.3f s  %8.1f Mpixels/s  (x %.2f)\n",t[1],passes*aire/t[1]*1e-6,t[0]/t[1]);
+  printf("pixels d'id different : %d (%.3f %%)\n",nd,100.0*nd/((double)T*T));
+  delete [] tri; delete [] Zdata; delete [] Zbuf; delete [] Iddata; delete [] Zid; delete [] Idref;
+  return 0;
+}// main()
@@ -2,6 +2,8 @@
 #include "outils.h"
 // BSP
 
+char *chemin(const char *); // radioxity.cpp : nom dans le repertoire de travail
+
 BSP::~BSP(){
   // 0cout << "destructeur de BSP\n"; cout.flush();
   Ldiff.free_liste();
@@ -23,13 +25,13 @@ void BSP::volume_englobant_scene(reel *bornemin, reel *bornemax,ListeD<Diffuseur
   }
   if (Ldiff_scene.est_vide() == VRAI){
     cout << "ERREUR - Pas de diffuseur dans la scene\n"; cout.flush();
-    exit (2);
+    prog_terminate(2);
   }
   else{
     //visualise le tri pour l'infini
     Primitive* prim;
     FILE* ftri;
-    ftri=fopen("trinf.can","w");
+    ftri=fopen(chemin("trinf.can"),"w");
     
     nb_diffuseurs=0;
     for( Ldiff_scene.debut(); ! Ldiff_scene.finito();
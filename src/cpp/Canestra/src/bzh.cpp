@@ -156,7 +156,7 @@ void hd_calc_Bfar(VEC *Cenv,char *pcEnvName,Diffuseur ** TabDiff,double Eclt){
   if(Nc!=nbp){
     Ferr <<" Erreur nombre de couche de "  << pcEnvName<<" et de " 
 	 << pcBfName<<" differents\n" ;
-    exit(3);
+    prog_terminate(3);
   }
   fread(&nbp,sizeof(int),1,fic);
   if(verbose>1) 
@@ -3,13 +3,21 @@ using namespace std ;
 #include <boost/python.hpp>
 using namespace boost::python ;
 #include <cstring>
+#include <vector>
+#include <string>
+#include <transf.h>
+#include <ferrlog.h>
 
 int canestra(int argc, char **argv);
-int canestra_wrap(boost::python::list args ) {
-  int iSize = extract<int> (args.attr("__len__")()),
-    iIb ;
+int canestra_mem(int argc,char **argv,Patch *Ts,int Nt,
+		 double *lum,int Nl,vector<double> &res,const char *wd);
+
+// copie de la liste python des arguments en argv
+static char ** make_argv(boost::python::list args, int &iSize) {
+  int iIb ;
+  iSize = extract<int> (args.attr("__len__")()) ;
   char ** argv = new char*[iSize] ;
-  
+
   for (iIb=0; iIb < iSize ; iIb ++) {
     const char * pcArg ;
     extract <const char*> earg(args[iIb]);
@@ -19,17 +27,102 @@ int canestra_wrap(boost::python::list args ) {
       strcpy (argv[iIb], pcArg);
       // Ferr << "Argument "<<iIb<< " : "<< argv[iIb] << endl ;
     }
-  } 
-
-  int result = canestra (iSize, argv ) ;
+  }
+  return argv ;
+}
 
-  for (iIb = 0 ; iIb < iSize ;iIb ++) {
+static void free_argv(char **argv, int iSize) {
+  for (int iIb = 0 ; iIb < iSize ;iIb ++) {
     delete [] argv[iIb] ;
   }
   delete [](argv) ;
+}
+
+// GIL relache pendant un calcul canestra (les appels sont serialises par
+// canestra_engine._lock), repris meme si une exception C++ remonte
+struct SansGIL {
+  PyThreadState *etat ;
+  SansGIL() : etat(PyEval_SaveThread()) {}
+  ~SansGIL() { PyEval_RestoreThread(etat) ; }
+} ;
+
+int canestra_wrap(boost::python::list args ) {
+  int iSize, result ;
+  char ** argv = make_argv(args, iSize) ;
+
+  {
+    SansGIL sans_gil ;
+    try {
+      result = canestra (iSize, argv ) ;
+    } catch (Terminaison &t) {
+      Ferr.close() ;
+      result = t.code ;
+    }
+  }
+
+  free_argv(argv, iSize) ;
   return result ;
 }
 
+// canestra sur des buffers (numpy) : patches est un tableau contigu de Patch
+// (dtype [('t','i1'),('P','f4',(3,3))] aligne, 40 octets), lights un tableau
+// contigu de float64 (E vx vy vz) ; l'un ou l'autre peut etre None (=> -M, -l).
+// workdir : repertoire des fichiers lus et ecrits par canestra ("" : courant).
+// Retourne (status, octets des lignes float64 No label area Eabs Ei_sup Ei_inf)
+boost::python::tuple canestra_arrays(boost::python::list args,
+				     object patches, object lights,
+				     std::string workdir) {
+  Py_buffer vpatch, vlight ;
+  Patch *Ts = NULL ;
+  double *lum = NULL ;
+  int Nt = 0, Nl = 0, iSize, result ;
+  bool bpatch = !patches.is_none(), blight = !lights.is_none() ;
+  vector<double> res ;
+
+  if (bpatch) {
+    if (PyObject_GetBuffer(patches.ptr(), &vpatch, PyBUF_C_CONTIGUOUS) != 0)
+      throw_error_already_set() ;
+    if (vpatch.len % sizeof(Patch) != 0) {
+      PyBuffer_Release(&vpatch) ;
+      PyErr_SetString(PyExc_ValueError, "patches buffer size is not a multiple of sizeof(Patch)") ;
+      throw_error_already_set() ;
+    }
+    Ts = (Patch *) vpatch.buf ;
+    Nt = vpatch.len / sizeof(Patch) ;
+  }
+  if (blight) {
+    if (PyObject_GetBuffer(lights.ptr(), &vlight, PyBUF_C_CONTIGUOUS) != 0) {
+      if (bpatch) PyBuffer_Release(&vpatch) ;
+      throw_error_already_set() ;
+    }
+    lum = (double *) vlight.buf ;
+    Nl = vlight.len / (4 * sizeof(double)) ;
+  }
+
+  char ** argv = make_argv(args, iSize) ;
+  {
+    SansGIL sans_gil ;
+    result = canestra_mem(iSize, argv, Ts, Nt, lum, Nl, res,
+			   workdir.empty() ? NULL : workdir.c_str()) ;
+  }
+  free_argv(argv, iSize) ;
+
+  if (bpatch) PyBuffer_Release(&vpatch) ;
+  if (blight) PyBuffer_Release(&vlight) ;
+
+  const char *data = res.empty() ? "" : (const char *) &res[0] ;
+  Py_ssize_t size = res.size() * sizeof(double) ;
+#if PY_MAJOR_VERSION >= 3
+  object out(handle<>(PyBytes_FromStringAndSize(data, size))) ;
+#else
+  object out(handle<>(PyString_FromStringAndSize(data, size))) ;
+#endif
+  return boost::python::make_tuple(result, out) ;
+}
+
 BOOST_PYTHON_MODULE(canestra2py) {
-  def ("canestra", canestra_wrap ) ; 
-} 
+  // les erreurs de canestra (prog_terminate) ne doivent pas tuer l'interpreteur
+  prog_exception = true ;
+  def ("canestra", canestra_wrap ) ;
+  def ("canestra_arrays", canestra_arrays ) ;
+}
@@ -8,6 +8,8 @@ using namespace std ;
 
 #include <cmath>
 #include <cstdio>
+#include <cstring>
+#include <algorithm>
 
 #include "outils.h"
 #include "chrono.h"
@@ -63,7 +65,7 @@ void Canopy::sail_pur(VEC **Cfar,double *Eclt,char* envname){
   if(fenv==NULL){
     fflush(stdout);
     Ferr <<"<!> FF.C <init_NFF> Unable to open the file " << envname<<'\n' ;
-    exit(4);
+    prog_terminate(4);
   }
   fscanf(fenv,"%d %lf",&Nc,&dzc);
   printf("Canopy::sail_pur(): Nc = %d - dz = %lf\n",Nc,dzc);
@@ -125,9 +127,11 @@ void Canopy::sail_pur(VEC **Cfar,double *Eclt,char* envname){
 
 void colorie_triangle( void *,void *,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double, void (*f)(void *, int, int, void*));
 void colorie_capteur(REELLE **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,int& pB0);
+void colorie_aretes(int32_t,int32_t **,REELLE **, const Punkt,const Punkt,const Punkt, int,int, double,double);
 
 void pt2pkt(Point &, Punkt);
 void zproj(void *, int, int, void*);
+void zproj_id(void *, int, int, void*);
 void zFF(void *, int, int, void*);
 
 
@@ -137,6 +141,11 @@ void zproj(void * Zprim, int i, int j, void* prim) {
   ((Diffuseur***) Zprim)[i][j] = (Diffuseur *) prim;
 }//zproj()
 
+//+************ zproj_id()
+void zproj_id(void * Zid, int i, int j, void* id) {
+  ((int32_t**) Zid)[i][j] = *(int32_t *) id;
+}//zproj_id()
+
 //+************ zFF()
 void zFF(void *, int, int, void*) {
 
@@ -502,33 +511,529 @@ void Canopy::calc_FF(SPMAT *FF){
 
 #endif
 
+//-*************** Zbuffer::alloue() ************************
+// (re)alloue les tampons si la taille de l'image a change
+void Zbuffer::alloue(int T) {
+  int i;
+  if(Tz==T && Zdata!=NULL) return;
+  libere();
+  Tz=T;
+  Zdata=new REELLE[(size_t)Tz*Tz];
+  Zcopy=new REELLE[(size_t)Tz*Tz];
+  Zbuf=new REELLE*[Tz];
+  Iddata=new int32_t[(size_t)Tz*Tz];
+  Zid=new int32_t*[Tz];
+  for(i=0;i<Tz;i++) {
+    Zbuf[i]=Zdata+(size_t)i*Tz;
+    Zid[i]=Iddata+(size_t)i*Tz;
+  }
+}//Zbuffer::alloue()
+
+void Zbuffer::libere() {
+  delete [] Zdata;
+  delete [] Zcopy;
+  delete [] Zbuf;
+  delete [] Iddata;
+  delete [] Zid;
+  delete [] Ddata;
+  Zdata=Zcopy=NULL; Zbuf=NULL; Iddata=NULL; Zid=NULL; Ddata=NULL; Tz=0;
+}//Zbuffer::libere()
+
+//-*************** Zhier ************************
+#define BLOC 8 // pixels d'un bloc de niveau 1 (8 x 8 blocs au niveau 2)
+#define TRANCHES 1024 // tranches de profondeur de l'ordre de projplan
+
+// Z hierarchique d'un ecran T x T dont tous les pixels valent z
+void Zhier::init(int T0,float z) {
+  T=T0;
+  n1=(T+BLOC-1)/BLOC;
+  n2=(n1+7)/8;
+  max1.assign((size_t)n1*n1,z);
+  max2.assign((size_t)n2*n2,z);
+  sale1.assign((size_t)n1*n1,0);
+  sale2.assign((size_t)n2*n2,0);
+}//Zhier::init()
+
+// profondeur max des pixels du bloc b (niveau 1)
+float Zhier::max_pixels(int b,float **Zbuf) {
+  int i,j,i0=(b/n1)*BLOC,j0=(b%n1)*BLOC,i1=min(T,i0+BLOC),j1=min(T,j0+BLOC);
+  float m=Zbuf[i0][j0];
+  for(i=i0;i<i1;i++)
+    for(j=j0;j<j1;j++)
+      if(Zbuf[i][j]>m) m=Zbuf[i][j];
+  return m;
+}//Zhier::max_pixels()
+
+// aretes du triangle P (en pixels) : e0*x+e1*y+e2 >=0 a l'interieur
+static void aretes_bloc(const double P[3][2],double e[3][3]) {
+  int n,m;
+  double s=(P[1][0]-P[0][0])*(P[2][1]-P[0][1])-(P[1][1]-P[0][1])*(P[2][0]-P[0][0]);
+  for(n=0;n<3;n++) {
+    m=(n+1)%3;
+    e[n][0]=-(P[m][1]-P[n][1])*s;
+    e[n][1]=(P[m][0]-P[n][0])*s;
+    e[n][2]=-(e[n][0]*P[n][0]+e[n][1]*P[n][1]);
+  }
+}
+
+// position du bloc (bi,bj), centres de ses pixels a 1 pixel pres, par
+// rapport au triangle d'aretes e : -1 hors, 1 dedans, 0 a cheval
+static int position_bloc(const double e[3][3],int bi,int bj) {
+  int n,pos=1;
+  double x0=BLOC*bi-1,x1=BLOC*bi+BLOC+1,y0=BLOC*bj-1,y1=BLOC*bj+BLOC+1;
+  for(n=0;n<3;n++) {
+    if(e[n][2]+max(e[n][0]*x0,e[n][0]*x1)+max(e[n][1]*y0,e[n][1]*y1)<0)
+      return -1;
+    if(e[n][2]+min(e[n][0]*x0,e[n][0]*x1)+min(e[n][1]*y0,e[n][1]*y1)<0)
+      pos=0;
+  }
+  return pos;
+}
+
+// vrai si les pixels du triangle P (en pixels, bornes [i0,i1]x[j0,j1])
+// sont tous plus proches que z : un triangle de profondeur >= z y serait
+// entierement cache. Seuls les blocs touches par le triangle (a 1 pixel
+// pres) sont testes, les blocs propres avant les blocs sales a recalculer
+bool Zhier::cache(const double P[3][2],int i0,int i1,int j0,int j1,double z,float **Zbuf) {
+  int a,b,a1,b1,bi,bj,k,c,passe;
+  aretes_bloc(P,e);
+  for(a=i0/(8*BLOC);a<=i1/(8*BLOC);a++)
+    for(b=j0/(8*BLOC);b<=j1/(8*BLOC);b++) {
+      c=a*n2+b;
+      if(z>=max2[c]) continue;
+      if(sale2[c]) { // max des blocs (eventuellement sales : majorant)
+	max2[c]=max1[(size_t)(8*a)*n1+8*b];
+	for(bi=8*a;bi<min(n1,8*a+8);bi++)
+	  for(bj=8*b;bj<min(n1,8*b+8);bj++)
+	    max2[c]=max(max2[c],max1[(size_t)bi*n1+bj]);
+	sale2[c]=0;
+	if(z>=max2[c]) continue;
+      }
+      a1=min(i1/BLOC,8*a+7);
+      b1=min(j1/BLOC,8*b+7);
+      for(passe=0;passe<2;passe++)
+	for(bi=max(i0/BLOC,8*a);bi<=a1;bi++)
+	  for(bj=max(j0/BLOC,8*b);bj<=b1;bj++) {
+	    k=bi*n1+bj;
+	    if(z>=max1[k] || (passe==0)==(sale1[k]!=0))
+	      continue;
+	    if(position_bloc(e,bi,bj)<0)
+	      continue; // bloc hors du triangle
+	    if(passe==1) {
+	      max1[k]=max_pixels(k,Zbuf);
+	      sale1[k]=0;
+	      sale2[c]=1;
+	      if(z>=max1[k]) continue;
+	    }
+	    return false;
+	  }
+    }
+  return true;
+}//Zhier::cache()
+
+// le triangle du dernier cache() (bornes [i0,i1]x[j0,j1]) va etre colorie
+// a une profondeur dans [z0,z] : le max d'un bloc couvert baisse au plus a z,
+// un bloc a cheval est marque sale s'il a des pixels derriere z0
+void Zhier::marque(int i0,int i1,int j0,int j1,double z0,double z) {
+  int a,b,k,pos;
+  for(a=i0/BLOC;a<=i1/BLOC;a++)
+    for(b=j0/BLOC;b<=j1/BLOC;b++) {
+      k=a*n1+b;
+      if(z0>=max1[k] || (sale1[k] && z>=max1[k]))
+	continue; // rien a changer
+      pos=position_bloc(e,a,b);
+      if(pos<0)
+	continue;
+      if(pos>0)
+	max1[k]=min(max1[k],(float)z);
+      else
+	sale1[k]=1;
+      sale2[(size_t)(a/8)*n2+b/8]=1;
+    }
+}//Zhier::marque()
+
+// les pixels [i0,i1]x[j0,j1] vont etre ecrits
+void Zhier::sale(int i0,int i1,int j0,int j1) {
+  int a,b;
+  for(a=i0/BLOC;a<=i1/BLOC;a++)
+    for(b=j0/BLOC;b<=j1/BLOC;b++) {
+      sale1[(size_t)a*n1+b]=1;
+      sale2[(size_t)(a/8)*n2+b/8]=1;
+    }
+}//Zhier::sale()
+
+//-*************** Canopy::index_diff() ************************
+// tableaux des diffuseurs reels (en tete de Ldiff) et des capteurs virtuels
+void Canopy::index_diff() {
+  Diffuseur *pdiff;
+  int n=Ldiff.card();
+  if(n>maxZdiff) {
+    delete [] Zdiff;
+    delete [] Zcapt;
+    maxZdiff=n;
+    Zdiff=new Diffuseur*[maxZdiff];
+    Zcapt=new Diffuseur*[maxZdiff];
+  }
+  nZdiff=nZcapt=0;
+  for(Ldiff.debut();(! Ldiff.finito()) && Ldiff.contenu()->isreal();Ldiff.suivant())
+    Zdiff[nZdiff++]=Ldiff.contenu();
+  if(nbcell>0)
+    for( ;! Ldiff.finito();Ldiff.suivant()){
+      pdiff=Ldiff.contenu();
+      if(pdiff->isreal()){
+	Ferr <<"<!> Attention triangle reel dans la liste capteur virtuel!!\n";
+	continue;
+      }
+      Zcapt[nZcapt++]=pdiff;
+    }
+}//Canopy::index_diff()
+
+//-*************** projection par tuiles ************************
+// Les demi-triangles sont projetes tuile par tuile avec les calculs de
+// colorie_triangle() (memes pixels, memes profondeurs), dans un tampon de la
+// taille d'une tuile : la memoire ne depend plus de la taille de l'ecran.
+
+// pixel d'un diffuseur : z-buffer et indice de la tuile
+struct PixZ {
+  REELLE *Z;
+  int32_t *Id,id;
+  int i0,j0,T;
+  inline void operator()(int i,int j,double z) {
+    int p=(i-i0)*T+(j-j0);
+    if(z<Z[p]) {
+      Z[p]=(REELLE) z;
+      Id[p]=id;
+    }
+  }
+};
+
+// pixel d'un translate infini (i,j)+(di,dj) : profondeur minimale des translates
+struct PixD {
+  double *Dz,dz;
+  int i0,j0,T,di,dj;
+  inline void operator()(int i,int j,double z) {
+    int p=(i+di-i0)*T+(j+dj-j0);
+    double d=(REELLE) z+dz;
+    if(d<Dz[p]) Dz[p]=d;
+  }
+};
+
+// pixel d'un capteur virtuel : compte des pixels vus
+struct PixC {
+  REELLE *Z;
+  int i0,j0,T,n;
+  inline void operator()(int i,int j,double z) {
+    if(z<Z[(i-i0)*T+(j-j0)]) n++;
+  }
+};
+
+// colorie_triangle() restreint aux pixels [i0,i1[ x [j0,j1[ de l'ecran
+template <class Pixel>
+static void colorie_fenetre(const Punkt a,const Punkt b,const Punkt c, int Tx, int Ty,double tx, double ty,
+			    int i0,int i1,int j0,int j1,Pixel &f){
+  double penteL,penteR,xL,xR,zL,yrel,vab,vbc,z,dz;
+  register int i,j, iR,iL, deby,finy;
+  double K[2];
+  
+  K[0]=(Tx-1)/tx;
+  K[1]=(Ty-1)/ty;
+  penteL = (b[0] - a[0]) / (b[1] - a[1]);   
+  penteR = (c[0] - a[0]) / (c[1] - a[1]);  
+  if(b[1] > a[1]){
+    deby   = int(a[1]*K[1]+ 0.5);
+    finy   = int(b[1]*K[1]- 0.5);
+  }
+  else{
+    deby   = int(b[1]*K[1]+ 0.5);
+    finy   = int(a[1]*K[1]- 0.5);
+  }
+  if( finy<0 || deby>=Ty || deby>finy )
+    return;  
+  deby=max(0,deby);
+  finy=min(Ty-1,finy);
+  vab = (b[2] - a[2])/(b[1] - a[1]);
+  vbc = (c[2] - b[2])/(b[1] - a[1]);
+  yrel=((((double)deby+0.5)/K[1])-a[1]);
+  xL=penteL*yrel+a[0];
+  xR=penteR*yrel+a[0];
+  zL= a[2] + yrel*vab + ((c[2]-b[2])/(c[0]-b[0])*0.5/K[0]);
+  dz=vbc/(penteR-penteL)/K[0];
+  penteL/=K[1];
+  penteR/=K[1];
+  vab/=K[1]; 
+  // les lignes et les pixels hors fenetre sont parcourus (sans etre colories)
+  // pour que les increments donnent les memes valeurs que colorie_triangle()
+  for(j=deby;j<=finy && j<j1;j++){
+    if(j>=j0) {
+      iL=max(0,int(xL*K[0]+0.5));
+      iR=min(min(Tx-1,int(xR*K[0]-0.5)),i1-1); 
+      z = zL;
+      for(i=iL;i<=iR;i++){
+	if(i>=i0)
+	  f(i,j,z);
+	z = z+dz;
+      }
+    }
+    xL+=penteL;  
+    xR+=penteR;
+    zL+=vab;
+  }
+}// colorie_fenetre()
+
+// ajoute un demi-triangle (sommets dans l'ordre de colorie_triangle()) a L
+static void ajoute_demi(vector<Demi> &L,const Punkt a,const Punkt b,const Punkt c,int32_t id,
+			int T,double tx,double ty) {
+  Demi d;
+  double K0=(T-1)/tx, K1=(T-1)/ty;
+  for(int k=0;k<3;k++) {
+    d.a[k]=a[k];
+    d.b[k]=b[k];
+    d.c[k]=c[k];
+  }
+  d.id=id;
+  // majorant des pixels colories (a un pixel pres)
+  d.i0=max(0,(int)floor(min(a[0],min(b[0],c[0]))*K0)-1);
+  d.i1=min(T-1,(int)ceil(max(a[0],max(b[0],c[0]))*K0)+1);
+  d.j0=max(0,(int)floor(min(a[1],min(b[1],c[1]))*K1)-1);
+  d.j1=min(T-1,(int)ceil(max(a[1],max(b[1],c[1]))*K1)+1);
+  if(d.i0<=d.i1 && d.j0<=d.j1)
+    L.push_back(d);
+}//ajoute_demi()
+
+// range les demi-triangles de L dans les nt x nt tuiles de taille Tt
+static void range_demis(vector<Demi> &L,int Tt,int nt,vector<int> &debut,vector<int32_t> &idx,
+			vector<int> &curs) {
+  int n,ti,tj;
+  debut.assign(nt*nt+1,0);
+  for(n=0;n<(int)L.size();n++)
+    for(ti=L[n].i0/Tt;ti<=L[n].i1/Tt;ti++)
+      for(tj=L[n].j0/Tt;tj<=L[n].j1/Tt;tj++)
+	debut[ti*nt+tj+1]++;
+  for(n=0;n<nt*nt;n++)
+    debut[n+1]+=debut[n];
+  idx.resize(debut[nt*nt]);
+  curs.assign(debut.begin(),debut.end()-1);
+  for(n=0;n<(int)L.size();n++)
+    for(ti=L[n].i0/Tt;ti<=L[n].i1/Tt;ti++)
+      for(tj=L[n].j0/Tt;tj<=L[n].j1/Tt;tj++)
+	idx[curs[ti*nt+tj]++]=n;
+}//range_demis()
+
+//-*************** Canopy::projplan_tuiles() ************************
+// fin de projplan() en mode tuiles : z-buffer, infinitisation (translates
+// zb.trans), capteurs et eclairement direct, tuile par tuile
+void Canopy::projplan_tuiles(Zbuffer &zb,Vecteur &visee,double cdist,double du,double dv,
+			     double Apix,double *Bo) {
+  int Tt=zb.Tz, nt=(Timg+Tt-1)/Tt;
+  int ti,tj,t,i,j,i0,i1,j0,j1,si0,si1,sj0,sj1,bi,bj,b,oi,oj,g,nbpix;
+  unsigned int n,m,nummer;
+  size_t p,tsurf=(size_t)Tt*Tt;
+  int32_t id;
+  Diffuseur *pdiff;
+  PixZ pz;
+  PixD pd;
+  PixC pc;
+  
+  range_demis(zb.demis,Tt,nt,zb.debut,zb.idx,zb.curs);
+  range_demis(zb.capts,Tt,nt,zb.cdebut,zb.cidx,zb.curs);
+  zb.gpix.assign(zb.gnum.size(),0);
+  if(!zb.trans.empty() && zb.Ddata==NULL)
+    zb.Ddata=new double[tsurf];
+  pz.Z=pc.Z=zb.Zdata;
+  pz.Id=zb.Iddata;
+  pd.Dz=zb.Ddata;
+  pz.T=pd.T=pc.T=Tt;
+  for(ti=0;ti<nt;ti++)
+    for(tj=0;tj<nt;tj++) {
+      t=ti*nt+tj;
+      i0=ti*Tt; i1=min(Timg,i0+Tt);
+      j0=tj*Tt; j1=min(Timg,j0+Tt);
+      fill(zb.Zdata,zb.Zdata+tsurf,(REELLE)99999999999.9);
+      memset(zb.Iddata,0,tsurf*sizeof(int32_t));
+      pz.i0=pd.i0=pc.i0=i0;
+      pz.j0=pd.j0=pc.j0=j0;
+      // diffuseurs
+      for(n=zb.debut[t];n<(unsigned int)zb.debut[t+1];n++) {
+	Demi &d=zb.demis[zb.idx[n]];
+	pz.id=d.id;
+	colorie_fenetre(d.a,d.b,d.c,Timg,Timg,du,dv,i0,i1,j0,j1,pz);
+      }
+      // infinitisation : un pixel est ombre (Zid=0) si un translate le
+      // couvre plus pres que le diffuseur vu, comme avec infinitise_id()
+      if(!zb.trans.empty()) {
+	fill(zb.Ddata,zb.Ddata+tsurf,HUGE_VAL);
+	for(m=0;m<zb.trans.size();m+=2) {
+	  pd.di=zb.trans[m];
+	  pd.dj=zb.trans[m+1];
+	  pd.dz=cdist*pd.dj;
+	  // pixels de l'ecran translates dans la tuile
+	  si0=max(0,i0-pd.di); si1=min(Timg,i1-pd.di);
+	  sj0=max(0,j0-pd.dj); sj1=min(Timg,j1-pd.dj);
+	  if(si0>=si1 || sj0>=sj1)
+	    continue;
+	  for(bi=si0/Tt;bi<=(si1-1)/Tt;bi++)
+	    for(bj=sj0/Tt;bj<=(sj1-1)/Tt;bj++) {
+	      b=bi*nt+bj;
+	      for(n=zb.debut[b];n<(unsigned int)zb.debut[b+1];n++) {
+		Demi &d=zb.demis[zb.idx[n]];
+		oi=max(d.i0,si0);
+		oj=max(d.j0,sj0);
+		if(oi>min(d.i1,si1-1) || oj>min(d.j1,sj1-1))
+		  continue; // hors des pixels translates
+		if(oi/Tt!=bi || oj/Tt!=bj)
+		  continue; // traite avec une autre tuile de l'ecran
+		colorie_fenetre(d.a,d.b,d.c,Timg,Timg,du,dv,si0,si1,sj0,sj1,pd);
+	      }
+	    }
+	}
+	for(p=0;p<tsurf;p++)
+	  if(zb.Ddata[p]<zb.Zdata[p]) {
+	    zb.Zdata[p]=(REELLE) zb.Ddata[p];
+	    zb.Iddata[p]=0;
+	  }
+      }
+      // capteurs virtuels
+      for(n=zb.cdebut[t];n<(unsigned int)zb.cdebut[t+1];n++) {
+	Demi &d=zb.capts[zb.cidx[n]];
+	pc.n=0;
+	colorie_fenetre(d.a,d.b,d.c,Timg,Timg,du,dv,i0,i1,j0,j1,pc);
+	zb.gpix[d.id]+=pc.n;
+      }
+      //calcul de l'eclairage direct des pixels de la tuile
+      for(i=i0;i<i1;i++)
+	for(j=j0;j<j1;j++) {
+	  id=zb.Iddata[(i-i0)*Tt+(j-j0)];
+	  if(id!=0) {
+	    pdiff=Zdiff[id-1];
+	    nummer=pdiff->num_vu(visee);
+	    Bo[nummer]+=Apix;
+	    if(!pdiff->isopaque())
+	      Bo[pdiff->num_dos(visee)]-=Apix;
+	  }
+	}
+    }
+  // eclairement des capteurs, nbpix cumule sur les acv comme dans projplan()
+  nbpix=0;
+  for(g=0;g<(int)zb.gnum.size();g++) {
+    if(zb.gnew[g])
+      nbpix=0;
+    nbpix+=zb.gpix[g];
+    Bo[zb.gnum[g]]+=nbpix*Apix;
+  }
+}//Canopy::projplan_tuiles()
+
 void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
+  index_diff();
+  zbuf.alloue(Timg);
+  projplan(visee,infty,Bo,zbuf);
+}//Canopy::projplan()
+
+// decoupe le triangle projete Pp[0..2] (Pp[3] : travail) en demi-triangles
+// et les colorie dans zb, ou les range par tuile en mode tuiles
+void Canopy::dessine_diffuseur(Zbuffer &zb,Point *Pp,int32_t id,bool tuiles,double du,double dv) {
+  int i,j,k,l=0;
+  Punkt a,b,c;
+  double pente;
+  bool up,down;
+  if(aretes && !tuiles) { // triangle entier, sans decoupage en demis
+    pt2pkt(Pp[0],a);
+    pt2pkt(Pp[1],b);
+    pt2pkt(Pp[2],c);
+    colorie_aretes(id,zb.Zid,zb.Zbuf,a,b,c,Timg,Timg,du,dv);
+    return;
+  }
+  // Tri sommets tq Pp[i][1]<<Pp[j][1]<<Pp[k][1] ie A[1] < B[1] < C[1]
+  j = (Pp[1][1]>Pp[2][1])? 1: 2; // calc intermed
+  k = (Pp[0][1]>Pp[j][1])? 0: j; // indice max pour coord y
+  i = (k+1)%3; j= (i+1)%3;
+  i = (Pp[i][1]<Pp[j][1])? i : j; // indice min pour coord y
+  j = 3- i-k;
+  //       cout<<" (i,j,k) = "<<i<<j<<k<<endl;
+  if ((i!=k)&& !((A[0]==B[0])&&(B[0]==C[0]))&& !((A[1]==B[1])&&(B[1]==C[1]))){
+    // Pts A,B,Cpas  alignes selon les axes Xou Y
+    // tri Ok
+    up=down=false;
+    if (A[1]==B[1]) // up 
+    { i = (A[0] <B[0])?i:j;
+    j = 3-i-k; 
+    up=(A[0]==B[0])?false: true;
+    }//if up
+    else{
+      if(B[1] == C[1]){ // down 
+	k = (B[0] <C[0])?k:j; 
+	j = 3-i-k;
+	down =(B[0]==C[0])?false: true;
+      }//if down
+      else { 
+	D[1] = B[1];
+	pente=(D[1]-A[1])/(C[1]-A[1]);
+	D[0] = pente*(C[0]-A[0])+A[0];
+	// D[2] = (A[2]*(C[1]-D[1]) + C[2]*(D[1]-A[1]))/(C[1]-A[1]);
+	D[2] = pente*(C[2]-A[2])+A[2];
+	up=down=(B[0]==D[0])?false: true;
+	if(D[0]>B[0]) { l=i; i=j; j=3;}
+	else          { l=i; i=3;     }
+      }//else cas quelconque, ni up , ni down 
+    }
+    //     cout<<"2 (i,j,k) = "<<i<<j<<k<<endl;
+    // rappel syntaxe colorie_triangle()
+    //void colorie_triangle( void * tria,void *Zprim, double **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,void (*f)(void * Zprim, int i, int j, void* tria)){
+
+    if(up) {
+      pt2pkt(A,a);
+      pt2pkt(B,b);
+      pt2pkt(C,c);
+      /* printf(" UP : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
+      printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
+      printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
+      */
+      if(tuiles)
+	ajoute_demi(zb.demis,c,a,b,id,Timg,du,dv);
+      else
+	colorie_triangle(&id,zb.Zid,zb.Zbuf, c,a,b,Timg,Timg,du,dv,zproj_id);
+    }
+    if(down) {
+      if (up) { k=j; j=i; i=l; }
+      pt2pkt(A,a);
+      pt2pkt(B,b);
+      pt2pkt(C,c);
+      /* printf(" DOWN : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
+      printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
+      printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
+      */
+      if(tuiles)
+	ajoute_demi(zb.demis,a,b,c,id,Timg,du,dv);
+      else
+	colorie_triangle(&id,zb.Zid,zb.Zbuf, a,b,c, Timg,Timg,du,dv,zproj_id);
+    }// if down
+  }//if pas un triangle plat
+}//Canopy::dessine_diffuseur()
+
+void Canopy::projplan(Vecteur &visee,bool infty, double* Bo, Zbuffer &zb) {
   register int i,j,k,l,img_surf;
   Point roof[4];
-  REELLE **Zbuf,**pZbuf,*ptZ;
-  double tx,ty,costeta,Apix;
-  Diffuseur ***Zprim,***pZprim;
+  double tx,ty,costeta,Apix,cdist=0;
+  int32_t id,nid;
+  REELLE **Zbuf;
+  int32_t **Zid;
+  bool tuiles=(Ttuile>0 && Ttuile<Timg);
   l=0;
-  //   Tabdyn<REELLE, 2> Zbuf(img->taille(0),img->taille(1));
-  //Tabdyn<Diffuseur *, 2> Zprim(img->taille(0),img->taille(1));
   if(verbose>2) printf("%c => projplan() DEBUT res. %d x %d\n%c",7, Timg,Timg);
-  Zbuf= new REELLE*[Timg];
-  pZbuf=Zbuf;
+  // tampons persistants (d'une tuile en mode tuiles), remis a zero en bloc
+  zb.alloue(tuiles? Ttuile : Timg);
+  Zbuf=zb.Zbuf;
+  Zid=zb.Zid;
   img_surf=Timg*Timg;
-  for(i=0;i<Timg;i++,pZbuf++) {
-    (*pZbuf)=new REELLE[Timg];
-  }
-  pZbuf=Zbuf;
-  for(i=0;i<Timg;i++,pZbuf++) {
-    ptZ=*pZbuf;
-    for(j=0;j<Timg;j++,ptZ++)
-      *ptZ=99999999999.9;
+  if(tuiles) {
+    zb.demis.clear();
+    zb.capts.clear();
+    zb.gnum.clear();
+    zb.gnew.clear();
+    zb.trans.clear();
   }
-  Zprim=new Diffuseur**[Timg];
-  for(i=0,pZprim=Zprim;i<Timg;i++,pZprim++) {
-    (*pZprim)=new Diffuseur*[Timg];
-    for(j=0;j<Timg;j++,ptZ++)
-    (*pZprim)[j]=NULL;
+  else {
+    fill(zb.Zdata,zb.Zdata+img_surf,(REELLE)99999999999.9);
+    memset(zb.Iddata,0,img_surf*sizeof(int32_t));
   }
   //&&&&&& ProjPlan() &&&&&&&&&
   //calcul de laposition de l'ecran en fonction des bornes de la scene
@@ -539,6 +1044,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   costeta=-visee[2];
   
   if(fabs(visee[2]+1.0)<1e-6) {  
+#pragma omp critical (ferr)
     Ferr<<"Projplan(): cas de la visee verticale\n";
     Ecran[0][0]=vmin[0];
     Ecran[0][1]=vmax[1];
@@ -677,13 +1183,27 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   delta[1][0]=vmax[0]-vmin[0];
   delta[2][1]=vmax[1]-vmin[1];
   
+  // Z hierarchique (hors tuiles) : les diffuseurs sont d'abord projetes (dans
+  // l'ordre de Zdiff, pour la memoire) puis colories du plus proche au plus
+  // loin (profondeur min des sommets) ; un triangle entierement derriere les
+  // pixels deja ecrits n'est pas colorie
+  bool hier=(zhier && !tuiles);
+  double K0=(Timg-1)/du,K1=(Timg-1)/dv,zmin,zmax,den,gx,dz,Pix[3][2];
+  int32_t rang,ntris;
+  int pi0,pi1,pj0,pj1;
+  if(hier) {
+    zb.tris.clear();
+    zb.cle.clear();
+  }
+
   // Cas des primitives (non capteurs virtuels)
   // int comptr;
   //comptr=0;
-  for(Ldiff.debut();(! Ldiff.finito()) && Ldiff.contenu()->isreal();Ldiff.suivant()){
+  for(nid=0;nid<nZdiff;nid++){
     //Ferr<<"* diff no. "<<++comptr<<endl;
-    pdiff=Ldiff.contenu();
+    pdiff=Zdiff[nid];
     pastoutvu=false;
+    id=nid+1; // indice du diffuseur dans Zid
     //cout <<"Canopy[projplan] primitive = "<<pdiff->primi().name()<<endl;
     //cout <<"Canopy[projplan] P{Re} = ";Ecran[i+1].show();
     /*if( (Ecran[i+1][2]<0.0) || pastoutvu){  // Prim  PARTIELLEMENT pas vue
@@ -714,75 +1234,81 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	  Pp[i][1]=Ecran[i+1][1];
 	  Pp[i][2]=Ecran[i+1][2];//distZ;
 	}//for triangle
-	// Tri sommets tq Pp[i][1]<<Pp[j][1]<<Pp[k][1] ie A[1] < B[1] < C[1]
-	j = (Pp[1][1]>Pp[2][1])? 1: 2; // calc intermed
-	k = (Pp[0][1]>Pp[j][1])? 0: j; // indice max pour coord y
-      i = (k+1)%3; j= (i+1)%3;
-      i = (Pp[i][1]<Pp[j][1])? i : j; // indice min pour coord y
-      j = 3- i-k;
-      //       cout<<" (i,j,k) = "<<i<<j<<k<<endl;
-      if ((i!=k)&& !((A[0]==B[0])&&(B[0]==C[0]))&& !((A[1]==B[1])&&(B[1]==C[1]))){
-	// Pts A,B,Cpas  alignes selon les axes Xou Y
-	// tri Ok
-	up=down=false;
-	if (A[1]==B[1]) // up 
-	{ i = (A[0] <B[0])?i:j;
-	j = 3-i-k; 
-	up=(A[0]==B[0])?false: true;
-	}//if up
-	else{
-	  if(B[1] == C[1]){ // down 
-	    k = (B[0] <C[0])?k:j; 
-	    j = 3-i-k;
-	    down =(B[0]==C[0])?false: true;
-	  }//if down
-	  else { 
-	    D[1] = B[1];
-	    pente=(D[1]-A[1])/(C[1]-A[1]);
-	    D[0] = pente*(C[0]-A[0])+A[0];
-	    // D[2] = (A[2]*(C[1]-D[1]) + C[2]*(D[1]-A[1]))/(C[1]-A[1]);
-	    D[2] = pente*(C[2]-A[2])+A[2];
-	    up=down=(B[0]==D[0])?false: true;
-	    if(D[0]>B[0]) { l=i; i=j; j=3;}
-	    else          { l=i; i=3;     }
-	  }//else cas quelconque, ni up , ni down 
+	if(!hier)
+	  dessine_diffuseur(zb,Pp,id,tuiles,du,dv);
+	else { // tri par profondeur min, puis dessin
+	  zb.tris.push_back(Projete());
+	  Projete &t=zb.tris.back();
+	  for(i=0;i<3;i++)
+	    for(k=0;k<3;k++)
+	      t.p[i][k]=Pp[i][k];
+	  t.id=id;
+	  zb.cle.push_back(min(Pp[0][2],min(Pp[1][2],Pp[2][2])));
 	}
-	//     cout<<"2 (i,j,k) = "<<i<<j<<k<<endl;
-	// rappel syntaxe colorie_triangle()
-	//void colorie_triangle( void * tria,void *Zprim, double **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,void (*f)(void * Zprim, int i, int j, void* tria)){
-
-	if(up) {
-	  pt2pkt(A,a);
-	  pt2pkt(B,b);
-	  pt2pkt(C,c);
-	  /* printf(" UP : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
-	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
-	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
-	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, c,a,b,Timg,Timg,du,dv,zproj);
-	}
-	if(down) {
-	  if (up) { k=j; j=i; i=l; }
-	  pt2pkt(A,a);
-	  pt2pkt(B,b);
-	  pt2pkt(C,c);
-	  /* printf(" DOWN : \tA[0]= %g, A[1]=%g, A[2]=%g\n",A[0], A[1],A[2]);
-	  printf(" \t\tB[0]= %g, B[1]=%g, B[2]=%g\n",B[0], B[1],B[2]);
-	  printf(" \t\tC[0]= %g, C[1]=%g, C[2]=%g\n",C[0], C[1],C[2]);
-	  */
-	  colorie_triangle(pdiff,Zprim,Zbuf, a,b,c, Timg,Timg,du,dv,zproj);
-	}// if down
-      }//if pas un triangle plat
     }//if !pastoutvu 
   }// for liste diffuseurs
 
+  if(hier) {
+    // du plus proche au plus loin par tranches de profondeur min (ordre de
+    // Zdiff dans une tranche) : tri par denombrement
+    ntris=zb.tris.size();
+    zb.ordre.resize(ntris);
+    zb.tranche.assign(TRANCHES+1,0);
+    if(ntris>0) {
+      zmin=*min_element(zb.cle.begin(),zb.cle.end());
+      zmax=*max_element(zb.cle.begin(),zb.cle.end());
+      dz=(zmax>zmin)? (TRANCHES-1)/(zmax-zmin) : 0.0;
+      for(rang=0;rang<ntris;rang++)
+	zb.tranche[(int)((zb.cle[rang]-zmin)*dz)+1]++;
+      for(i=0;i<TRANCHES;i++)
+	zb.tranche[i+1]+=zb.tranche[i];
+      for(rang=0;rang<ntris;rang++)
+	zb.ordre[zb.tranche[(int)((zb.cle[rang]-zmin)*dz)]++]=rang;
+    }
+    zb.hz.init(Timg,(REELLE)99999999999.9);
+    for(rang=0;rang<ntris;rang++) {
+      const Projete &t=zb.tris[zb.ordre[rang]];
+      for(i=0;i<3;i++)
+	for(k=0;k<3;k++)
+	  Pp[i][k]=t.p[i][k];
+      // pixels pouvant etre colories (+1 de marge) et minorant de leur
+      // profondeur : colorie_triangle() evalue z a 1/2 pixel (en x) au
+      // plus hors du triangle
+      zmin=min(Pp[0][2],min(Pp[1][2],Pp[2][2]));
+      zmax=max(Pp[0][2],max(Pp[1][2],Pp[2][2]));
+      pi0=max(0,(int)floor(min(Pp[0][0],min(Pp[1][0],Pp[2][0]))*K0)-1);
+      pi1=min(Timg-1,(int)ceil(max(Pp[0][0],max(Pp[1][0],Pp[2][0]))*K0)+1);
+      pj0=max(0,(int)floor(min(Pp[0][1],min(Pp[1][1],Pp[2][1]))*K1)-1);
+      pj1=min(Timg-1,(int)ceil(max(Pp[0][1],max(Pp[1][1],Pp[2][1]))*K1)+1);
+      den=(Pp[1][0]-Pp[0][0])*(Pp[2][1]-Pp[0][1])-(Pp[1][1]-Pp[0][1])*(Pp[2][0]-Pp[0][0]);
+      zb.nproj++;
+      if(pi0<=pi1 && pj0<=pj1) {
+	if(den!=0) {
+	  gx=((Pp[1][2]-Pp[0][2])*(Pp[2][1]-Pp[0][1])-(Pp[1][1]-Pp[0][1])*(Pp[2][2]-Pp[0][2]))/den;
+	  dz=0.5*fabs(gx)/K0+1e-6*(fabs(zmin)+zmax-zmin);
+	  for(i=0;i<3;i++) {
+	    Pix[i][0]=Pp[i][0]*K0;
+	    Pix[i][1]=Pp[i][1]*K1;
+	  }
+	  if(zb.hz.cache(Pix,pi0,pi1,pj0,pj1,zmin-dz,Zbuf)) {
+	    zb.ncache++;
+	    continue;
+	  }
+	  zb.hz.marque(pi0,pi1,pj0,pj1,zmin-dz,zmax+dz);
+	}
+	else
+	  zb.hz.sale(pi0,pi1,pj0,pj1);
+      }
+      dessine_diffuseur(zb,Pp,t.id,false,du,dv);
+    }
+  }
+
   //Infinitisation
   if(infty && visee[2]>-1+1e-6) {
-    int **roofi;
-    double cdist;//cste de distance ne depend que de l'inclinaison de la visee
-    roofi=new int*[4];
+    int roofd[4][2],*roofi[4];
+    //cdist : cste de distance ne depend que de l'inclinaison de la visee
     for(i=0;i<4;i++) {
-      roofi[i]=new int[2];
+      roofi[i]=roofd[i];
       roof[i]-=SvE;
       roof[i]=roof[i].chgt_base(v,w,u);
       roofi[i][0] = (int)(roof[i][0]*(Timg)/du);
@@ -790,10 +1316,10 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
       }
     cdist=tan(Macos(-visee[2]))*dv/(double)Timg;
     //infinitisation sans duplication des primi (juste ombrage)
-    infinitise((void ***)Zprim,Zbuf,cdist,roofi,Timg,Timg,false);
-    for(i=0;i<4;i++)
-      delete [] roofi[i];
-    delete [] roofi;
+    if(tuiles)
+      translates_infini(roofi,Timg,Timg,zb.trans); // appliques par tuile
+    else
+      infinitise_id(Zid,Zbuf,zb.Zcopy,cdist,roofi,Timg,Timg);
   }//if infty
   
 //Valeur d'un pixel 
@@ -804,12 +1330,8 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
   // Cas des capteurs virtuels 
   if(nbcell>0){  
     int nbpix;
-    for( ;! Ldiff.finito();Ldiff.suivant()){
-      pdiff=Ldiff.contenu();
-      if(pdiff->isreal()){
-	Ferr <<"<!> Attention triangle reel dans la liste capteur virtuel!!\n";
-	continue;
-      }
+    for(nid=0;nid<nZcapt;nid++){
+      pdiff=Zcapt[nid];
       // Ferr<<"\t prodscal="<<visee.prod_scalaire(pdiff->normal())<<endl;
       if(visee.prod_scalaire(pdiff->normal())<0){//capteur bien vu par dessus
 	nbpix=0;
@@ -822,6 +1344,11 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	for(acv_idx=0;acv_idx<=acv_fin;acv_idx++) {
 	  if(acv_idx==1 && pdiff->acv==2)
 	    acv_idx++;
+	  if(tuiles) { // les pixels seront comptes par projplan_tuiles()
+	    id=zb.gnum.size();
+	    zb.gnum.push_back(pdiff->num());
+	    zb.gnew.push_back(acv_idx==0);
+	  }
 	  for(i=0;i<3;i++) { // Cas des triangles
 	    Ecran[i+1]=pdiff->primi()[i];
 	    Ecran[i+1]+=delta[acv_idx];
@@ -868,35 +1395,45 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	      pt2pkt(A,a);
 	      pt2pkt(B,b);
 	      pt2pkt(C,c);
-	      colorie_capteur(Zbuf, c,a,b,Timg,Timg,du,dv,nbpix);
+	      if(tuiles)
+		ajoute_demi(zb.capts,c,a,b,id,Timg,du,dv);
+	      else
+		colorie_capteur(Zbuf, c,a,b,Timg,Timg,du,dv,nbpix);
 	    }
 	    if(down) {
 	      if (up) { k=j; j=i; i=l; }
 	      pt2pkt(A,a);
 	      pt2pkt(B,b);
 	      pt2pkt(C,c);
-	      colorie_capteur(Zbuf, a,b,c, Timg,Timg,du,dv,nbpix) ;
+	      if(tuiles)
+		ajoute_demi(zb.capts,a,b,c,id,Timg,du,dv);
+	      else
+		colorie_capteur(Zbuf, a,b,c, Timg,Timg,du,dv,nbpix) ;
 	    }// if down
 	  }//if pas un triangle plat
 	  //maj de l'eclairement 
 	  //Ferr <<"Capt no. "  << (int)(pdiff->num())<<" => nbpix=" 
 	  //     << nbpix<<"\n" ;
 
-	  Bo[pdiff->num()]+=nbpix*Apix;
+	  if(!tuiles)
+	    Bo[pdiff->num()]+=nbpix*Apix;
 	}//for acv
       }//if vu par au-dessus
     }// for liste diffuseurs
   }  // Fin traitt Capteurs virtuels 
   
-  //maj de l'image en fonction de Zprim
+  //maj de l'image en fonction de Zid
   double cocnomen,alt;
   int nummer;
   double cocmax=0, cocmin=99999999999.,altmin=99999999.,altmax=0;
   //calcul de l'eclairage direct
   if(verbose>1) printf("projplan() : du=%lf - dv=%lf =>  Apix= %lf\n",du,dv,Apix);
+  if(tuiles)
+    projplan_tuiles(zb,visee,cdist,du,dv,Apix,Bo);
+  else
   for(i=0;i<Timg;i++)
     for(j=0;j<Timg;j++) {
-      pdiff=Zprim[i][j];
+      pdiff=(Zid[i][j]==0)? NULL : Zdiff[Zid[i][j]-1];
       if(0){
 	cocnomen=(pdiff==NULL)? 0:pdiff->primi().name()/1e7;
 	alt=(pdiff==NULL)? 0: 100*Zbuf[i][j];
@@ -905,22 +1442,13 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
 	altmax=(alt>altmax) ? alt:altmax;
 	altmin=(alt<altmin) ? alt:altmin;
       }
-      //calcul de la visibilite'
+      //calcul de la visibilite' (sans changer la face active des diffuseurs)
       if(pdiff!=NULL) {
-	nummer=pdiff->num();
-	pdiff->active(visee);
-        //printf("projplan : img(%d,%d)=%d\n",i,j,pdiff->num());
-	Bo[pdiff->num()]+=Apix;
-	if(!pdiff->isopaque()) {
-	  pdiff->togle_face();
-	  Bo[pdiff->num()]-=Apix;
-	  pdiff->togle_face();
-	}//si transparent
-	pdiff->activ_num(nummer);
-        if(pdiff->num()!=nummer){
-	  Ferr <<" pdiff->num()!=nummer\n" ;
-          exit(5);
-        }
+	nummer=pdiff->num_vu(visee);
+        //printf("projplan : img(%d,%d)=%d\n",i,j,nummer);
+	Bo[nummer]+=Apix;
+	if(!pdiff->isopaque())
+	  Bo[pdiff->num_dos(visee)]-=Apix;
       }
     }
 
@@ -938,7 +1466,7 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
  cocmin-=((cocmax-cocmin>0?cocmax-cocmin:1))/10.;
  for(i=Timg-1;i>=0;i--)
    for(j=Timg-1;j>=0;j--) {
-     pdiff=Zprim[i][j];
+     pdiff=(Zid[i][j]==0)? NULL : Zdiff[Zid[i][j]-1];
      alt=(pdiff==NULL)? altmax: 100*Zbuf[i][j];
      bit= (unsigned char) ((alt-altmin)/(altmax-altmin)*255);
      bit=(bit>255|| bit<0)?255:bit;
@@ -951,14 +1479,6 @@ void Canopy::projplan(Vecteur &visee,bool infty, double* Bo) {
  fclose(fz);
  fclose(fprim);
  */
- // libere les Xbuff
- pZbuf=Zbuf;
- for(i=0;i<Timg;i++,pZbuf++) 
-   delete [] (*pZbuf);
- delete []  Zbuf;
- for(i=0,pZprim=Zprim;i<Timg;i++,pZprim++) 
-   delete [] (*pZprim);
- delete Zprim;
  if(verbose>2) printf("<= projplan() FIN\n%c",7);
 }//Canopy::projplan()
 
@@ -1054,6 +1574,97 @@ void colorie_triangle( void * tria,void *Zprim, REELLE **Zbuf,const Punkt a,cons
 }// colorie_triangle()
 
 
+//-*************** colorie_aretes() ************************
+// Variante de colorie_triangle() pour un triangle entier (sans decoupage en
+// demis) : fonctions d'aretes incrementales en virgule fixe (1/16 pixel),
+// regle haut-gauche pour les pixels sur une arete commune, test de
+// profondeur et ecriture de l'id en ligne. Les pixels ont les memes centres
+// que dans colorie_triangle(), seuls ceux des aretes peuvent differer.
+// Pour chaque colonne i, les pixels j ou les 3 fonctions sont >=0 sont
+// calcules en entiers, puis parcourus dans la colonne contigue Zbuf[i][.].
+
+#define SOUSPIX 16
+
+void colorie_aretes(int32_t id,int32_t **Zid,REELLE **Zbuf,const Punkt a,const Punkt b,const Punkt c, int Tx, int Ty,double tx, double ty){
+  double K[2],P[3][3],den,dzdi,dzdj,z0,z;
+  int64_t X[3],Y[3],di[3],dj[3],ei[3],aire,kmin,kmax,k;
+  int i,j,jfin,n,m,imin,imax,jmin,jmax;
+  REELLE *pz;
+  int32_t *pid;
+
+  K[0]=(Tx-1)/tx;
+  K[1]=(Ty-1)/ty;
+  // sommets en pixels, puis en virgule fixe
+  for(n=0;n<3;n++) {
+    const double *s=(n==0)? a : ((n==1)? b : c);
+    P[n][0]=s[0]*K[0];
+    P[n][1]=s[1]*K[1];
+    P[n][2]=s[2];
+    X[n]=(int64_t) floor(P[n][0]*SOUSPIX+0.5);
+    Y[n]=(int64_t) floor(P[n][1]*SOUSPIX+0.5);
+  }
+  aire=(X[1]-X[0])*(Y[2]-Y[0])-(Y[1]-Y[0])*(X[2]-X[0]);
+  if(aire==0)
+    return; // triangle plat
+  if(aire<0) { // sens direct
+    swap(X[1],X[2]); swap(Y[1],Y[2]);
+    for(m=0;m<3;m++) swap(P[1][m],P[2][m]);
+  }
+  // pixels dont le centre (i+0.5,j+0.5) peut etre dans le triangle
+  imin=max(0,(int) ceil((min(X[0],min(X[1],X[2]))-SOUSPIX/2)/(double)SOUSPIX));
+  imax=min(Tx-1,(int) floor((max(X[0],max(X[1],X[2]))-SOUSPIX/2)/(double)SOUSPIX));
+  jmin=max(0,(int) ceil((min(Y[0],min(Y[1],Y[2]))-SOUSPIX/2)/(double)SOUSPIX));
+  jmax=min(Ty-1,(int) floor((max(Y[0],max(Y[1],Y[2]))-SOUSPIX/2)/(double)SOUSPIX));
+  if(imin>imax || jmin>jmax)
+    return;
+  // plan de profondeur
+  den=(P[1][0]-P[0][0])*(P[2][1]-P[0][1])-(P[1][1]-P[0][1])*(P[2][0]-P[0][0]);
+  dzdi=((P[1][2]-P[0][2])*(P[2][1]-P[0][1])-(P[1][1]-P[0][1])*(P[2][2]-P[0][2]))/den;
+  dzdj=((P[1][0]-P[0][0])*(P[2][2]-P[0][2])-(P[1][2]-P[0][2])*(P[2][0]-P[0][0]))/den;
+  z0=P[0][2]+dzdi*(imin+0.5-P[0][0])+dzdj*(jmin+0.5-P[0][1]);
+  // arete n : de n a m=(n+1)%3, positive a l'interieur ; un pixel sur une
+  // arete haute ou gauche est dedans, sur une autre arete dehors
+  for(n=0;n<3;n++) {
+    m=(n+1)%3;
+    di[n]=-(Y[m]-Y[n])*SOUSPIX;
+    dj[n]=(X[m]-X[n])*SOUSPIX;
+    ei[n]=(X[m]-X[n])*(jmin*SOUSPIX+SOUSPIX/2-Y[n])-(Y[m]-Y[n])*(imin*SOUSPIX+SOUSPIX/2-X[n]);
+    if(!(Y[m]<Y[n] || (Y[m]==Y[n] && X[m]<X[n])))
+      ei[n]--;
+  }
+  for(i=imin;i<=imax;i++) {
+    // pixels jmin+k, kmin<=k<=kmax, de la colonne i dans le triangle
+    kmin=0; kmax=jmax-jmin;
+    // (divisions seulement pour les aretes qui coupent la colonne)
+    for(n=0;n<3;n++)
+      if(ei[n]<0) {
+	if(dj[n]>0)
+	  kmin=max(kmin,(-ei[n]+dj[n]-1)/dj[n]);
+	else
+	  kmax=-1;
+      }
+      else if(dj[n]<0 && ei[n]+kmax*dj[n]<0)
+	kmax=ei[n]/(-dj[n]);
+    if(kmin<=kmax) {
+      pz=Zbuf[i];
+      pid=Zid[i];
+      k=kmin;
+      z=z0+k*dzdj;
+      jfin=jmin+(int)kmax;
+      for(j=jmin+(int)kmin;j<=jfin;j++) {
+	if(z<pz[j]) {
+	  pz[j]=(REELLE) z;
+	  pid[j]=id;
+	}
+	z+=dzdj;
+      }
+    }
+    ei[0]+=di[0]; ei[1]+=di[1]; ei[2]+=di[2];
+    z0+=dzdi;
+  }
+}// colorie_aretes()
+
+
 /***** colorie_capteur() *****/
  void colorie_capteur(REELLE **Zbuf,Punkt a,Punkt b,Punkt c, int Tx, int Ty,double tx, double ty,int& pB0){
  double penteL,penteR,xL,xR,zL,yrel,vab,vac,vbc,z,dz; // L Left, R  Right
@@ -22,6 +22,11 @@ using namespace std ;
 #include "canopy.h"
 #include "outils.h"
 
+#include <cstring>
+#ifndef WIN32
+#include <sys/mman.h>
+#endif
+
 /*
 char clef_seg_in[12] ;	//  version char* de la clef numerique
 HANDLE	hSharedSegIn ;	// Handle du fichier mapp
@@ -32,20 +37,20 @@ LPVOID	lpSharedSegIn ;	// pointeur LPVOID sur seg. partag
  **************************************************************************/
 void syntax_error(char * nomfic)
  { Ferr<<" Class Canopy Erreur de syntaxe dans le fichier "<<nomfic<<"\n";
-   exit(6); 
+   prog_terminate(6); 
  }  
 void  err_syntax(char*msg){
   Ferr <<" \n\n<!>dans canopy_io.C, pb Capteur virtuel =>" ;
   Ferr  << msg<<"" ;
   Ferr << '\n' ;
-  exit(7);
+  prog_terminate(7);
   }
 
 void  err_syntax( string msg){
   Ferr <<" \n\n<!>dans canopy_io.C, pb Capteur virtuel =>" ;
   Ferr  << msg<<"" ;
   Ferr << '\n' ;
-  exit(8);
+  prog_terminate(8);
   }
 
 bool opak=true;
@@ -122,7 +127,95 @@ inline char * endline(ifstream & fin){
   return pline;
 }//endline()
 
+//-********************   Sources de triangles    ***********************
+// Patch : t = -i opaque de l'espece i, 0 sol, i transparent de l'espece i
+void PatchSource::get(int it,float P[3][3],double &nom,short &specie,bool &opak){
+  specie=(short)(fabs(double(Ts[it].t))); // HA cast double 11 2003
+  opak=(Ts[it].t<=0)? true : false;
+  nom=(double)(Ts[it].t);
+  memcpy(P,Ts[it].P,sizeof(Ts[it].P));
+}
+
+// .canb : entete de 24 octets (cf. canopy.h), sommets (n*9 float ou double)
+// completes a un multiple de 8 octets, puis n libelles int64 (label du .can)
+bool CanbSource::is_canb(char *name){
+  char magic[4]={0,0,0,0};
+  FILE *f=fopen(name,"rb");
+  if(f==NULL)
+    return false;
+  size_t lu=fread(magic,1,4,f);
+  fclose(f);
+  return lu==4 && strncmp(magic,CANB_MAGIC,4)==0;
+}
+
+CanbSource::CanbSource(char *name){
+  FILE *f=fopen(name,"rb");
+  if(f==NULL){
+    Ferr << "ERREUR - Impossible d'ouvrir :"<<name<<'\n' ;
+    prog_terminate(10);
+  }
+  fseek(f,0,SEEK_END);
+  len=ftell(f);
+  fseek(f,0,SEEK_SET);
+  if(len<CANB_HEADER){
+    Ferr << "ERREUR - Fichier .canb tronque :"<<name<<'\n' ;
+    prog_terminate(10);
+  }
+#ifndef WIN32
+  data=(char *)mmap(NULL,len,PROT_READ,MAP_PRIVATE,fileno(f),0);
+  if(data==(char *)MAP_FAILED){
+    Ferr << "ERREUR - Projection en memoire impossible :"<<name<<'\n' ;
+    prog_terminate(10);
+  }
+#else
+  data=new char[len];
+  fread(data,1,len,f);
+#endif
+  fclose(f);
+  uint32_t version;
+  uint64_t n;
+  memcpy(&version,data+4,4);
+  memcpy(&fsize,data+8,4);
+  memcpy(&n,data+16,8);
+  nb=(int)n;
+  vblock=((size_t)nb*9*fsize+7)/8*8;
+  if(version!=1 || (fsize!=4 && fsize!=8) || len<CANB_HEADER+vblock+(size_t)nb*8){
+    Ferr << "ERREUR - Entete .canb invalide :"<<name<<'\n' ;
+    prog_terminate(10);
+  }
+}
+
+CanbSource::~CanbSource(){
+#ifndef WIN32
+  munmap(data,len);
+#else
+  delete [] data;
+#endif
+}
+
+void CanbSource::get(int it,float P[3][3],double &nom,short &specie,bool &opak){
+  int64_t label;
+  const char *v=data+CANB_HEADER+(size_t)it*9*fsize;
+  if(fsize==4)
+    memcpy(P,v,9*sizeof(float));
+  else{
+    double d[9];
+    memcpy(d,v,sizeof(d));
+    for(int k=0;k<9;k++)
+      P[k/3][k%3]=(float)d[k];
+  }
+  memcpy(&label,data+CANB_HEADER+vblock+(size_t)it*8,8);
+  //format label : esp*1E11 + plante*1e6 + feuille*1E3 + triangle (cf. parse_can)
+  nom=(double)label;
+  specie=(short)(label/100000000000LL);
+  opak=((label/1000)%1000==0)? true : false;
+}
+
 long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,reel*bornemax,int sol,char *nsolem,Diffuseur **&TabDiff){
+  // scene binaire (.canb) : lue par projection en memoire
+  if(CanbSource::is_canb(ngeom))
+    return read_canb(ngeom,nopti,name8,bornemin,bornemax,sol,nsolem,TabDiff);
+
   bool rejet=false;
   int i=0,j;
   long nbp=0;
@@ -138,14 +231,14 @@ long int Canopy::parse_can(char *ngeom,char *nopti,char * name8,reel *bornemin,r
   if (!fopti){
     Ferr << "ERREUR - Impossible d'ouvrir :"<<nopti<<'\n' ;//endl;
     //Ferr.flush();
-    exit(9);
+    prog_terminate(9);
   }
   
   ifstream fgeom(ngeom,ios::in);
   if (!fgeom){
     Ferr << "ERREUR - Impossible d'ouvrir :"<<ngeom<<'\n' ;//endl;;
     //Ferr->flush();
-    exit(10);
+    prog_terminate(10);
   }
   // lecture des proprietes optiques (fichier '.opt')
   do{
@@ -544,25 +637,10 @@ long int Canopy::read_shm(
 	char *nsolem,
 	Diffuseur **&TabDiff)
 {
-  bool rejet=false;
-  int i=0,j,it,nbp=0,Nt;
-  Diffuseur* diff;
-  ifstream fopti(nopti,ios::in);
-  char c, line[256];
-  double popt[4];
-  int nbopt=0,ii=0;
-  Tabdyn<Actop*,1> tabopaque;
-  Tabdyn<Actop*,2> tabtransp;
-  Actop *testopt; 
+  int Nt;
+  long int nbf;
   Patch *Ts;
 
- 
-  if (!fopti){
-    Ferr << "ERREUR - Impossible d'ouvrir :"<<nopti<<'\n' ;//endl;;
-    //Ferr->flush();
-    exit(11);
-  }
-
   // initialisation du segpar 
   //BUG MC feb 2006 !!!:  Nt=clef/100;
   Nt=clef/100-1;
@@ -571,13 +649,19 @@ long int Canopy::read_shm(
 #ifndef WIN32
   // Unix
   int shmid;
-  shmid=shmget((key_t)clef,SEGSIZE*sizeof(Patch) ,IPC_CREAT|0666);
+  // segment dimensionne sur Nt (SEGSIZE limitait la taille des scenes)
+  shmid=shmget((key_t)clef,Nt*sizeof(Patch) ,IPC_CREAT|0666);
   if(shmid==-1){//en cas de pb
     Ferr << "<!> ouverture du segment partage no. "<< clef
 	 <<" impossible =>exit" << "\n" ;
-    exit(12);
+    prog_terminate(12);
+  }
+  Ts=(Patch *)shmat(shmid,0,0);
+  if(Ts==(Patch *)-1){
+    Ferr << "<!> attachement du segment partage no. "<< clef
+	 <<" impossible =>exit" << "\n" ;
+    prog_terminate(12);
   }
-  Ts=(Patch *)shmat(shmid,0,NULL);
 #else
   // Win NT
      char clef_seg_in[12] ;	//  version char* de la clef numerique
@@ -601,6 +685,89 @@ long int Canopy::read_shm(
 #endif
       if(true||verbose) 
 	Ferr <<"Canestra{read_shm] Clef="  << clef<<", Nt="  << Nt<<"\n" ;
+
+  nbf=read_patches(Ts,Nt,nopti,name8,bornemin,bornemax,sol,nsolem,TabDiff);
+
+  //liberation du shm
+#ifndef WIN32
+  // Unix
+  shmdt((void*)Ts);
+#else
+  // Win NT
+    UnmapViewOfFile(lpSharedSegIn) ; // invalidation du ptr sur mem partagee
+    // Ts = NULL ;		   // tester avant ...
+    CloseHandle(hSharedSegIn) ;	   // Fermeture du fichier mapp
+#endif
+  return nbf;
+}//read_shm()
+
+//-********************   Canopy::read_patches()    ***********************
+// Chargement de la scene depuis un tableau de Nt Patch (segment partage ou
+// memoire de l'appelant - canestra2py) 
+long int Canopy::read_patches(
+	Patch *Ts,
+	int Nt,
+	char *nopti,
+	char *name8,
+	reel *bornemin,
+	reel *bornemax,
+	int sol,
+	char *nsolem,
+	Diffuseur **&TabDiff)
+{
+  PatchSource src(Ts,Nt);
+  return read_source(src,nopti,name8,bornemin,bornemax,sol,nsolem,TabDiff);
+}//read_patches()
+
+//-********************   Canopy::read_canb()    ***********************
+// Chargement de la scene depuis un fichier binaire .canb (projete en memoire)
+long int Canopy::read_canb(
+	char *ngeom,
+	char *nopti,
+	char *name8,
+	reel *bornemin,
+	reel *bornemax,
+	int sol,
+	char *nsolem,
+	Diffuseur **&TabDiff)
+{
+  long int nbf;
+  CanbSource src(ngeom);
+  nbf=read_source(src,nopti,name8,bornemin,bornemax,sol,nsolem,TabDiff);
+  return nbf;
+}//read_canb()
+
+//-********************   Canopy::read_source()    ***********************
+// Chargement de la scene depuis une source de triangles (cf. TriSource)
+long int Canopy::read_source(
+	TriSource &src,
+	char *nopti,
+	char *name8,
+	reel *bornemin,
+	reel *bornemax,
+	int sol,
+	char *nsolem,
+	Diffuseur **&TabDiff)
+{
+  bool rejet=false;
+  int i=0,j,it,nbp=0;
+  Diffuseur* diff;
+  ifstream fopti(nopti,ios::in);
+  char c, line[256];
+  double popt[4];
+  int nbopt=0,ii=0;
+  Tabdyn<Actop*,1> tabopaque;
+  Tabdyn<Actop*,2> tabtransp;
+  Actop *testopt; 
+
+ 
+  if (!fopti){
+    Ferr << "ERREUR - Impossible d'ouvrir :"<<nopti<<'\n' ;//endl;;
+    //Ferr->flush();
+    prog_terminate(11);
+  }
+  // opak a pu etre modifie par un chargement precedent (appels en memoire)
+  opak=true;
   // lecture des proprietes optiques (fichier '.opt')
   do{
     fopti>>c; 
@@ -673,15 +840,14 @@ long int Canopy::read_shm(
   short specie;
   char acv;
   int Nrejet=0;
-  Ferr <<" read_shm() nombre de triangles="  << Nt<<"\n" ;
+  int Nt=src.size();
+  float P[3][3];
+  Ferr <<" read_source() nombre de triangles="  << Nt<<"\n" ;
   for(it=0;it<Nt;it++){
-    //identifiants
-    //format label : -i opaque, 0 sol, i transparent de l'esp i
-    specie=(short)(fabs(double(Ts[it].t))); // HA cast double 11 2003
-    opak=(Ts[it].t<=0)? true : false;
-    nom=(double)(Ts[it].t);
+    //identifiants et geometrie
+    src.get(it,P,nom,specie,opak);
     //-** saisie de la geometrie
-    prim=new Polygone(Ts[it].P,nom,min,max);
+    prim=new Polygone(P,nom,min,max);
 
     //Ferr <<"=>  it="  << it<<", prim="  << (long)prim<<"\n" ;
 
@@ -691,6 +857,10 @@ long int Canopy::read_shm(
     if(min[0]>max[0]){ //primitive rejete
       Ferr <<" *****  Primitive rejete car min>max!?: libelle = "<<nom<<" - No="<<it<<'\n' ;
       rejet=true;
+      //label >=0 : triangle rejete dans Ldiff0 (cf. genres)
+      Ldiff0.ajoute(fabs(nom));
+      delete prim;
+      Nrejet++;
     }
     /* Traitement des a-cheval ici et non dans BSP::volume_englobant,
        co parcinopy a cause de visu3d.C*/
@@ -727,6 +897,7 @@ long int Canopy::read_shm(
       }//if infty
       if(rejet) {
 	Ferr<<"* Prim no "<<it<<" ==> rejettee"<<"\n";
+	Ldiff0.ajoute(fabs(nom));
 	delete prim;
 	Nrejet++;
       }
@@ -747,23 +918,13 @@ long int Canopy::read_shm(
 	//cout<<"numero = "<<diff->num()<<'\n' ;//endl;
 	diff->acv=acv;
 	Ldiff.ajoute(diff);
+	Ldiff0.ajoute(-1); //bon triangle : code label <0
 	nbp++;
       }//else rejected primi
     }//if valid
   }//for it
 
-  //liberation du shm
-#ifndef WIN32
-  // Unix
-  shmdt((void*)shmid);
-#else
-  // Win NT
-    UnmapViewOfFile(lpSharedSegIn) ; // invalidation du ptr sur mem partagee
-    // Ts = NULL ;		   // tester avant ...
-    CloseHandle(hSharedSegIn) ;	   // Fermeture du fichier mapp
-#endif
-
-   if(rejet){
+   if(Nrejet){
      char Tmsg[100];
      sprintf(Tmsg,">>>  Canopy[read_shm] ****** %d  rejected triangles ****",Nrejet);
      cout <<Tmsg<<"\n";
@@ -924,24 +1085,48 @@ long int Canopy::read_shm(
   }
 
   //mise en tableau
-  FILE* fcan;
-  fcan=fopen("scene.can","w");
+  // la scene ne passe pas par le disque : scene.can seulement en mode bavard
+  FILE* fcan=NULL;
+  if(verbose>2)
+    fcan=fopen("scene.can","w");
   TabDiff= new Diffuseur *[radim];
   for(Ldiff.debut(),i=0;! Ldiff.finito();Ldiff.suivant()){
     diff=Ldiff.contenu();
-    // Ecriture du .can (apres nettoyage de parse_can et ajout du sol)
-    prim=&(diff->primi());
-    fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
-    for(char iii=0;iii<prim->nb_sommet();iii++)
-      fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
-    fprintf(fcan," \n");
+    if(fcan!=NULL){
+      // Ecriture du .can (apres nettoyage de parse_can et ajout du sol)
+      prim=&(diff->primi());
+      fprintf(fcan,"p  1 %.0f %d \t",prim->name()*1000.,prim->nb_sommet());
+      for(char iii=0;iii<prim->nb_sommet();iii++)
+	fprintf(fcan," %lf %lf %lf  ",prim->sommets(iii)[0],prim->sommets(iii)[1],prim->sommets(iii)[2]);
+      fprintf(fcan," \n");
+    }
     TabDiff[i++]=diff;
     if(!diff->isopaque())
       TabDiff[i++]=diff;
   }
-  fclose(fcan);
+  if(fcan!=NULL)
+    fclose(fcan);
   return radim;
-}//read_shm()
+}//read_source()
+
+//-********************   Canopy::vide()    ***********************
+// Libere les diffuseurs de la scene courante, avant un nouveau chargement
+// dans le meme processus (canestra2py)
+void Canopy::vide(){
+  Diffuseur *diff;
+  for(Ldiff.debut();!Ldiff.finito();Ldiff.suivant()){
+    diff=Ldiff.contenu();
+    delete &(diff->primi());
+    if(diff->isopaque())
+      delete (DiffO *)diff;
+    else
+      delete (DiffT *)diff;
+  }
+  Ldiff.free_liste();
+  Ldiff0.free_liste();
+  Diffuseur::idx=0;
+  radim=nb_face=nbcell=nbprim=0;
+}//Canopy::vide()
 
 ///////////////////////// FIN READ_SHM
 
@@ -968,7 +1153,7 @@ void Canopy::xabs(char* nx3d,double *bornemin,double *bornemax,bool normee)
    ofstream fout(nx3d,ios::out);
    if (!fout)
      { Ferr << "ERREUR - Impossible d'ouvrir :"<<nx3d<<'\n' ;//endl;
-       exit(13);
+       prog_terminate(13);
      }
 
 // Ecriture du fichier nx3d au format X3D
@@ -1069,7 +1254,7 @@ void Canopy::xrad(char* nvar,double *bornemin,double *bornemax,bool normee)
    ofstream fout(nvar,ios::out);
    if (!fout)
      { Ferr << "ERREUR - Impossible d'ouvrir :"<<nvar<<"\n";//endl
-       exit(14);
+       prog_terminate(14);
      }
 
 // Ecriture du fichier nvar au format X3D
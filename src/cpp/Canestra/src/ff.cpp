@@ -350,7 +350,7 @@ void   init_NFF(char * EnvName,double *Esource,double &Rsph,bool bias) {
       fflush(stdout);
       Ferr <<"<!> FF.C <init_NFF> Unable to open the file "  << EnvName<<'\n' ;
       fflush(stderr);
-      exit(15);
+      prog_terminate(15);
     }
     fscanf(fenv,"%d %lf",&Nc,&dzc);
     if(verbose>3) printf("Nc = %d - dz = %lf\n",Nc,dzc);
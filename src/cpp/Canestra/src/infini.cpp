@@ -14,22 +14,27 @@ using namespace std;
 #include "image.h"
 #include "chrono.h"
 
-// global variable
-static Tabdyn<void *,2> Zdat0;
-static Tabdyn<REELLE,2> Zbuf0;
-static void ***Zdat8;
-static REELLE **Zbuf8;
-static double cdist;
-static int **T, Ti,Tj, tr[8];
-static bool duplik;
-static Chrono myclock;
-
-//proto
-void lateral(int x,int y, char idx) ;
-void pave(int x,int  y, char idx) ;
+// etat d'une infinitisation (pas de variable globale : les projections de
+// plusieurs sources peuvent etre infinitisees en parallele)
+struct Pavage {
+  void **Zdat0;   // copie de Zdat8 (Tx*Ty, si duplication)
+  REELLE *Zbuf0;  // copie de Zbuf8 (Tx*Ty)
+  void ***Zdat8;
+  int32_t **Zid8;
+  REELLE **Zbuf8;
+  double cdist;
+  int **T, Ti,Tj, tr[8];
+  bool duplik;
+  vector<int> *trans; // si non NULL : collecte des translates (x,y) du pavage
+  bool out(int i,int j,int moving_i,int moving_j);
+  void zbuf(int i,int j);
+  void lateral(int x,int y, char idx) ;
+  void pave(int x,int  y, char idx) ;
+  void infini();
+};
 
 //local function
-bool out(int i,int j,int moving_i,int moving_j) {
+bool Pavage::out(int i,int j,int moving_i,int moving_j) {
   register int k,l;
   bool dehors[2]={true,true};
 
@@ -61,23 +66,31 @@ bool out(int i,int j,int moving_i,int moving_j) {
  
 }//out()
 
-void zbuf(int i,int j) {
+void Pavage::zbuf(int i,int j) {
   int k,l,max[2]={Ti,Tj},min[2]={0,0};
   double d;
   
+  if(trans!=NULL) {
+    trans->push_back(i);
+    trans->push_back(j);
+    return;
+  }
   if(i>=0) min[0]=i; else max[0]+=i; 
   if(j>=0) min[1]=j; else max[1]+=j;
   for(l=min[1];l<max[1];l++)
     for(k=min[0];k<max[0];k++) {
-      d=Zbuf0(k-i,l-j)+cdist*j;
+      d=Zbuf0[(k-i)+Ti*(l-j)]+cdist*j;
       if( d < Zbuf8[k][l] ) {
 	Zbuf8[k][l]=(REELLE) d;
-	Zdat8[k][l]= duplik?Zdat0(k-i,l-j):NULL;
+	if(Zid8!=NULL)
+	  Zid8[k][l]=0;
+	else
+	  Zdat8[k][l]= duplik?Zdat0[(k-i)+Ti*(l-j)]:NULL;
       }
     }      
 }//zbuf()
 
-void lateral(int x,int y, char idx) {
+void Pavage::lateral(int x,int y, char idx) {
   if(out(x,y,tr[idx],tr[idx+1])) return;
  if(verbose>1) printf("lateral (%d,%d,%d)-",x,y,idx);
  zbuf(x,y);
@@ -85,7 +98,7 @@ void lateral(int x,int y, char idx) {
 }//lateral()
 
 
-void pave(int x,int  y, char idx ) {
+void Pavage::pave(int x,int  y, char idx ) {
   if(out(x,y,tr[idx],tr[idx+1])) return;
   if(verbose>1)printf("\n pave(%d,%d,%d):\n",x,y);
   if( !(x==0 && y == 0))
@@ -95,30 +108,18 @@ void pave(int x,int  y, char idx ) {
   pave(x+tr[idx],y+tr[idx+1],idx); // tout droit
 }//pave()
 
-//-***  Exported Functions : infinitise()
-void infinitise(void ***Zprim, REELLE **Zbuf,
-		double cste_dist,int** roof,int Tx, int Ty,bool dupli) {
+//pavage de Zbuf8 (et Zdat8 ou Zid8) par les translates du toit
+void Pavage::infini() {
   int i,j;
+  Chrono myclock;
   if(verbose>1){
     myclock.Start();
     cout<<"* infinitise(): DEBUT\n";
   }
-  //init
-  Zdat0.alloue(Tx,Ty);
-  Zbuf0.alloue(Tx,Ty);
-  // parameters --> global variables
-  Zdat8=Zprim;
-  Zbuf8=Zbuf;
-  T=roof;
-  duplik=dupli;
-  cdist=cste_dist;
-  Ti=Tx;Tj=Ty;
-  for(j=0;j<Ty;j++)
-    for(i=0;i<Tx;i++) {
-      Zdat0(i,j)=Zprim[i][j];
-      Zbuf0(i,j)=Zbuf[i][j];
-
-    }
+  if(trans==NULL)
+    for(j=0;j<Tj;j++)
+      for(i=0;i<Ti;i++)
+	Zbuf0[i+Ti*j]=Zbuf8[i][j];
   i=j=0;
 
   /* for(int ii=0; ii<4; ii++)
@@ -152,12 +153,75 @@ void infinitise(void ***Zprim, REELLE **Zbuf,
   i+=tr[6];
   j+=tr[7];
   pave(i,j,6); //down
-  //Mr Propre
-  Zdat0.free();
-  Zbuf0.free();
   if(verbose>1){
     myclock.Stop();
     cout<<"\n::::>  Infinitisation en "<<myclock<<endl;
     fflush(stdout);
   }
+}//infini()
+
+//-***  Exported Functions : infinitise()
+void infinitise(void ***Zprim, REELLE **Zbuf,
+		double cste_dist,int** roof,int Tx, int Ty,bool dupli) {
+  int i,j;
+  Pavage pav;
+  pav.Zdat8=Zprim;
+  pav.Zid8=NULL;
+  pav.Zbuf8=Zbuf;
+  pav.cdist=cste_dist;
+  pav.T=roof;
+  pav.Ti=Tx; pav.Tj=Ty;
+  pav.duplik=dupli;
+  pav.trans=NULL;
+  pav.Zdat0=NULL;
+  if(dupli) {
+    pav.Zdat0=new void*[Tx*Ty];
+    for(j=0;j<Ty;j++)
+      for(i=0;i<Tx;i++)
+	pav.Zdat0[i+Tx*j]=Zprim[i][j];
+  }
+  pav.Zbuf0=new REELLE[Tx*Ty];
+  pav.infini();
+  //Mr Propre
+  delete [] pav.Zdat0;
+  delete [] pav.Zbuf0;
 }//infinitise()
+
+//-***  Exported Functions : infinitise_id()
+// infinitisation sans duplication d'une image d'indices (juste ombrage) :
+// les pixels ombres par un translate passent a 0. Zcopy (Tx*Ty) est un
+// tampon de travail fourni par l'appelant
+void infinitise_id(int32_t **Zid, REELLE **Zbuf, REELLE *Zcopy,
+		   double cste_dist,int** roof,int Tx, int Ty) {
+  Pavage pav;
+  pav.Zdat8=NULL;
+  pav.Zdat0=NULL;
+  pav.Zid8=Zid;
+  pav.Zbuf8=Zbuf;
+  pav.Zbuf0=Zcopy;
+  pav.cdist=cste_dist;
+  pav.T=roof;
+  pav.Ti=Tx; pav.Tj=Ty;
+  pav.duplik=false;
+  pav.trans=NULL;
+  pav.infini();
+}//infinitise_id()
+
+//-***  Exported Functions : translates_infini()
+// translates (x,y) (en pixels) de l'image par lesquels infinitise() la pave,
+// ranges a la suite dans trans
+void translates_infini(int** roof,int Tx, int Ty,vector<int> &trans) {
+  Pavage pav;
+  pav.Zdat8=NULL;
+  pav.Zdat0=NULL;
+  pav.Zid8=NULL;
+  pav.Zbuf8=NULL;
+  pav.Zbuf0=NULL;
+  pav.cdist=0;
+  pav.T=roof;
+  pav.Ti=Tx; pav.Tj=Ty;
+  pav.duplik=false;
+  trans.clear();
+  pav.trans=&trans;
+  pav.infini();
+}//translates_infini()
@@ -3,6 +3,9 @@
 #endif
 
 #include "verbose.h"
+#include <stdint.h>
+#include <vector>
+using namespace std;
 
 #ifdef _INFINI
 #define EXTR
@@ -13,3 +16,5 @@
 //protos utilise dans Canopy
 #define REELLE float  
 EXTR void infinitise(void ***Zprim, REELLE **Zbuf, double,int** roof,int Tx, int Ty,bool dupli);
+EXTR void infinitise_id(int32_t **Zid, REELLE **Zbuf, REELLE *Zcopy, double,int** roof,int Tx, int Ty);
+EXTR void translates_infini(int** roof,int Tx, int Ty,vector<int> &trans);
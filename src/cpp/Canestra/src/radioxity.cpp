@@ -8,6 +8,15 @@
 *************************************************************/
 
 #include <iostream> // introduire la notion de namespace
+#include <vector>
+#include <list>
+#include <string>
+#include <limits>
+#include <cstring>
+#include <stdint.h>
+#ifdef _OPENMP
+#include <omp.h>
+#endif
 using namespace std ;
 
 #include <ferrlog.h>
@@ -32,6 +41,8 @@ extern "C" {
 #include "sparse.h"
 #include "iter.h"
 }
+// err.h (meschach) definit une macro catch, inutilisee ici : on garde celle du C++
+#undef catch
 #ifdef _HD
 #include "solver.h"
 #include "bzh.h"
@@ -48,6 +59,9 @@ static  void beep(const char *,int);
 static  void erreur_syntaxe(char *);
 static int options(int argc,char **argv);
 static  void genres();
+static  void memres_row(int,double,double,double,double,double);
+static  void write_binres(const char *,vector<double> &);
+static  bool write_expo(const char *);
 
 // Variables globales 
 extern unsigned int NB;
@@ -63,9 +77,12 @@ static VEC  **B0,**B, **Cenv;
 static char opak;
 //  Options
 static  unsigned int nb_iter,nbsim;
+static  int nthreads; // threads projetant les sources (-j)
+static  int tuile;    // taille des tuiles de projplan (-K), -1 : auto
+static  int zcache;   // Z hierarchique de projplan (-Z)
 static double denv;
 static  bool ffseul, infty, geom, ordre1, 
-  ff_print, bio, byseg, byfile, radonly, memsize,bias;
+  ff_print, bio, byseg, byfile, radonly, memsize,bias, binres, expo;
 static  double seuil;
 static  char *maqname, *envname, *optname, *lightname, *name8; 
 static   int clef_shm=-1;
@@ -73,6 +90,24 @@ static  char *dirname, *matname;
 // Option capteur virtuel - MC0699
 static  bool solem; 
 static char * nsolem;
+// Scene, sources et resultats en memoire (canestra2py)
+static Patch *memTs=NULL;
+static int memNt=0;
+static double *memLum=NULL;
+static int memNl=0;
+static vector<double> *memRes=NULL;
+// Repertoire de travail de canestra_mem() ("" : repertoire courant) : les noms
+// relatifs des options et des fichiers ecrits y sont pris, sans changer le
+// repertoire courant du processus
+static string memDir;
+static list<string> memNoms;
+char *chemin(const char *); // aussi utilise par bsp.cpp
+// Option -x : matrice d'exposition (eclairement direct par source et par triangle)
+static vector<double> expoLum;  // sources (E vx vy vz)
+static vector<float> expoDiff;  // Bsource/surface par source et par diffuseur
+static vector<int> diffTri;     // diffuseur -> triangle en entree (Nt0), -1 sinon
+static vector<char> diffFace;   // diffuseur -> face (0 sup, 1 inf)
+static int expoNt=0;
 
 ferrlog Ferr((char*)"canestra.log") ;
 #ifndef NOMAIN
@@ -99,6 +134,10 @@ int main(int argc,char **argv){
       scene.parse_can(maqname,optname,name8,bornemin, 
                       bornemax,sol,nsolem,TabDiff);
       Ferr<<__FILE__<<" : byfile"<<'\n';
+    }else if(memTs!=NULL){
+      scene.read_patches(memTs,memNt,optname,name8,bornemin, 
+                         bornemax,sol,nsolem,TabDiff); 
+      Ferr<<__FILE__<<" : bymem"<<'\n';
     }else{
       scene.read_shm(clef_shm,optname,name8,bornemin, 
                      bornemax,sol,nsolem,TabDiff); 
@@ -146,11 +185,11 @@ int main(int argc,char **argv){
   
     //************ Calcul de l'eclairage direct (soleil & ciel)  ***************
     //    initialisation
-    double *Bsource;
     opak=0;
   
     clock.Start();
-    Bsource = new double[scene.radim];
+    expoLum.clear();
+    expoDiff.clear();
     B= B0 = new VEC*[nbsim]; //B=B0 si pas de calcul des rediffusions
     for(i=0;i<nbsim;i++) {
       B0[i] = v_get(scene.radim);
@@ -161,45 +200,109 @@ int main(int argc,char **argv){
   
     //    calcul de visibilite (purely geometric)
     Vecteur dir_source;
-    double Esource,rho;
-    //     calcul de l'eclairage direct (soleil, ciel)
-    ifstream flight(lightname,ios::in);
-    do {
-      flight>>Esource;
-      if(!flight) 
-          break;
-      flight>>dir_source[0]>>dir_source[1]>>dir_source[2];
-    
-      for(i=0;i<scene.radim;i++) {
-          Bsource[i]=0.0;
+    double Esource;
+    //     sources lues dans le fichier -l ou dans memLum (E vx vy vz)
+    vector<double> lum;
+    if(memLum!=NULL)
+      lum.assign(memLum,memLum+4*memNl);
+    else{
+      ifstream flight;
+      flight.open(lightname,ios::in);
+      while(flight>>Esource){
+	lum.push_back(Esource);
+	flight>>dir_source[0]>>dir_source[1]>>dir_source[2];
+	for(j=0;j<3;j++)
+	  lum.push_back(dir_source[j]);
       }
-      scene.projplan(dir_source,infty,Bsource);
-      //recommenter
-      Ferr <<"param. projplan : dir = ("  << dir_source[0]<<"," << dir_source[1]
-	   <<","  << dir_source[2]<<") - Esun = "  << Esource<<'\n' ;
-      for(i=0;i<scene.radim;i++) {   
-	if(Bsource[i]!=0.0) {  
-	  TabDiff[i]->activ_num(i);
-	  if(Bsource[i]>0) 
-	    rho=TabDiff[i]->rho() * Bsource[i] / TabDiff[i]->surface();
-	  else { 
-	    TabDiff[i]->togle_face();
-	    rho=-TabDiff[i]->tau() * Bsource[i] / TabDiff[i]->surface();
+      flight.close();
+    }
+    int nl=lum.size()/4;
+    //     proprietes des faces, lues une fois : les projections ne
+    //     modifient pas les diffuseurs et peuvent etre faites en parallele
+    vector<double> rhoF(scene.radim),tauF(scene.radim),surfF(scene.radim);
+    for(i=0;i<scene.radim;i++){
+      TabDiff[i]->activ_num(i);
+      rhoF[i]=TabDiff[i]->rho();
+      surfF[i]=TabDiff[i]->surface();
+      TabDiff[i]->togle_face();
+      tauF[i]=TabDiff[i]->tau();
+      TabDiff[i]->active(0);// reactive le diff sur la face sup (defaut)
+    }
+    if(expo)
+      expoDiff.assign((size_t)nl*scene.radim,0);
+    //     calcul de l'eclairage direct (soleil, ciel) : chaque thread projette
+    //     un bloc de sources consecutives et cumule dans son propre vecteur,
+    //     les vecteurs des threads sont sommes dans l'ordre => resultat
+    //     independant de l'ordonnancement
+    int nth=max(1,min(nthreads,nl));
+    vector<double> Bthread((size_t)nth*scene.radim,0.0);
+    vector<long> ncull(2*nth,0); // triangles projetes / caches par thread
+    scene.index_diff();
+#ifdef _OPENMP
+#pragma omp parallel num_threads(nth)
+#endif
+    {
+      int t=0,nteam=1,il,bloc;
+      unsigned int k;
+      double rho;
+      Vecteur dir;
+      Zbuffer zb;
+      vector<double> Bsource(scene.radim);
+#ifdef _OPENMP
+      t=omp_get_thread_num();
+      nteam=omp_get_num_threads();
+#endif
+      // l'equipe peut compter moins de threads que de blocs (sans OpenMP,
+      // OMP_THREAD_LIMIT...) : chaque thread traite les blocs t, t+nteam, ...
+      for(bloc=t;bloc<nth;bloc+=nteam){
+      double *Bth=&Bthread[(size_t)bloc*scene.radim];
+      for(il=nl*bloc/nth;il<nl*(bloc+1)/nth;il++){
+	for(k=0;k<3;k++)
+	  dir[k]=lum[4*il+1+k];
+	for(k=0;k<scene.radim;k++)
+	  Bsource[k]=0.0;
+	scene.projplan(dir,infty,&Bsource[0],zb);
+	for(k=0;k<3;k++)
+	  lum[4*il+1+k]=dir[k]; // direction normalisee par projplan
+	if(expo)
+	  for(k=0;k<scene.radim;k++)
+	    if(Bsource[k]!=0.0)
+	      expoDiff[(size_t)il*scene.radim+k]=Bsource[k] / surfF[k];
+	for(k=0;k<scene.radim;k++) {   
+	  if(Bsource[k]!=0.0) {  
+	    if(Bsource[k]>0) 
+	      rho=rhoF[k] * Bsource[k] / surfF[k];
+	    else 
+	      rho=-tauF[k] * Bsource[k] / surfF[k];
+	    // Cumule les contrib des differents angles solides
+	    Bth[k]+=lum[4*il]*rho;
 	  }
-	  // Cumule les contrib des differents angles solides
-	  B0[0]->ve[i]+=Esource*rho;
-	  //Ferr <<"i="  << i<<" : Bsource="  << Bsource[i]<<", B0="  
-	  //     << B0[0]->ve[i]<<"\n" ;
-	  TabDiff[i]->active(0);// reactive le diff sur la face sup (defaut)
 	}
-      }   
-    }while(flight);
-    flight.close();
+      }
+      }
+      ncull[2*t]=zb.nproj;
+      ncull[2*t+1]=zb.ncache;
+    }
+    for(int t=0;t<nth;t++)
+      for(i=0;i<scene.radim;i++)
+	B0[0]->ve[i]+=Bthread[(size_t)t*scene.radim+i];
+    for(int il=0;il<nl;il++)
+      Ferr <<"param. projplan : dir = ("  << lum[4*il+1]<<"," << lum[4*il+2]
+	   <<","  << lum[4*il+3]<<") - Esun = "  << lum[4*il]<<'\n' ;
+    for(int t=1;t<nth;t++) {
+      ncull[0]+=ncull[2*t];
+      ncull[1]+=ncull[2*t+1];
+    }
+    if(ncull[0]>0)
+      Ferr <<"projplan : "<<ncull[1]<<" triangles sur "<<ncull[0]
+	   <<" caches, non colories ("<<100.0*ncull[1]/ncull[0]<<" %)"<<'\n' ;
+    if(expo)
+      expoLum=lum;
     clock.Stop();
     Ferr<<">>> Canestra[main] calcul du direct en "<<clock<<'\n' ; 
   
     if(byfile){//ecriture du direct dans un fichier E0	
-      fres=fopen("E0.dat","w");
+      fres=fopen(chemin("E0.dat"),"w");
       for(j=0;j<scene.radim;j++) {
 	//Ferr <<"B0("  << j<<") ="  << B0[0]->ve[j]<<" - B("  << j<<") ="  
 	//   << B[0]->ve[j]<<" \n" ;
@@ -216,7 +319,7 @@ int main(int argc,char **argv){
       int istem;
       double teta,deg=180./M_PI,surfT;
       //Ferr << __FILE__<<" : "<< __LINE__<<'\n' ;
-      fres=fopen("geom.dat","w");
+      fres=fopen(chemin("geom.dat"),"w");
       for(i=0;i<scene.radim;i++) {
 	diff=TabDiff[i];
 	if(TabDiff[i]->isopaque()){
@@ -331,7 +434,7 @@ int main(int argc,char **argv){
 #else
 	if(ff_print) {
 	  FILE * fff;
-	  fff=fopen("FF.dat","w");
+	  fff=fopen(chemin("FF.dat"),"w");
 	  for(i=0;i<FF->m;i++) {
 	    for(j=0;j<FF->n;j++) {
 	      fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
@@ -371,7 +474,7 @@ int main(int argc,char **argv){
 	if(ff_print) {
 	  FILE * fff;
 	
-	  fff=fopen("M.dat","w");
+	  fff=fopen(chemin("M.dat"),"w");
 	  for(i=0;i<FF->m;i++) {
 	    for(j=0;j<FF->n;j++) {
 	      fprintf(fff,"%lf  ",sp_get_val(FF,i,j));
@@ -412,6 +515,8 @@ int main(int argc,char **argv){
   
     //Rendu - Traitement des resultats
     genres();
+    if(expo && bio && !write_expo(chemin("Exposure.mat")))
+      prog_terminate(18);
     // Gestion des fichiers persistants
     if(bMemoriseMatrix==false) {
       EffaceMatrices();
@@ -421,12 +526,143 @@ int main(int argc,char **argv){
     return 0 ;
   } //main()
 
+#ifdef NOMAIN
+  //======>  canestra_mem(): canestra sans passer par le disque pour la scene,
+  // les sources et les resultats (canestra2py).
+  // Ts : Nt triangles (cf. Patch), lum : Nl sources (E vx vy vz) ou NULL (=> -l),
+  // res : lignes (No label area Eabs Ei_sup Ei_inf) equivalentes a Etri.vec0
+  // wd : repertoire de travail (NULL : repertoire courant)
+  int canestra_mem(int argc,char **argv,Patch *Ts,int Nt,
+		   double *lum,int Nl,vector<double> &res,const char *wd){
+    int status;
+
+    // liberation de la scene de l'appel precedent
+    if(scene.radim>0){
+      delete [] TabDiff;
+      TabDiff=NULL;
+    }
+    scene.vide();
+    memNoms.clear();
+    memDir=(wd!=NULL)? wd : "";
+    Ferr.open(chemin("canestra.log"));
+    memTs=Ts; memNt=Nt;
+    memLum=lum; memNl=Nl;
+    res.clear();
+    memRes=&res;
+    try{
+      status=canestra(argc,argv);
+    }catch(Terminaison &t){
+      // erreur (prog_terminate) : rendue a l'appelant au lieu de quitter
+      Ferr <<"canestra: erreur "<<t.code<<'\n';
+      Ferr.close();
+      status=t.code;
+    }
+    memTs=NULL; memNt=0;
+    memLum=NULL; memNl=0;
+    memRes=NULL;
+    memDir="";
+    return status;
+  }//canestra_mem()
+#endif
+
 
 
   /*****************************************************************************
    **********               Fonctions Locales                          *********
    *****************************************************************************/
 
+  //======>  chemin(): nom de fichier pris dans le repertoire de travail memDir
+  char *chemin(const char *name){
+    if(name==NULL || memDir.empty() || name[0]=='/' || name[0]=='\\'
+       || (name[0]!=0 && name[1]==':'))
+      return (char*)name;
+    memNoms.push_back(memDir+"/"+name);
+    return (char*)memNoms.back().c_str();
+  }//chemin()
+
+  //======>  memres_row(): ajoute une ligne (equivalente a Etri.vec0) a memRes
+  inline void memres_row(int No,double nom,double surf,double Eabs,double Esup,double Einf){
+    memRes->push_back(No);
+    memRes->push_back(nom);
+    memRes->push_back(surf);
+    memRes->push_back(Eabs);
+    memRes->push_back(Esup);
+    memRes->push_back(Einf);
+  }//memres_row()
+
+  //======>  write_binres(): ecrit les lignes de Etri.vec0 dans un fichier binaire
+  // entete de 24 octets : "ETRI", uint32 version(=1), uint32 ncol(=6), uint32 0, uint64 n
+  // puis les 6 colonnes (No label area Eabs Ei_sup Ei_inf) en float64, l'une apres l'autre
+  void write_binres(const char *name,vector<double> &rows){
+    uint32_t head[4]={0,1,6,0};
+    uint64_t n=rows.size()/6;
+    FILE *fb=fopen(name,"wb");
+    if(fb==NULL){
+      Ferr <<"<!> Ouverture de "<<(char*)name<<" impossible\n";
+      return;
+    }
+    memcpy(head,"ETRI",4);
+    fwrite(head,sizeof(uint32_t),4,fb);
+    fwrite(&n,sizeof(uint64_t),1,fb);
+    vector<double> col(n);
+    for(int k=0;k<6;k++){
+      for(uint64_t r=0;r<n;r++)
+	col[r]=rows[6*r+k];
+      if(n>0)
+	fwrite(&col[0],sizeof(double),n,fb);
+    }
+    fclose(fb);
+  }//write_binres()
+
+  //======>  write_expo(): ecrit la matrice d'exposition (option -x)
+  // entete de 32 octets : "EXPO", uint32 version(=1), uint32 nface(=2), uint32 0,
+  // uint64 nsrc, uint64 ntri ; puis les nsrc sources (E vx vy vz) en float64 et
+  // la matrice (nsrc, nface, ntri) en float32 de l'eclairement direct des faces
+  // sup et inf de chaque triangle en entree pour une source d'energie unite
+  // (NaN pour les triangles rejetes). Retourne false (fichier supprime) en cas
+  // d'erreur d'ecriture
+  bool write_expo(const char *name){
+    uint32_t head[4]={0,1,2,0};
+    uint64_t dims[2];
+    size_t nsrc=expoLum.size()/4, nbf=diffTri.size(), radim=scene.radim;
+    size_t nmat=2*(size_t)expoNt;
+    bool ok;
+    FILE *fx=fopen(name,"wb");
+    if(fx==NULL){
+      Ferr <<"<!> Ouverture de "<<(char*)name<<" impossible\n";
+      return false;
+    }
+    memcpy(head,"EXPO",4);
+    dims[0]=nsrc;
+    dims[1]=expoNt;
+    ok=fwrite(head,sizeof(uint32_t),4,fx)==4
+      && fwrite(dims,sizeof(uint64_t),2,fx)==2
+      && (nsrc==0 || fwrite(&expoLum[0],sizeof(double),4*nsrc,fx)==4*nsrc);
+    vector<float> mat(nmat);
+    // indices en size_t : nsrc*radim depasse 2^31 pour une course du soleil
+    // sur une grande scene
+    for(size_t k=0;ok && k<nsrc;k++){
+      mat.assign(nmat,numeric_limits<float>::quiet_NaN());
+      for(size_t d=0;d<nbf;d++)
+	if(diffTri[d]>=0)
+	  mat[diffTri[d]]=mat[expoNt+diffTri[d]]=0;
+      for(size_t d=0;d<nbf;d++){
+	float b=expoDiff[k*radim+d];
+	// la face vue par la source recoit Bsource>0, l'autre face -Bsource
+	if(diffTri[d]>=0 && b>0)
+	  mat[(size_t)diffFace[d]*expoNt+diffTri[d]]+=b;
+      }
+      if(nmat>0)
+	ok=fwrite(&mat[0],sizeof(float),nmat,fx)==nmat;
+    }
+    ok=(fclose(fx)==0) && ok;
+    if(!ok){
+      Ferr <<"<!> Ecriture de "<<(char*)name<<" impossible\n";
+      remove(name);
+    }
+    return ok;
+  }//write_expo()
+
   //======>  genres(): calcule et genere les fichiers de resultats - MC98 
   void genres(){
     // Impression des resultats : vecteur des  radiosites, if(bio) Eabs.dat et Einc.dat
@@ -434,12 +670,12 @@ int main(int argc,char **argv){
   
     if(false && !ordre1){// genere les fichiers .dat de debug B0 et Bf generes
       if(envname != NULL){
-	fres=fopen("Bf.dat","w");
+	fres=fopen(chemin("Bf.dat"),"w");
 	for(i=0;i<nbf;i++) 
 	  fprintf(fres,"%lf \n",Cenv[0]->ve[i]);
 	fclose(fres);
       }
-      fres=fopen("B0.dat","w");
+      fres=fopen(chemin("B0.dat"),"w");
       for(j=0;j<nbf;j++) {
 	fprintf(fres,"%.10lf \n ",B0[0]->ve[j]);
       }
@@ -447,7 +683,7 @@ int main(int argc,char **argv){
     }// if fichiers .dat de debug B0 et Bf generes
     // Ecriture des radiosites totales => B.dat
     if(byfile){
-      fres=fopen("B.dat","w");
+      fres=fopen(chemin("B.dat"),"w");
       Ferr <<"==> Impression des resultats radim="  << scene.radim<<", nbcell="  << scene.nbcell<<"\n" ;
       for(j=0;j<nbf;j++) {
 	fprintf(fres,"%.10lf \n ",B[0]->ve[j]);
@@ -457,7 +693,7 @@ int main(int argc,char **argv){
     // Ecriture des ecliarement des capteurs virtues => solem.dat
     if(scene.nbcell>0){
       //id 1er ordre Total en eclairement et surface
-      fres=fopen("solem.dat","w");
+      fres=fopen(chemin("solem.dat"),"w");
       for(j=0;j<scene.nbcell;j++) {
 	fprintf(fres,"%.0lf\t %.10lf\t %.10lf \t%.6lf\n",
 		TabDiff[nbf+j]->primi().name(),
@@ -476,19 +712,26 @@ int main(int argc,char **argv){
       FILE *fa=NULL,*fi=NULL,*ft=NULL,*ft0=NULL;
       double *Te=NULL,surf, nom; 
       int Nt; int Nt0=0;
-      if(byfile) {//by file
-	fa=fopen("Eabs.vec","w");
-	fi=fopen("Einc.vec","w");
-	ft=fopen("Etri.vec","w");    
+      const double NaN=numeric_limits<double>::quiet_NaN();
+      // option -b : les lignes de Etri.vec0 sont cumulees puis ecrites
+      // dans un seul fichier binaire (Etri.vec0b) a la place des .vec
+      bool txt=byfile && !binres;
+      vector<double> binrows;
+      if(byfile && binres)
+	memRes=&binrows;
+      if(txt) {//by file
+	fa=fopen(chemin("Eabs.vec"),"w");
+	fi=fopen(chemin("Einc.vec"),"w");
+	ft=fopen(chemin("Etri.vec"),"w");    
 	fprintf(ft,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",maqname,name8,optname,lightname,denv,(int)ordre1 );
 	fprintf(ft,"# label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
 	// Version repreannt la liste initiale de triangle du .can pr PyCaribu
-	ft0=fopen("Etri.vec0","w");    
+	ft0=fopen(chemin("Etri.vec0"),"w");    
 	fprintf(ft0,"# canestrad: can=%s F8=%s opt=%s light=%s : denv=%.2f direct=%d \n",maqname,name8,optname,lightname,denv,(int)ordre1 );
 	fprintf(ft0,"# No Label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf) (Ex=surfacic density of energy <nrj/s/m2>)\n");
       
       }
-      else{//by shared memory
+      else if(byseg){//by shared memory
       
 	DecodeClefIn(&Nt,&clef_shm,clef_shm); //In caribu
 	// TEST: Ne plante plus si ouvre 1 segment =!= de celui de caribu
@@ -497,16 +740,22 @@ int main(int argc,char **argv){
 	Ferr <<"==> print_Eabs(): Nt="  << Nt<<", clef_shm="  << clef_shm<<"\n" ;
 #ifndef WIN32
 	// Mode Unix
-	shmid2=shmget((key_t)clef_shm,SEGSIZE*sizeof(double) ,IPC_CREAT|0666);
+	// 3 blocs de Nt-1 doubles : Eabs*S, Ei_sup*S, Ei_inf*S (-S si opaque)
+	shmid2=shmget((key_t)clef_shm,3*(Nt-1)*sizeof(double) ,IPC_CREAT|0666);
 	if(shmid2==-1){//en cas de pb
 	  // stderr2cerr: Parse error here ?
 	  // Found _1_ formats but _0_ printable arguments
 	  // Normal, y'en n'avait pas 
 	  Ferr <<"<!> Ouverture du segment partage no. " <<clef_shm
 	       <<" impossible => I terminate now !!\n";
-	  exit(16);
+	  prog_terminate(16);
+	}
+	Te=(double *)shmat(shmid2,0,0);
+	if(Te==(double *)-1){
+	  Ferr <<"<!> Attachement du segment partage no. " <<clef_shm
+	       <<" impossible => I terminate now !!\n";
+	  prog_terminate(16);
 	}
-	Te=(double *)shmat(shmid2,0,(int)NULL);
 #else
 	sprintf ( pcClefNum, "%d", clef_shm) ;
 	Ferr<<"------------------------oOo-------------------------"<<'\n';
@@ -533,6 +782,8 @@ int main(int argc,char **argv){
       }
       Ei=new reel[nbf];
       Eabs=new reel[scene.Ldiff.card()-scene.nbcell+1]; // +1:HA
+      diffTri.assign(nbf,-1);
+      diffFace.assign(nbf,0);
 
       opak=0;
       ia=0;
@@ -542,7 +793,12 @@ int main(int argc,char **argv){
 	//Geston de la sortie Etrivec0 identique a liste de triangle en entree - MC09
 	while(scene.Ldiff0.contenu()>=0 ){
 	  if(scene.Ldiff0.finito()) break;
-	  fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  if(ft0!=NULL)
+	    fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  if(memRes!=NULL)
+	    memres_row(Nt0,scene.Ldiff0.contenu(),0,NaN,NaN,NaN);
+	  if(byseg)
+	    Te[Nt0]=Te[Nt0+(Nt-1)]=Te[Nt0+2*(Nt-1)]=NaN;
 	  Nt0++;
 	  // printf("dbg 2, Nt0=%d, Ldiff0()=%d\n", Nt0, scene.Ldiff0.contenu());
 	  scene.Ldiff0.suivant();
@@ -575,23 +831,27 @@ int main(int argc,char **argv){
 	      Ei[i]=B[0]->ve[i]/diff->rho();
 	      Eabs[ia]=Ei[i]-B[0]->ve[i];
 	    }
-	    if(byfile){
+	    if(txt){
 	      fprintf(fi,"%g\n",Ei[i]);
 	      fprintf(fa,"%g\n",Eabs[ia]*surf);
 	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-1.);
 	      //liste compatible pycaribu - MC09  
 	      fprintf(ft0,"%d %.0f %f  %f  %f %f\n",Nt0,nom, surf, Eabs[ia], Ei[i],-1.);
-	      Nt0++;
-	      scene.Ldiff0.suivant(); 
-	    } else{
-	      Te[ia]=Eabs[ia]*surf;
+	    } else if(byseg){
+	      // Te suit l'ordre des triangles en entree (Nt0), rejetes compris
+	      Te[Nt0]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      //met dans le SegMem les eclairement des faces sup et inf 
 	      // Bug MC nov05: Te[ia+(Nt+1)]=B[0]->ve[i]*surf; //face sup
-	      Te[ia+(Nt-1)]=Ei[i]*surf; //face sup
-	      Te[ia+2*(Nt-1)]=-surf; //face inf
+	      Te[Nt0+(Nt-1)]=Ei[i]*surf; //face sup
+	      Te[Nt0+2*(Nt-1)]=-surf; //face inf
 	      // Ferr <<"Te["  << ia<<"]="  << Te[ia]<<"\n" ;
 	    }
+	    if(memRes!=NULL)
+	      memres_row(Nt0,nom,surf,Eabs[ia],Ei[i],-1.);
+	    diffTri[i]=Nt0;
+	    Nt0++;
+	    scene.Ldiff0.suivant(); 
 	    //MCMarch2006
 	    ia++;
 	    break;
@@ -626,29 +886,33 @@ int main(int argc,char **argv){
 		 <<", Ea["  <<  ia<<"]="  <<  Eabs[ia]<<"\n\n" ;
 		 /recommenter */
 	    }
-	    if(byfile){
+	    if(txt){
 	      fprintf(fi,"%g\n%g\n",Ei[i-1], Ei[i]);
 	      fprintf(fa,"%g\n",Eabs[ia]*surf);
 	      fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i-1], Ei[i]);
 	      //liste compatible pycaribu - MC09  
 	      fprintf(ft0,"%d %.0f %f  %f  %f %f\n",Nt0,nom, surf,  Eabs[ia], Ei[i-1], Ei[i]);
-	      Nt0++;
-	      scene.Ldiff0.suivant();
-	    } else{
-	      Te[ia]=Eabs[ia]*surf;
+	    } else if(byseg){
+	      Te[Nt0]=Eabs[ia]*surf;
 	      //MCoct05: caribu4.4
 	      /* Bug 221105 MC
 		 Te[ia+(Nt+1)]=B[0]->ve[i-1]*surf;//face sup 
 		 Te[ia+2*(Nt+1)]=B[0]->ve[i]*surf; //face inf
 	      */
-	      Te[ia+(Nt-1)]=Ei[i-1]*surf;//face sup 
-	      Te[ia+2*(Nt-1)]=Ei[i]*surf; //face inf
+	      Te[Nt0+(Nt-1)]=Ei[i-1]*surf;//face sup 
+	      Te[Nt0+2*(Nt-1)]=Ei[i]*surf; //face inf
 	   
 	      if(verbose>2) {
-		Ferr <<"Te["  << ia<<"]="  << Te[ia]<<" Ei(sup)="<<Ei[i-1]<<", Ei(inf)="<<Ei[i]<<"\n" ;
-		cout <<"Te["  << ia<<"]="  << Te[ia]<<" Ei(sup)["<<ia+(Nt-1)<<"]="<<Ei[i-1]<<", Te(ia+2*(Nt-1)="<<Te[ia+2*(Nt-1)]<<", Ei(inf)["<<ia+2*(Nt-1)<<"]="<<Ei[i]<<", Nt="<<Nt<<"\n" ;
+		Ferr <<"Te["  << Nt0<<"]="  << Te[Nt0]<<" Ei(sup)="<<Ei[i-1]<<", Ei(inf)="<<Ei[i]<<"\n" ;
+		cout <<"Te["  << Nt0<<"]="  << Te[Nt0]<<" Ei(sup)["<<Nt0+(Nt-1)<<"]="<<Ei[i-1]<<", Te(Nt0+2*(Nt-1)="<<Te[Nt0+2*(Nt-1)]<<", Ei(inf)["<<Nt0+2*(Nt-1)<<"]="<<Ei[i]<<", Nt="<<Nt<<"\n" ;
 	      }
 	    }
+	    if(memRes!=NULL)
+	      memres_row(Nt0,nom,surf,Eabs[ia],Ei[i-1],Ei[i]);
+	    diffTri[i-1]=diffTri[i]=Nt0;
+	    diffFace[i]=1;
+	    Nt0++;
+	    scene.Ldiff0.suivant();
 	    //MCMarch2006
 	    ia++;
 	    break;
@@ -663,7 +927,7 @@ int main(int argc,char **argv){
 	  */
 	  Ei[i]=B[0]->ve[i]/diff->rho();
 	  Eabs[ia]=Ei[i]-B[0]->ve[i];
-	  if(byfile){
+	  if(txt){
 	    fprintf(fi,"%g\n", Ei[i]);
 	    fprintf(fa,"%g\n",Eabs[ia]*surf);
 	    fprintf(ft,"%.0f %f  %f  %f %f\n",nom, surf, Eabs[ia], Ei[i],-2.);
@@ -676,12 +940,18 @@ int main(int argc,char **argv){
       //vidage de liste au cas ou - MC09
       if(!scene.Ldiff0.finito())
 	while(scene.Ldiff0.contenu()>=0 ){
-	  fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  if(ft0!=NULL)
+	    fprintf(ft0,"%d %.0f 0 NaN NaN NaN\n",Nt0,scene.Ldiff0.contenu());
+	  if(memRes!=NULL)
+	    memres_row(Nt0,scene.Ldiff0.contenu(),0,NaN,NaN,NaN);
+	  if(byseg)
+	    Te[Nt0]=Te[Nt0+(Nt-1)]=Te[Nt0+2*(Nt-1)]=NaN;
 	  Nt0++;
 	  //printf("dbg 6, Nt0=%d, Ldiff0()=%d\n", Nt0, scene.Ldiff0.contenu());
 	  scene.Ldiff0.suivant();
 	  if(scene.Ldiff0.finito()) break;
 	}
+      expoNt=Nt0;
       //printf("dbg 7\n");    
   
       /* Cas du sol mis au placard - MC nov2005
@@ -697,15 +967,18 @@ int main(int argc,char **argv){
 
       //Ferr << "Au max on atteint: Eabs["<<ia<<"]"<<'\n';
 
-      if(byfile){
+      if(txt){
 	fclose(fi); 
 	fclose(fa);
 	fclose(ft);
 	fclose(ft0);
-      } else
+      } else if(byfile){
+	write_binres(chemin("Etri.vec0b"),binrows);
+	memRes=NULL;
+      } else if(byseg)
 #ifndef WIN32
 	// Unix way
-	shmdt((void*)shmid2);
+	shmdt((void*)Te);
 #else
       // Complicated Way
       UnmapViewOfFile(lpSharedSeg) ; // invalidation du ptr sur mem partagee
@@ -743,7 +1016,13 @@ int main(int argc,char **argv){
       "  -a threshold \t Threshold of the CG solver [1e6] \n"
       "  -1 \t\t Compute only the direct lightning \n"
       "  -L nb \t Resolution of the light screen [1536]  \n"
+      "  -j nb \t Number of threads projecting the light sources [1]\n"
+      "  -E \t\t Rasterize the triangles with fixed-point edge functions (untiled screens)\n"
+      "  -K nb \t Size of the tiles of the light screen (0: no tiling) [1024 if the screen is larger than 4096, else 0]\n"
+      "  -Z 0|1 \t Skip the triangles hidden behind the screen pixels already drawn (untiled screens) [0]\n"
       "  -A \t\t Generate  energy vector (Eabs.dat, Einc.dat)\n"
+      "  -b \t\t With -A, write a single binary result file (Etri.vec0b) instead of the .vec files\n"
+      "  -x \t\t With -A, write the direct irradiance of each triangle face per unit source (Exposure.mat)\n"
       "  -g \t\t Generate the geometry file (geom.dat)\n"
       "  -B \t\t Test the effect of the choice of inner triangles (bias?) \n"
       "  -T \t\t Estimate the maximum required memory\n"
@@ -761,24 +1040,29 @@ int main(int argc,char **argv){
   //======> options(): traite la ligne de commande argv - MC98
   int options(int argc,char **argv){
     int c;
-    GetOpt option(argc,argv,"AC:BFTg1hs:L:M:R:S:8:a:d:e:f:i:l:m:n:p:r:t:v:w:");
+    GetOpt option(argc,argv,"AC:BEFTbg1hxs:j:K:L:M:R:S:Z:8:a:d:e:f:i:l:m:n:p:r:t:v:w:");
   
     // Valeur par defaut des options
-    NB=52; nb_iter=1000; nbsim=1;
+    NB=52; nb_iter=1000; nbsim=1; nthreads=1; tuile=-1; zcache=0;
     denv=0.30; seuil=1e-6; //-1 ie seuil_solver=MACHEPS
-    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=radonly=memsize=solem=false;
+    ffseul=infty=geom=ordre1=ff_print=bio=byseg=byfile=radonly=memsize=solem=binres=expo=false;
     bias=true;
     lightname=maqname=envname=optname=name8=dirname=matname=nsolem=NULL;
     sol=0;
-    scene.Timg=1536;
+    scene.Timg=1536; scene.aretes=false;
     // Traitememnt des options
     if(argc<2){erreur_syntaxe(argv[0]);return 1;}
     while((c=option())!=EOF)
       switch(c) {
       case 'A' : bio =true;                       break;// genere Eabs.dat et Einc.dat
       case 'B' : bias=false;                      break;// pb des a cheval sur la sphere  
+      case 'b' : binres=true;                    break;// resultats binaires (Etri.vec0b)
+      case 'x' : expo=true;                      break;// matrice d'exposition (Exposure.mat)
       case 'C' : nsolem=option.optarg; solem=true;break;// solem.can     
+      case 'E' : scene.aretes=true;              break;// colorie_aretes()
       case 'F' : ff_print=true;                  break;// FF -> FF.dat
+      case 'K' : tuile=atoi(option.optarg);      break;//Tuiles projplan
+      case 'Z' : zcache=atoi(option.optarg);     break;//Z hierarchique projplan
       case 'L' : scene.Timg=atoi(option.optarg); break;//Resolution projplan 
       case 'M' : maqname=option.optarg; byfile=true; break;//maquette .can
       case 'S' : nbsim=atoi(option.optarg);      break;// nombre de simulations  
@@ -796,6 +1080,7 @@ int main(int argc,char **argv){
       case 'g' : geom=true;                     break;
       case 'h' : erreur_syntaxe(argv[0]); return 1;
       case 'i' : nb_iter=atoi(option.optarg);    break;// nbre d'iterations
+      case 'j' : nthreads=atoi(option.optarg);   break;// threads de l'eclairage direct
       case 'l' : lightname=option.optarg;        break;
       case 'm' : clef_shm=atoi(option.optarg);byseg=true; break;// by segmem clef 
       case 'p' : optname=option.optarg;          break;
@@ -811,6 +1096,10 @@ int main(int argc,char **argv){
       default  : erreur_syntaxe(argv[0]); return 1;
       }// switch
   
+    // tuiles par defaut pour les grands ecrans (z-buffer de 1024 x 1024)
+    scene.Ttuile=(tuile>=0)? tuile : ((scene.Timg>4096)? 1024 : 0);
+    // Z hierarchique sur demande seulement : a profondeur egale, l'ordre de trace change
+    scene.zhier=(zcache>0);
     if (clef_shm != -1){
       Ferr <<"-------------o clef_shm = "<<clef_shm<<" o---------------"<<'\n';
     }
@@ -819,7 +1108,13 @@ int main(int argc,char **argv){
 	"with 3 necessary options:\n -M maqname -p optname -l lightname \n " ;
       return 1;
     }
-    if(((maqname==NULL)&&byfile) ||((clef_shm==-1)&&byseg) || (lightname==NULL) || (optname==NULL)) {
+    if(memTs!=NULL && (byfile||byseg)){
+      Ferr <<"<!> Fatal error"  << (char)7<<"\n==> Canestra called in memory "
+	"mode should not be given -M or -m \n " ;
+      return 1;
+    }
+    if(((maqname==NULL)&&byfile) ||((clef_shm==-1)&&byseg) || (!byfile&&!byseg&&memTs==NULL)
+       || (lightname==NULL&&memLum==NULL) || (optname==NULL)) {
       Ferr <<"<!> Fatal error"  << (char)7<<"\n==> Canestra should be called "
 	"with 3 necessary options:\n"
 	"    [-M maqname| -m shmkey]  -p optname -l lightname \n " ;
@@ -828,8 +1123,12 @@ int main(int argc,char **argv){
   
     if(byfile) cout <<"\n Fichier maquette  :: "<<maqname;
     if(byseg ) cout <<"\n SegMem  maquette  :: "<<clef_shm;
+    if(memTs!=NULL) cout <<"\n Memoire maquette  :: "<<memNt<<" triangles";
     cout <<"\n Fichier optique   :: "<<optname;
-    cout <<"\n Fichier sources   :: "<<lightname; 
+    if(memLum!=NULL)
+      cout <<"\n Memoire sources   :: "<<memNl<<" sources";
+    else
+      cout <<"\n Fichier sources   :: "<<lightname; 
     cout <<"\n Seuil convergence :: "<<seuil;
     cout <<"\n Dist envt (rayon) :: "<<denv;
     if(denv==0) cout <<" ==> <!> SAIL pur";
@@ -880,6 +1179,10 @@ int main(int argc,char **argv){
   
     if(dirname==NULL) {
       dirname= new char[100]; strcpy(dirname,".\\");}
+    // fichiers d'entree et matrices dans le repertoire de travail (canestra_mem)
+    maqname=chemin(maqname); lightname=chemin(lightname); optname=chemin(optname);
+    envname=chemin(envname); name8=chemin(name8); nsolem=chemin(nsolem);
+    dirname=chemin(dirname);
     if(memsize){
       char cmd[125];
       sprintf(cmd,"maxmem %s 1 > maxmem.res &",argv[0]);
@@ -365,7 +365,7 @@ int	i,is, j_idx,j, n,iff,nd,*diag=NULL;//i : indice prim, is indice face
   diag=new int[nd+1];//nd= nb prim + 1
   if(diag==NULL) {
     Ferr <<" Impossible d allouer diag["  << nd+1<<"]!\n" ;
-    exit(17);
+    prog_terminate(17);
  }
   fread(diag,sizeof(int),nd+1,fic);
   fclose(fic);
@@ -75,7 +75,7 @@ GetOpt::exchange (char **argv)
   if (temp == NULL) 
     {
       Ferr << "GetOpt n'a pas assez de mmoire" << "\n" ;
-      exit (21) ; 
+      prog_terminate(21) ; 
     }
 
   // if
@@ -218,7 +218,7 @@ void Vecteur::normalise(){
   double norm=norme();
   if(norm<=0.0)
     { Ferr<<"Vecteur [normalise] norme <=0"<<'\n';
-  exit(27);
+  prog_terminate(27);
   }
   homo[0]/=norm;
   homo[1]/=norm;
@@ -285,7 +285,7 @@ Point Point::operator + (const Homogene &vect) const {
 
   if (vect[3]==1){
     Ferr << "ERREUR - Impossible d'additionner deux points"<<'\n';
-    exit(28) ;//exit (1);
+    prog_terminate(28) ;//exit (1);
   }
   else{
     res[0]=vect[0]+homo[0];
@@ -303,7 +303,7 @@ Point Point::operator - (const Homogene &vect) const{
 
   if (vect[3]==1)	{
     Ferr << "ERREUR - Impossible de soustraire deux points"<<'\n';
-    exit (29);
+    prog_terminate(29);
   }
   else	{
     res[0]=homo[0]-vect[0];
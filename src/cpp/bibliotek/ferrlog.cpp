@@ -193,7 +193,7 @@ ferrlog & ferrlog::operator << ( string msg)
 } ;
 
 void ferrlog::close(void) {
-    if (out->good()) {
+    if (out != NULL && out->good()) {
       *out << "ferrlog stream close() called." << endl ;
       out->flush() ;
       out->close() ;
@@ -202,11 +202,12 @@ void ferrlog::close(void) {
 
 // operateur ferrlog << string
 
-// Historique !!
-// operator ferrlog << ostream &
-//void prog_terminate (int code) 
-//{
-//  Ferr << "Exit appel avec valeur " << code << "\n" ;
-//  delete (ferr) ;
-//  exit (code) ;
-//}
+bool prog_exception = false ;
+
+void prog_terminate (int code)
+{
+  Ferr.flush() ;
+  if (prog_exception)
+    throw Terminaison(code) ;
+  exit (code) ;
+}
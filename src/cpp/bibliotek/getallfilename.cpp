@@ -9,6 +9,7 @@
 using namespace std ;
 
 #include <system.h>
+#include <ferrlog.h>
 
 char *GetAllFileName(char *nom) {
   char *pcTmpName=NULL;
@@ -17,7 +18,7 @@ char *GetAllFileName(char *nom) {
   if(true){
     if (pcTmpName == NULL){
       clog<<__FILE__<<" : "<<__LINE__<<" : Plus de mmoire"<<endl;
-      exit (1);
+      prog_terminate(1);
     }
     // fin de chane
     pcTmpName[0]=0;
@@ -45,7 +46,7 @@ char *GetAllFileName(char *nom) {
     iTest = system (ccCommande);
     if (iTest != 0) {
       cerr <<__FILE__<< ": Pas pu executer "<<ccCommande<<endl ;
-      exit (20);
+      prog_terminate(20);
     };
     ifstream fin (pcTmpName, ios::in);
     
@@ -9,7 +9,7 @@ void raus(bool cond, const char *msg)
  { if(cond)
    { Ferr<<msg<< '\n' ;
       //Ferr.flush(); // '\n' --> endl l'a dj fait
-      exit(22);
+      prog_terminate(22);
     }
  }//raus()
 
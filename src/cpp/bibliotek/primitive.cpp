@@ -85,7 +85,7 @@ Polygone::Polygone(string ligne,double name,
     init(tmp2,name,mini,maxi,valid);
   } else {
     Ferr <<"Plus de memoire" << "\n" ;
-    exit (23);
+    prog_terminate(23);
   }
   if (tmp1 != NULL) delete (tmp1);
   if (tmp2 != NULL) delete (tmp2);
@@ -393,7 +393,7 @@ void Polygone::calcul_normale_cst_equ(Point& p1, Point& p2, Point& p3){
   if(normale==v0){
     Ferr<<"Polygone::calcul_normale_cst_equ : normale nulle ->";
     qui();
-    exit(24);
+    prog_terminate(24);
   }
   normale.normalise();
   //        normale.show();
@@ -434,7 +434,7 @@ Triangle::Triangle(Liste<Point>& liste_sommet,double name=0) : Polygone(liste_so
   if (nb_sommets != 3)
     { Ferr << "ERREUR - nombre de sommets incoherent pour un triangle\n"; 
       Ferr << "nombre de sommets=" << nb_sommets << '\n';
-      exit(25);
+      prog_terminate(25);
     }
 //  calcul_normale_cst_equ(sommet[0],sommet [1],sommet[2]);
 }
@@ -527,7 +527,7 @@ double Polygone::surface(){
   case 1: //polygone de faussaire
   case 2:
     Ferr<<"Polygone[surface] Irrtum nb_sommet = "<<nb_sommets<< '\n';
-    exit(26);
+    prog_terminate(26);
     break;
   case 3: //triangle
     u.formation_vecteur(sommet[0],sommet[1]);
@@ -302,7 +302,7 @@ Type& Matrice<Type> :: operator () (int i, int j)
 	else
 	{
 		Ferr << "ERREUR d'indice dans la matrice"<<'\n';
-		exit (31);
+		prog_terminate(31);
 	}
 }
 
@@ -316,7 +316,7 @@ Matrice<Type>& Matrice<Type> :: operator =
 	{
 		Ferr << "ERREUR - Impossible d'egaliser 2 matrices de taille differente"<<'\n';
 		cout.flush();
-		exit (32);
+		prog_terminate(32);
 	}
 	else
 	{
@@ -338,7 +338,7 @@ Matrice<Type>  Matrice<Type> :: operator * (Matrice<Type>& A)
 	if (m != A.n)
 	{
 		Ferr<<"ERREUR-multiplication de matrices imcompatibles"<<'\n';
-		exit(33);
+		prog_terminate(33);
 	}
 	else
 	{
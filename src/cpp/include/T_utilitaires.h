@@ -56,7 +56,7 @@ public:
   void  quicksort(int (*clef)(Type *x, Type *y))
     { if(D>1)
       { Ferr <<"Tabdyn[quicksort] implemente que pour les tableaux 1D"<<'\n';
-      exit(34);
+      prog_terminate(34);
       }
     if(!trie)
       { trie=true;
@@ -76,7 +76,7 @@ inline Tabdyn<Type,D>& Tabdyn<Type,D>::operator =(Tabdyn<Type,D>& rval){
   for(register unsigned char i=0;i<D ;i++)
     if(max[i]!=rval.max[i]){
       Ferr<<"\n Tabdyn [operator =] erreur dimension "<<i<<'\n' ;
-      exit(35);
+      prog_terminate(35);
     }
   trie=false;
   memcpy(tab,rval.tab,taille*sizeof(Type *));
@@ -90,7 +90,7 @@ void Tabdyn<Type,D>::maj(Type val){
   if(tab==NULL) {
     Ferr<<"\nTabdyn [maj()]: Tableau dynamique pas alloue: acces impossible!";
     Ferr<<'\n';
-    exit(36);
+    prog_terminate(36);
   }
   unsigned long i;
   Type *pt;
@@ -103,7 +103,7 @@ inline  int  Tabdyn<Type,D>::bonind(int  ind,unsigned  char indmax){
   if(ind<0 || ind>=max[indmax]){
     Ferr<<"\n Tabdyn[operator()]: indice no "<<ind<<" hors-borne!"<<'\n';
     ind=(int)  (1/sin(0.0));
-    exit(37);
+    prog_terminate(37);
     return ind; // pour eviter les warning verbeux de SGI
   }
   else  return ind;
@@ -113,7 +113,7 @@ template <class Type, unsigned int D>
 inline   int  Tabdyn<Type,D>::bonmax(int ind)      {
   if(ind<=0) {
     Ferr<<"\n Tabdyn[bornmax()]: dimension de tableau negative ou nulle!"<<'\n';
-    exit(38);
+    prog_terminate(38);
     return ind; // pour eviter les warning verbeux de SGI
   }
   else  return ind;
@@ -131,7 +131,7 @@ inline void  Tabdyn<Type,D>::lectarg ( int &first,va_list & ptarg ){
   tab=new Type[taille];
   if(tab==NULL) {
     Ferr<<"Plus de mem pour alloc dyn!"<<'\n';
-    exit(39);
+    prog_terminate(39);
   }
   va_end(ptarg);
 }//lectarg()
@@ -150,7 +150,7 @@ template <class Type, unsigned int D>
 void Tabdyn<Type,D>::alloue( int  first,... ){
   if(tab!=NULL) {
     Ferr<< "\nTabdyn [alloue()]: Tableau dynamique deja alloue a la declaration!"<<'\n';
-    exit(40);
+    prog_terminate(40);
   }
   va_list ptarg;
   va_start( ptarg,first);
@@ -165,7 +165,7 @@ Type & Tabdyn<Type,D>::operator()(int first){
   else {
     Ferr <<"Tabdyn<Type,D>::operator()(int first) incompatbile avec D=";
     Ferr  << D<<'\n' ;
-    exit(41);
+    prog_terminate(41);
     return (tab[0]);// pour eviter les wranings verbeux de SGI !!!
   } 
 }//operator ()
@@ -177,7 +177,7 @@ Type & Tabdyn<Type,D>::operator()(int first, int second){
   else  {
     Ferr <<"Tabdyn<Type,D>::operator()(int first,int second) incompatbile";
     Ferr<<" avec D="  << D<<'\n' ;
-    exit(42);
+    prog_terminate(42);
     return(tab[0]);// pour eviter les wranings verbeux de SGI !!!
   } 
 }//operator ()
@@ -186,7 +186,7 @@ template <class Type,unsigned  int D>
 Type & Tabdyn<Type,D>::operator()(int first, int second, int third,...){
   /*  if(tab==NULL) {
     Ferr<< "Tabdyn [operator()]: Tableau dynamique pas alloue : acces impossible!"<<'\n';
-    exit(43);
+    prog_terminate(43);
   }
   */
   va_list ptarg;
@@ -493,7 +493,7 @@ inline void Liste<Type>::detruire(){//fucke', revu MC9/10/96
   else{
     Ferr << "ERREUR - Impossible de detruire un element car liste deja vide";
     Ferr<<'\n';
-    exit (1); // risque de pas voir le msg d'erreus
+    prog_terminate(1); // risque de pas voir le msg d'erreus
   }
 }
 
@@ -514,13 +514,13 @@ inline void Liste<Type> :: detruire_droite()
 		else
 		{
 			Ferr << "ERREUR - Impossible de detruire un element car fin de liste"<<'\n';
-			exit (44);
+			prog_terminate(44);
 		}
 	}
 	else
 	{
 		Ferr << "ERREUR - Impossible de detruire un element car liste vide"<<'\n';
-		exit (45);
+		prog_terminate(45);
 	}
 }
 
@@ -11,6 +11,8 @@
 using namespace std ;
 
 #include <cstdlib> // pour exit
+#include <stdint.h>
+#include <vector>
 
 #include<fstream> //.h>
 #include<iomanip> //.h>
@@ -25,6 +27,107 @@ extern "C" {
 #include "diffuseur.h"
 #include "voxel.h"
 
+// Sources de triangles pour Canopy::read_source()
+class TriSource{
+ public:
+  virtual ~TriSource() {}
+  virtual int size()=0;
+  // sommets, libelle, espece et opacite du triangle it
+  virtual void get(int it,float P[3][3],double &nom,short &specie,bool &opak)=0;
+};
+
+// tableau de Patch (segment partage ou memoire de l'appelant)
+class PatchSource : public TriSource{
+  Patch *Ts;
+  int Nt;
+ public:
+  PatchSource(Patch *T,int N) {Ts=T; Nt=N;}
+  int size() {return Nt;}
+  void get(int,float P[3][3],double &,short &,bool &);
+};
+
+// fichier binaire .canb projete en memoire
+// entete : "CANB", uint32 version(=1), uint32 taille des reels (4|8), uint32 0, uint64 n
+#define CANB_MAGIC "CANB"
+#define CANB_HEADER 24
+class CanbSource : public TriSource{
+  char *data;
+  size_t len,vblock;
+  uint32_t fsize;
+  int nb;
+ public:
+  CanbSource(char *);
+  ~CanbSource();
+  static bool is_canb(char *);
+  int size() {return nb;}
+  void get(int,float P[3][3],double &,short &,bool &);
+};
+
+// Demi-triangle projete par Canopy::projplan en mode tuiles : sommets dans
+// l'ordre de colorie_triangle(), indice du diffuseur (ou du groupe de capteur)
+// et pixels de l'ecran qu'il peut couvrir [i0,i1]x[j0,j1]
+struct Demi{
+  double a[3],b[3],c[3];
+  int32_t id;
+  int i0,i1,j0,j1;
+};
+
+// Diffuseur projete par Canopy::projplan hors tuiles, avant le tri par
+// profondeur : sommets dans le repere de l'ecran et 1 + indice dans Zdiff
+struct Projete{
+  double p[3][3];
+  int32_t id;
+};
+
+// Z hierarchique de Canopy::projplan : profondeur max des pixels de Zbuf par
+// bloc de 8 x 8 pixels (niveau 1) et de 8 x 8 blocs (niveau 2). Les max ne
+// font que baisser : un bloc ecrit est marque (sale) et recalcule seulement
+// quand un test en a besoin
+class Zhier{
+  int T,n1,n2;
+  std::vector<float> max1,max2;
+  std::vector<char> sale1,sale2;
+  double e[3][3]; // aretes du triangle du dernier cache()
+  float max_pixels(int,float **);
+ public:
+  void init(int,float);
+  bool cache(const double [3][2],int,int,int,int,double,float **);
+  void marque(int,int,int,int,double,double);
+  void sale(int,int,int,int);
+};
+
+// Tampons de Canopy::projplan : Timg x Timg contigus (ou une tuile), alloues
+// une fois et reutilises pour chaque direction (un par thread). Zid contient
+// 1 + l'indice (32 bits) dans Canopy::Zdiff du diffuseur vu, 0 pour un pixel vide
+class Zbuffer{
+ public:
+  float *Zdata,**Zbuf; // REELLE de infini.h
+  float *Zcopy;        // travail de infinitise_id()
+  int32_t *Iddata,**Zid;
+  double *Ddata;       // mode tuiles : profondeur des translates infinis
+  int Tz;
+  // mode tuiles : demi-triangles des diffuseurs et des capteurs, ranges par
+  // tuile (la tuile t contient idx[debut[t]..debut[t+1]-1]), groupes de capteurs
+  std::vector<Demi> demis,capts;
+  std::vector<int> debut,cdebut,curs,trans;
+  std::vector<int32_t> idx,cidx;
+  std::vector<int> gnum,gpix;
+  std::vector<bool> gnew;
+  // hors tuiles : diffuseurs projetes, ordre du plus proche au plus loin (cle :
+  // profondeur min, tri par tranches), Z hierarchique et triangles projetes /
+  // elimines car caches (cumuls)
+  std::vector<Projete> tris;
+  std::vector<int32_t> ordre;
+  std::vector<double> cle;
+  std::vector<int> tranche;
+  Zhier hz;
+  long nproj,ncache;
+  Zbuffer() {Zdata=Zcopy=NULL; Zbuf=NULL; Iddata=NULL; Zid=NULL; Ddata=NULL; Tz=0; nproj=ncache=0;}
+  ~Zbuffer() {libere();}
+  void alloue(int);
+  void libere();
+};
+
 // Canopy : contient les caracteristiques de la scene
 // Elle contiendra les resultats du lance de la simulation
 class Canopy{
@@ -33,12 +136,22 @@ class Canopy{
   reel bmax[3],vmax[3];
   bool infty;
   reel delta[2]; //sert a l'infini
+  // projplan : tampons par defaut, diffuseurs reels (Zdiff) et capteurs
+  // virtuels (Zcapt) dans l'ordre de Ldiff
+  Zbuffer zbuf;
+  Diffuseur **Zdiff,**Zcapt;
+  int nZdiff,nZcapt,maxZdiff;
+  void dessine_diffuseur(Zbuffer &,Point *,int32_t,bool,double,double);
+  void projplan_tuiles(Zbuffer &,Vecteur &,double,double,double,double,double *);
  public:
   //temporary public variable
   Voxel mesh;
   ListeD<Diffuseur *> Ldiff;
   ListeD<double> Ldiff0; //liste des labels des diffuseurs du .can (bon et pas bons) - MC10
   int Timg; //Resolution de l'image projplan (Avant en #define) - 0699 (default 1536)
+  int Ttuile; // taille des tuiles de projplan (0 : image entiere en memoire)
+  bool aretes; // projplan colorie les diffuseurs avec colorie_aretes() (hors tuiles)
+  bool zhier; // projplan elimine les diffuseurs caches (Z hierarchique, hors tuiles)
   //member function
   unsigned int radim; // nombre de faces visibles de la scene
   // necessaire au capteur virtuel
@@ -46,10 +159,17 @@ class Canopy{
   unsigned int nbcell; 
   unsigned int nbprim; 
   
-  Canopy() {Etot=Einit=0.0;}
+  Canopy() {Etot=Einit=0.0; Zdiff=Zcapt=NULL; nZdiff=nZcapt=maxZdiff=0; Ttuile=0; aretes=zhier=false;}
+  ~Canopy() {delete [] Zdiff; delete [] Zcapt;}
   // cree la liste des diffuseurs de la scene
   long int  parse_can(char *,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
   long int  read_shm(int,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
+  // cree la liste des diffuseurs a partir d'un tableau de Patch (shm ou memoire)
+  long int  read_patches(Patch *,int,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
+  long int  read_canb(char *,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
+  long int  read_source(TriSource &,char *,char *,reel *,reel*,int,char *,Diffuseur **&);
+  // libere les diffuseurs pour recharger une scene (appels successifs en memoire)
+  void vide();
   void cstruit_grille(double Renv) {mesh.construction(bmin,bmax,Renv,Ldiff);}
   void sail_pur(VEC **Cfar,double *Esource,char* envname);
 
@@ -73,6 +193,10 @@ class Canopy{
 #endif
   
   void projplan(Vecteur &,bool,double *);
+  // indexe Ldiff pour projplan(Vecteur &,bool,double *,Zbuffer &), qui ne
+  // modifie pas la scene et peut etre appele en parallele avec des Zbuffer distincts
+  void index_diff();
+  void projplan(Vecteur &,bool,double *,Zbuffer &);
   void data3d(int tx,int ty,Vecteur &visee,bool infty,long int ** &Zno) ;
   // bool converge(double seuil);
   //void xabs(char*,double *,double*,bool normme=false);
@@ -30,6 +30,9 @@ public:
   void  show(char *texte="",ostream& out=cout) // montre!
   { prim->show(texte,out);  }
   virtual  unsigned int num()=0;
+  // num. de la face vue depuis dir (et de l'autre face) sans changer la face active
+  virtual  unsigned int num_vu(Vecteur &dir)=0;
+  virtual  unsigned int num_dos(Vecteur &dir)=0;
   virtual  void togle_face()=0;
   virtual void active(Vecteur&)=0;
   virtual void active(unsigned char)=0;
@@ -58,6 +61,8 @@ public:
   double rho() {return  opti->rho();}
   double tau() {return opti->tau();} 
   unsigned int num() {return no;}
+  unsigned int num_vu(Vecteur &dir) {return no;}
+  unsigned int num_dos(Vecteur &dir) {return no;}
   void togle_face() {}
   void active(Vecteur &dir) {}
   void active(unsigned char cefa) {}
@@ -99,6 +104,12 @@ public:
   double tau() {return popt(actif)->tau();} 
  
   unsigned int num() {return no[actif];}
+  unsigned int num_vu(Vecteur &dir) {
+    return (dir.prod_scalaire(prim->normal())<0)? no[sup] : no[inf];
+  }
+  unsigned int num_dos(Vecteur &dir) {
+    return (dir.prod_scalaire(prim->normal())<0)? no[inf] : no[sup];
+  }
   void togle_face() {actif =1-actif;}
   void active(Vecteur &dir) {
     if(  dir.prod_scalaire(prim->normal())<0)
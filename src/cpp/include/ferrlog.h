@@ -42,9 +42,14 @@ class ferrlog
 
 extern ferrlog Ferr ;               //ferrlog.cpp
 
-//void prog_terminate (int code) ;
-/* assure la destruction du ferrlog avant exit;
- * puis apelle exit(code)
- */
+// Sortie en faute : vide le ferrlog puis appelle exit(code), ou leve
+// Terminaison(code) si prog_exception (programme execute dans un processus
+// hote, cf. canestra2py, qui ne doit pas etre tue par une erreur d'entree)
+struct Terminaison {
+  int code ;
+  Terminaison(int c) : code(c) {}
+} ;
+extern bool prog_exception ;           //ferrlog.cpp
+void prog_terminate (int code) ;
 
 #endif
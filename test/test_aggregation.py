@@ -0,0 +1,46 @@
+import json
+import pickle
+
+import numpy
+from nose.tools import assert_raises
+
+from alinea.caribu.aggregation import GroupBy, register_reducer, reducers, GroupedResults
+
+
+def test_groupby():
+    groups = ['b', 1, 'b', 1, 'soil']
+    values = [1., 2., 3., float('nan'), 5.]
+    area = [1., 1., 3., 0., 2.]
+    grouped = GroupBy(groups)
+    assert sorted(grouped.keys, key=str) == [1, 'b', 'soil']
+    assert grouped.split(values)['b'] == [1., 3.]
+    assert grouped.reduce(area, 'sum') == {'b': 4., 1: 1., 'soil': 2.}
+    # triangles with a null area do not contribute to weighted means
+    wmean = grouped.reduce(values, 'weighted_mean', weights=area)
+    assert wmean == {'b': 2.5, 1: 2., 'soil': 5.}
+    assert grouped.reduce(values, 'max')['b'] == 3
+    assert grouped.reduce(values, len) == {'b': 2, 1: 2, 'soil': 1}
+    assert_raises(ValueError, lambda: grouped.reduce(values, 'unknown'))
+
+    res = grouped.aggregate({'Eabs': values, 'area': area}, ('sum', 'min'))
+    assert res['area']['min'] == {'b': 1., 1: 0., 'soil': 2.}
+
+    register_reducer('count', lambda g, v, w: g.counts)
+    try:
+        assert GroupBy([0, 0, 2], ids=['x', 'y', 'z']).reduce([1, 2, 3], 'count') == {'x': 2, 'z': 1}
+    finally:
+        reducers.pop('count')
+
+
+def test_grouped_results():
+    out = {'band': {'area': [1., 2., 1.], 'Eabs': [2., 4., 6.]}}
+    results = GroupedResults(out, ['p', 'soil', 'p'], conv_unit=0.1)
+    aggregated = results.nested(results.aggregated, ['band'], ['area', 'Eabs'])
+    # plain nested dicts, that can be serialised
+    assert type(aggregated['band']) is dict
+    assert json.loads(json.dumps(aggregated)) == aggregated
+    assert pickle.loads(pickle.dumps(aggregated)) == aggregated
+    numpy.testing.assert_almost_equal(aggregated['band']['area']['p'], 0.02)
+    numpy.testing.assert_almost_equal(aggregated['band']['Eabs']['p'], 400)
+    assert 'soil' not in aggregated['band']['Eabs']
+    numpy.testing.assert_almost_equal(results.soil_raw('band', 'Eabs'), [400])
@@ -0,0 +1,86 @@
+from nose.tools import assert_raises
+
+from alinea.caribu.backends import Backend, CanestraBackend, problem, select_backend, \
+    register_backend, available_backends, backends
+from alinea.caribu.caribu import raycasting
+
+
+class Constant(Backend):
+    name = 'constant'
+
+    def supports(self, desc):
+        return desc['algorithm'] == 'raycasting'
+
+    def cost(self, desc):
+        return 0.
+
+    def raycasting(self, triangles, materials, lights, domain=None, screen_size=1536, threads=1):
+        return {'Eabs': [1.] * len(triangles)}
+
+    def radiosity(self, triangles, materials, lights, screen_size=1536, ff_cache=None, threads=1):
+        raise NotImplementedError
+
+    def mixed_radiosity(self, triangles, materials, lights, domain, soil_reflectance, diameter,
+                        layers, height, screen_size=1536, ff_cache=None, threads=1):
+        raise NotImplementedError
+
+
+class RaycastingOnly(Backend):
+    name = 'raycasting_only'
+
+    def raycasting(self, triangles, materials, lights, domain=None, screen_size=1536, threads=1):
+        return {'Eabs': [1.] * len(triangles)}
+
+
+class Duck(object):
+    name = 'duck'
+
+    def raycasting(self, triangles, materials, lights, domain=None, screen_size=1536, threads=1):
+        return {'Eabs': [1.] * len(triangles)}
+
+
+def test_select_backend():
+    assert 'subprocess' in available_backends()
+    desc = problem('radiosity', 100, lights=16)
+    assert select_backend('subprocess', desc).name == 'subprocess'
+    assert_raises(ValueError, lambda: select_backend('unknown', desc))
+    assert_raises(ValueError, lambda: problem('unknown', 100))
+    # sharding is only relevant to raycasting
+    sharded = CanestraBackend('s4', shards=4)
+    assert not sharded.supports(desc)
+    assert sharded.supports(problem('raycasting', 10 ** 5, lights=16))
+    assert sharded.cost(problem('raycasting', 10 ** 5, lights=16)) < backends['subprocess'].cost(
+        problem('raycasting', 10 ** 5, lights=16))
+    assert sharded.cost(problem('raycasting', 10, lights=16)) > backends['subprocess'].cost(
+        problem('raycasting', 10, lights=16))
+
+    # in-process runs are never picked automatically
+    assert not backends['inprocess'].auto
+    for algorithm in ('raycasting', 'radiosity', 'mixed_radiosity'):
+        assert select_backend('auto', problem(algorithm, 10)).name != 'inprocess'
+
+    register_backend(Constant())
+    try:
+        assert select_backend('auto', problem('raycasting', 10)).name == 'constant'
+        assert_raises(ValueError, lambda: select_backend('constant', desc))
+    finally:
+        backends.pop('constant')
+
+
+def test_register_backend():
+    # incomplete backends are rejected
+    assert_raises(TypeError, RaycastingOnly)
+    assert_raises(TypeError, lambda: register_backend(Duck()))
+    Backend.register(Duck)
+    assert_raises(TypeError, lambda: register_backend(Duck()))
+    assert 'duck' not in backends
+
+
+def test_canestra_backend():
+    triangles = [[(0, 0, 0), (1, 0, 0), (0, 1, 0)]]
+    materials = [(0.1,)]
+    out = backends['subprocess'].raycasting(triangles, materials, lights=[(1, (0, 0, -1))])
+    ref = raycasting(triangles, materials)
+    assert out['Eabs'] == ref['Eabs']
+    out = backends['subprocess'].raycasting(triangles, materials, lights=[(1, (0, 0, -1))], threads=2)
+    assert out['Eabs'] == ref['Eabs']
@@ -0,0 +1,72 @@
+from nose import SkipTest
+from nose.tools import assert_raises, assert_almost_equal
+
+from alinea.caribu.canestra_engine import (PatchScene, is_available, patch_dtype,
+                                           material_index, light_array)
+from alinea.caribu.caribu import raycasting, radiosity
+
+
+def test_patch_layout():
+    # must match the Patch struct of canestra (transf.h)
+    assert patch_dtype.itemsize == 40
+    assert patch_dtype.fields['P'][1] == 4
+
+
+def test_material_index():
+    labels = ['000000000000', '100001000000', '200001001000']
+    t = material_index(labels)
+    assert list(t) == [0, -1, 2]
+    assert_raises(ValueError, lambda: material_index(['%d' % (200 * 10 ** 11)]))
+
+
+def test_patch_scene():
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    scene = PatchScene([pts1, pts2], ['100001000000', '200001001000'])
+    assert len(scene) == 2
+    assert scene.patches['P'].shape == (2, 3, 3)
+    assert scene.can_string().startswith('p 1 100001000000 3 0.000000')
+    assert_raises(ValueError, lambda: PatchScene([pts1], ['100001000000'] * 2))
+
+
+def test_light_array():
+    lights = light_array([(1, (0, 0, -1)), (0.5, (0, 1, -1))])
+    assert lights.shape == (2, 4)
+    assert lights.flags['C_CONTIGUOUS']
+
+
+def test_inprocess_matches_canestrad():
+    if not is_available():
+        raise SkipTest('canestra2py extension is not available')
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+    triangles = [pts1, pts2]
+    mats = [(0.06, 0.04), (0.1,)]
+    for f in (raycasting, radiosity):
+        ref = f(triangles, mats)
+        res = f(triangles, mats, inprocess=True)
+        assert res['label'] == ref['label']
+        for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            for x, y in zip(res[k], ref[k]):
+                assert_almost_equal(x, y, 5)
+    # repeated calls in the same process
+    res2 = radiosity(triangles, mats, inprocess=True)
+    assert_almost_equal(res2['Eabs'][0], res['Eabs'][0], 6)
+
+
+def test_inprocess_error():
+    if not is_available():
+        raise SkipTest('canestra2py extension is not available')
+    import shutil
+    import tempfile
+    from alinea.caribu.canestra_engine import run
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    scene = PatchScene([pts1], ['100001000000'])
+    workdir = tempfile.mkdtemp()
+    try:
+        # canestra errors are returned, instead of exiting the interpreter
+        status, res = run(['-p', 'missing.opt', '-1', '-A'], scene.patches, light_array([(1, (0, 0, -1))]),
+                          workdir)
+        assert status != 0
+    finally:
+        shutil.rmtree(workdir)
@@ -64,3 +64,86 @@ def test_radiosity_exception():
     # unmatch triangles <-> materials
     materials = [green_leaf_PAR]
     assert_raises(ValueError, lambda: radiosity(triangles, materials))
+
+
+def test_sharded_raycasting():
+    from alinea.caribu.caribu import shard_lights
+    assert map(len, shard_lights(range(7), 3)) == [3, 2, 2]
+    assert len(shard_lights(range(2), 4)) == 2
+
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+    triangles = [pts1, pts2]
+    mats = [(0.06, 0.04), (0.1,)]
+    lights = [(1, (0, 0, -1)), (0.5, (0.2, 0, -1)), (0.3, (0, 0.3, -1)), (0.2, (-0.1, -0.1, -1))]
+    ref = raycasting(triangles, mats, lights)
+    res = raycasting(triangles, mats, lights, shards=3)
+    assert res['label'] == ref['label']
+    for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf', 'Ei'):
+        for x, y in zip(res[k], ref[k]):
+            assert abs(x - y) <= 1e-5 * max(1, abs(y))
+    # in-process runs are serialised
+    assert_raises(ValueError, lambda: raycasting(triangles, mats, lights, inprocess=True, shards=3))
+
+
+def test_threaded_raycasting():
+    from alinea.caribu.caribu_shell import CaribuOptionError
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+    triangles = [pts1, pts2]
+    mats = [(0.06, 0.04), (0.1,)]
+    lights = [(1, (0, 0, -1)), (0.5, (0.2, 0, -1)), (0.3, (0, 0.3, -1)), (0.2, (-0.1, -0.1, -1))]
+    ref = raycasting(triangles, mats, lights)
+    res = raycasting(triangles, mats, lights, threads=3)
+    for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf', 'Ei'):
+        assert res[k] == ref[k]
+    assert_raises(CaribuOptionError, lambda: raycasting(triangles, mats, lights, threads=0))
+
+
+def test_exposure_matrix():
+    from alinea.caribu.caribu import exposure_matrix, apply_sky
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+    pts3 = [(0, 0, 0.5), (0, 1, 0.5), (1, 0, 0.5)]
+    triangles = [pts1, pts2, pts3]
+    mats = [(0.06, 0.04), (0.1,), (0.1, 0.05, 0.2, 0.1)]
+    lights = [(1, (0, 0, -1)), (0.5, (0.3, 0, -1)), (0.4, (0, 0.2, 1))]
+    expo = exposure_matrix(triangles, mats, lights)
+    assert expo['Ei_sup'].shape == (3, 3)
+    ref = raycasting(triangles, mats, lights)
+    res = apply_sky(expo, mats)
+    for k in ('Eabs', 'Ei_sup', 'Ei_inf', 'Ei'):
+        for x, y in zip(res[k], ref[k]):
+            assert abs(x - y) <= 1e-5 * max(1, abs(y))
+    res = apply_sky(expo, mats, [2, 0, 0])
+    assert res['Eabs'][0] == 0 and res['Ei_inf'][2] > 0
+    assert_raises(ValueError, lambda: apply_sky(expo, mats, [1, 1]))
+
+
+def test_material_index():
+    from alinea.caribu.caribu import MaterialIndex, opt_string_and_labels, x_opt_strings_and_labels, \
+        x_radiosity
+    pts1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    pts2 = [(0, 0, 1), (1, 0, 1), (0, 1, 1)]
+    pts3 = [(0, 0, 2), (1, 0, 2), (0, 1, 2)]
+    triangles = [pts1, pts2, pts3]
+    table = [green_leaf_PAR, (0.13,), green_leaf_PAR]
+    index = [0, 1, 2]
+    mats = MaterialIndex(table, index)
+    assert list(mats) == table
+    o_string, labels = opt_string_and_labels(mats)
+    # duplicated materials share the same specie
+    assert o_string.startswith('n 2\n')
+    assert labels[0] == labels[2] != labels[1]
+    ref = radiosity(triangles, table)
+    res = radiosity(triangles, mats)
+    for k in ('Eabs', 'Ei', 'Ei_sup', 'Ei_inf'):
+        assert res[k] == ref[k]
+
+    x_mats = {'par': MaterialIndex(table, index), 'nir': MaterialIndex([(0.4, 0.4), (0.5,)], [0, 1, 0])}
+    opt_strings, labels = x_opt_strings_and_labels(x_mats, {'par': -1, 'nir': -1})
+    assert labels[0] == labels[2] != labels[1]
+    ref = x_radiosity(triangles, {'par': table, 'nir': [(0.4, 0.4), (0.5,), (0.4, 0.4)]})
+    res = x_radiosity(triangles, x_mats)
+    for band in ('par', 'nir'):
+        assert res[band]['Eabs'] == ref[band]['Eabs']
@@ -1,5 +1,7 @@
 """ Unit Tests for caribu_shell module """
 
+from nose import SkipTest
+
 from alinea.caribu.caribu_shell import Caribu, CaribuOptionError, vcaribu
 from alinea.caribu.data_samples import data_path
 
@@ -142,3 +144,177 @@ def test_vcaribu():
     pattern = None
     options = {'infinity': False}
     nrj, status = vcaribu(can, sky, opts, pattern, options)
+
+
+def test_shm_transport():
+    from alinea.caribu import sysv_shm
+    if not sysv_shm.is_available():
+        raise SkipTest('System V shared memory is not available')
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+    nrj = {}
+    for transport in ('file', 'shm'):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False,
+                     resdir=None, resfile=None, transport=transport)
+        sim.run()
+        nrj[transport] = sim.nrj
+    for band in ('par', 'nir'):
+        ref, res = nrj['file'][band]['data'], nrj['shm'][band]['data']
+        assert res['label'] == ref['label']
+        for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            for x, y in zip(res[k], ref[k]):
+                assert abs(x - y) <= 1e-5 * max(1, abs(y))
+
+
+def test_canb_scene():
+    import os
+    import tempfile
+    from alinea.caribu.file_adaptor import read_can, write_canb
+    can = data_path('filterT.can')
+    cscene = read_can(can)
+    triangles = [tri for label in cscene for tri in cscene[label]]
+    labels = [label for label in cscene for _ in cscene[label]]
+    fd, canb = tempfile.mkstemp(suffix='.canb')
+    os.close(fd)
+    try:
+        write_canb(canb, triangles, labels, dtype='f8')
+        sky = data_path('zenith.light')
+        opts = [data_path('par.opt')]
+        for pattern in (None, data_path('filter.8')):
+            nrj = []
+            for scene in (can, canb):
+                sim = Caribu(canfile=scene, skyfile=sky, optfiles=opts, patternfile=pattern,
+                             infinitise=pattern is not None, resdir=None, resfile=None)
+                sim.run()
+                nrj.append(sim.nrj['par']['data'])
+            ref, res = nrj
+            assert res['label'] == ref['label']
+            for k in ('area', 'Eabs', 'Ei_sup'):
+                for x, y in zip(res[k], ref[k]):
+                    assert abs(x - y) <= 1e-5 * max(1, abs(y))
+    finally:
+        os.remove(canb)
+
+
+def test_binary_result():
+    import json
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+    nrj = []
+    for binary in (False, True):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False, direct=False,
+                     resdir=None, resfile=None, binary_result=binary)
+        sim.run()
+        nrj.append(sim.nrj)
+    for band in ('par', 'nir'):
+        ref, res = nrj[0][band]['data'], nrj[1][band]['data']
+        # results are plain dicts of lists
+        assert json.loads(json.dumps(res)) == res
+        assert res['label'] == ref['label']
+        assert res['index'] == ref['index']
+        for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+            for x, y in zip(res[k], ref[k]):
+                assert abs(x - y) <= 1e-5 * max(1, abs(y))
+
+
+def test_parallel_bands():
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt'), data_path('par.opt')]
+    names = ['par', 'nir', 'par2']
+    for direct, pattern, diameter, layers in ((True, None, -1, None),
+                                              (False, None, -1, None),
+                                              (False, data_path('filter.8'), 1, 6)):
+        nrj = []
+        for processes in (1, 3):
+            sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, optnames=names, patternfile=pattern,
+                         infinitise=pattern is not None, direct=direct, sphere_diameter=diameter,
+                         nb_layers=layers, can_height=21, resdir=None, resfile=None, processes=processes)
+            sim.run()
+            nrj.append(sim.nrj)
+        assert sorted(nrj[1].keys()) == sorted(names)
+        for band in names:
+            ref, res = nrj[0][band]['data'], nrj[1][band]['data']
+            assert res['label'] == ref['label']
+            for k in ('area', 'Eabs', 'Ei_sup', 'Ei_inf'):
+                assert res[k] == ref[k]
+
+
+def test_parallel_exposure():
+    from numpy.testing import assert_array_equal
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt'), data_path('par.opt')]
+    names = ['par', 'nir', 'par2']
+    expo = []
+    for processes in (1, 3):
+        sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, optnames=names, infinitise=False,
+                     resdir=None, resfile=None, exposure=True, processes=processes)
+        sim.run()
+        expo.append(sim.exposure_data)
+    assert expo[1] is not None
+    for ref, res in zip(expo[0], expo[1]):
+        assert_array_equal(res, ref)
+
+
+def test_ff_cache():
+    import tempfile
+    from alinea.caribu.ff_cache import FormFactorCache
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+    cache = FormFactorCache(tempfile.mkdtemp())
+    try:
+        for pattern, diameter, layers in ((None, -1, None), (data_path('filter.8'), 1, 6)):
+            nrj = []
+            for ff_cache in (None, cache, cache):
+                sim = Caribu(canfile=can, skyfile=sky, optfiles=opts, patternfile=pattern,
+                             infinitise=pattern is not None, direct=False, sphere_diameter=diameter,
+                             nb_layers=layers, can_height=21, resdir=None, resfile=None, ff_cache=ff_cache)
+                sim.run()
+                nrj.append(sim.nrj)
+            for band in ('par', 'nir'):
+                for res in nrj[1:]:
+                    assert res[band]['data']['Eabs'] == nrj[0][band]['data']['Eabs']
+        assert len(cache.entries()) == 2
+        # lru eviction
+        cache.max_size = 1
+        cache.evict()
+        assert len(cache.entries()) == 0
+    finally:
+        import shutil
+        shutil.rmtree(cache.root)
+
+
+def test_workdir_pool():
+    import os
+    import tempfile
+    from alinea.caribu.workdir import WorkdirPool
+    can = data_path('filterT.can')
+    sky = data_path('zenith.light')
+    opts = [data_path('par.opt'), data_path('nir.opt')]
+    ref = Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False, resdir=None, resfile=None)
+    ref.run()
+    ref.close()
+    with WorkdirPool(tempfile.mkdtemp()) as pool:
+        dirs = []
+        for i in range(2):
+            with Caribu(canfile=can, skyfile=sky, optfiles=opts, infinitise=False, resdir=None,
+                        resfile=None, workdir_pool=pool) as sim:
+                sim.run()
+                dirs.append(str(sim.tempdir))
+                assert os.path.dirname(dirs[-1]) == pool.root
+                # file inputs are linked, not copied
+                assert os.path.samefile(sim.tempdir / 'filterT.can', can) or os.path.islink(
+                    sim.tempdir / 'filterT.can')
+            assert sim.tempdir == ''
+            for band in ('par', 'nir'):
+                assert sim.nrj[band]['data']['Eabs'] == ref.nrj[band]['data']['Eabs']
+        # the working directory is reused, and emptied between runs
+        assert dirs[0] == dirs[1]
+        assert pool.idle == dirs[:1]
+        assert os.listdir(dirs[0]) == []
+    assert not os.path.exists(dirs[0])
+    os.rmdir(pool.root)
@@ -258,6 +258,7 @@ if run_test:
         out, agg = cscene.run(direct=True, infinite=False)
         assert 'par' in out.keys()
         assert 'nir' in out.keys()
+        assert type(out['par']) is dict and type(agg['par']) is dict
         assert len(out['par']['Eabs']) == 2
         assert len(out['par']['Eabs']['lower']) == 2
         assert len(out['nir']['Eabs']) == 2
@@ -281,4 +282,71 @@ if run_test:
         assert len(out['nir']['Eabs']) == 2
         assert out['par']['Eabs']['upper'][0] != out['nir']['Eabs']['upper'][0]
 
+        # lazy outputs
+        raw, lazy = cscene.run(direct=False, infinite=True, lazy=True)
+        assert raw is None and lazy is None
+        for band in ('par', 'nir'):
+            assert cscene.results.raw(band, 'Eabs') == out[band]['Eabs']
+            assert cscene.results.aggregated(band, 'Eabs') == agg[band]['Eabs']
+
         return out, agg
+
+
+    def test_exposure_matrix():
+        pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        pts_2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+        pts_3 = [(1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        pyscene = {'lower': [pts_1, pts_3], 'upper': [pts_2]}
+        lights = [(1, (0, 0, -1)), (0.5, (0.3, 0, -1)), (0.2, (0, -0.4, -1))]
+        cscene = CaribuScene(pyscene, light=lights, pattern=(0, 0, 1, 1))
+        for infinite in (False, True):
+            expo = cscene.exposure_matrix(infinite=infinite)
+            assert expo['Ei_sup'].shape == (3, 3)
+            out, agg = cscene.apply_sky(split_face=True)
+            ref, ref_agg = cscene.run(direct=True, infinite=infinite,
+                                      split_face=True)
+            band = cscene.default_band
+            for k in ('Eabs', 'Ei', 'Ei_sup'):
+                for pid in pyscene:
+                    assert_almost_equal(agg[band][k][pid], ref_agg[band][k][pid], 3)
+        # explicit weights
+        out, agg = cscene.apply_sky([e for e, _ in lights], simplify=True)
+        assert_almost_equal(agg['Eabs']['upper'],
+                            ref_agg[band]['Eabs']['upper'], 3)
+        # another sky on the same directions
+        out, agg = cscene.apply_sky([0, 2, 0], simplify=True)
+        assert agg['Eabs']['upper'] > 0
+
+
+    def test_update_primitives():
+        pts_1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+        pts_2 = [(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]
+        pts_3 = [(1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        cscene = CaribuScene({'lower': [pts_1, pts_3], 'upper': [pts_1]},
+                             pattern=(0, 0, 1, 1))
+        cscene.update_primitives({'upper': [pts_2]})
+        cscene.add_primitives({'new': [pts_3]}, {cscene.default_band: (0.1, 0.1)})
+        cscene.remove_primitives(['lower'])
+        assert cscene.clean() == {'lower', 'upper', 'new'}
+        assert cscene.material[cscene.default_band]['new'] == (0.1, 0.1)
+        ref = CaribuScene({'upper': [pts_2], 'new': [pts_3]},
+                          opt={cscene.default_band: {'upper': cscene.default_material, 'new': (0.1, 0.1)}},
+                          pattern=(0, 0, 1, 1))
+        _, agg = cscene.run(simplify=True)
+        _, ref_agg = ref.run(simplify=True)
+        assert agg == ref_agg
+        assert cscene.bbox() == ref.bbox()
+
+
+    def test_indexed_mesh():
+        import numpy
+        points = numpy.array([(0, 0, 0), (1, 0, 0), (0, 1, 0), (1, 1, 0)], dtype=float)
+        indices = numpy.array([(0, 1, 2), (1, 3, 2)])
+        upper = [[(0, 0, 1e-5), (1, 0, 1e-5), (0, 1, 1e-5)]]
+        cscene = CaribuScene({'lower': (points, indices), 'upper': upper}, pattern=(0, 0, 1, 1))
+        assert cscene.scene['lower'][1] == [(1, 0, 0), (1, 1, 0), (0, 1, 0)]
+        soup = CaribuScene({'lower': cscene.scene['lower'], 'upper': upper}, pattern=(0, 0, 1, 1))
+        for infinite in (False, True):
+            _, agg = cscene.run(infinite=infinite, simplify=True)
+            _, ref = soup.run(infinite=infinite, simplify=True)
+            assert agg == ref
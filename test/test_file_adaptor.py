@@ -1,4 +1,8 @@
-from alinea.caribu.file_adaptor import read_light, read_pattern, read_opt, read_can, build_materials
+import os
+import tempfile
+
+from alinea.caribu.file_adaptor import read_light, read_pattern, read_opt, read_can, build_materials, \
+    read_canb, write_canb, load_canb, is_canb, read_vec0, result_data, write_can
 from alinea.caribu.data_samples import data_path
 
 
@@ -45,6 +49,75 @@ def test_can():
     return cscene
 
 
+def test_canb():
+    can = data_path('filterT.can')
+    cscene = read_can(can)
+    triangles = [tri for label in cscene for tri in cscene[label]]
+    labels = [label for label in cscene for _ in cscene[label]]
+    fd, path = tempfile.mkstemp(suffix='.canb')
+    os.close(fd)
+    try:
+        for dtype in ('f4', 'f8'):
+            write_canb(path, triangles, labels, dtype=dtype)
+            assert is_canb(path)
+            vertices, labs = load_canb(path)
+            assert vertices.shape == (len(triangles), 3, 3)
+            assert vertices.dtype.itemsize == int(dtype[1])
+            cscene_b = read_canb(path)
+            assert cscene_b.keys() == cscene.keys()
+            for label in cscene:
+                for tb, t in zip(cscene_b[label], cscene[label]):
+                    for pb, p in zip(tb, t):
+                        for xb, x in zip(pb, p):
+                            assert abs(xb - x) < 1e-5
+    finally:
+        os.remove(path)
+    assert not is_canb(can)
+
+
+def test_write_can():
+    can = data_path('filterT.can')
+    cscene = read_can(can)
+    triangles = [tri for label in cscene for tri in cscene[label]]
+    labels = [label for label in cscene for _ in cscene[label]]
+    fd, path = tempfile.mkstemp(suffix='.can')
+    os.close(fd)
+    try:
+        write_can(path, triangles, labels, chunk_size=7)
+        cscene_w = read_can(path)
+        with open(path) as f:
+            lines = f.readlines()
+    finally:
+        os.remove(path)
+    assert len(lines) == len(triangles)
+    assert lines[0].startswith('p 1 %s 3 ' % labels[0])
+    assert cscene_w == cscene
+
+
+def test_vec0():
+    content = "# canestrad: doc\n# No Label1 Area Eabs(E/s/m2) Ei(sup) Ei(inf)\n" \
+              "0 100001001000 0.5 1.0 2.0 -1\n1 1001 0 NaN NaN NaN\n2 10000000001 0.25 3 4 5\n"
+    fd, path = tempfile.mkstemp(suffix='.vec0')
+    os.close(fd)
+    try:
+        with open(path, 'w') as f:
+            f.write(content)
+        doc, records = read_vec0(path)
+    finally:
+        os.remove(path)
+    assert doc == "# canestrad: doc\n"
+    assert len(records) == 3
+    assert records['label'][0] == 100001001000
+    data = result_data(records)
+    assert isinstance(data, dict)
+    assert data['index'] == [0, 1, 2]
+    assert data['label'] == ['100001001000', '000000001001', '10000000001']
+    assert data['area'] == [0.5, 0, 0.25]
+    assert data['Ei_sup'][1] != data['Ei_sup'][1]
+    assert sorted(data.keys()) == sorted(['index', 'label', 'area', 'Eabs', 'Ei_sup', 'Ei_inf'])
+    assert result_data(records, ['a', 'b', 'c'])['label'] == ['a', 'b', 'c']
+
+
 def test_materials():
     can = data_path('filterT.can')
     cscene = read_can(can)
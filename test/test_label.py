@@ -0,0 +1,30 @@
+from alinea.caribu.label import Label, encode, decode, label_strings, encode_label, decode_label
+
+
+def test_encode_decode():
+    labels = encode(optical_id=[1, 2, 12], leaf_id=[0, 1, 1], plant_id=[3, 45678, 1], elt_id=7)
+    assert labels.tolist() == [100003000007, 245678001007, 1200001001007]
+    assert label_strings(labels) == ['100003000007', '245678001007', '1200001001007']
+    for lab in label_strings(labels)[:2]:
+        label = Label(lab)
+        assert decode(lab) == (label.optical_id, label.plant_id, label.leaf_id, label.elt_id)
+    optical_id, plant_id, leaf_id, elt_id = decode(label_strings(labels))
+    assert optical_id.tolist() == [1, 2, 12]
+    assert plant_id.tolist() == [3, 45678, 1]
+    assert leaf_id.tolist() == [0, 1, 1]
+    assert elt_id.tolist() == [7, 7, 7]
+    assert label_strings(encode(0, 0, 0, 0)) == '000000000000'
+
+
+def test_encode_decode_round_trip():
+    labels = [200007001003, 100001000001, 1200045678999]
+    assert encode(*decode(labels)).tolist() == labels
+    assert encode(*decode('200007001003')) == 200007001003
+    assert decode(encode(2, 7, 1, 3)) == (2, 7, 1, 3)
+
+
+def test_encode_decode_label():
+    labels = encode_label(opt_id=[1, 2], opak=[0, 1], plant_id=3, elt_id=[4, 5, 6], minlength=4)
+    assert labels == ['100003000004', '200003001005', '100003000006', '200003001004']
+    assert decode_label(labels) == [(1, 2, 1, 2), (0, 1, 0, 1), (3, 3, 3, 3), (4, 5, 6, 4)]
+    assert decode_label([]) == []
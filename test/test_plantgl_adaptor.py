@@ -7,7 +7,8 @@ except ImportError:
 
 if run_test:
 
-    from alinea.caribu.plantgl_adaptor import scene_to_cscene, mtg_to_cscene
+    from alinea.caribu.plantgl_adaptor import scene_to_cscene, mtg_to_cscene, \
+        scene_to_meshes, tessellate, TessellationCache
 
     def test_scene():
         s = pgl.Scene()
@@ -45,4 +46,30 @@ if run_test:
         assert len(cs.values()[0][0]) == 3
         assert len(cs.values()[0][0][0]) == 3
 
-        return cs
\ No newline at end of file
+        return cs
+
+
+    def test_tessellation_cache():
+        sphere = pgl.Sphere()
+        s = pgl.Scene()
+        s.add(pgl.Shape(sphere))
+        s.add(pgl.Shape(sphere))
+        ref = scene_to_cscene(s)
+        cache = TessellationCache(maxsize=10)
+        assert scene_to_cscene(s, cache=cache) == ref
+        # the shared geometry is tessellated once
+        assert len(cache) == 1
+        assert scene_to_cscene(s, cache=cache, processes=2) == ref
+        assert cache.hits == 2
+        # new shapes or wrappers of a cached geometry are not tessellated again
+        tessellate([s[0].geometry, pgl.Shape(sphere)], cache=cache)
+        assert cache.hits == 4
+        # geometries modified in place are tessellated again once discarded
+        sphere.radius = 2
+        cache.discard(sphere)
+        assert scene_to_cscene(s, cache=cache) != ref
+
+        meshes = scene_to_meshes(s, processes=2)
+        points, indices = meshes.values()[0]
+        assert points.shape[1] == 3
+        assert indices.shape == (len(ref.values()[0]), 3)
@@ -0,0 +1,69 @@
+import numpy
+from nose.tools import assert_raises
+
+from alinea.caribu.scene_store import TriangleStore, IndexedMesh
+
+
+def test_triangle_store():
+    t1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    t2 = [(0, 0, 1), (2, 0, 1), (0, 2, 1)]
+    cscene = {'a': [t1, t2], 3: [t2]}
+    store = TriangleStore.from_dict(cscene)
+    assert len(store) == 3
+    assert store.vertices.shape == (3, 3, 3)
+    assert store.vertices.nbytes == 3 * 72
+    assert store.offsets.tolist() == [0, 2, 3] or store.offsets.tolist() == [0, 1, 3]
+    assert store.count('a') == 2
+    assert sorted(store.groups(), key=str) == [3, 'a', 'a']
+    areas = dict(zip(store.groups(), store.areas()))
+    assert areas[3] == 2
+    assert store.bbox() == ((0, 0, 0), (2, 2, 1))
+    view = store.view()
+    assert len(view) == 2
+    assert 'a' in view and 'b' not in view
+    assert view['a'] == [t1, t2]
+    assert dict(view) == cscene
+
+
+def test_store_update():
+    t1 = [(0, 0, 0), (1, 0, 0), (0, 1, 0)]
+    t2 = [(0, 0, 1), (2, 0, 1), (0, 2, 1)]
+    t3 = [(0, 0, 3), (1, 0, 3), (0, 1, 3)]
+    store = TriangleStore.from_dict({'a': [t1], 'b': [t2]})
+    store.areas(), store.bbox()
+    # same number of triangles: patched in place
+    points = store.points
+    store.update({'b': [t3]})
+    assert store.points is points
+    assert store.bbox() == ((0, 0, 0), (1, 1, 3))
+    store.update({'a': [t1, t2]})
+    store.add({'c': [t3]})
+    store.remove(['b'])
+    assert store.dirty == {'a', 'b', 'c'}
+    assert store.clean() == {'a', 'b', 'c'} and not store.dirty
+    assert store.ids == ['a', 'c']
+    assert store.groups() == ['a', 'a', 'c']
+    fresh = TriangleStore.from_dict({'a': [t1, t2], 'c': [t3]})
+    assert store.areas().tolist() == fresh.areas().tolist()
+    assert store.bbox() == fresh.bbox()
+    assert store.offsets.tolist() == [0, 2, 3]
+    assert_raises(KeyError, store.update, {'b': [t1]})
+    assert_raises(ValueError, store.add, {'a': [t1]})
+
+
+def test_indexed_mesh():
+    # a unit square, made of two triangles sharing two points
+    points = numpy.array([(0, 0, 0), (1, 0, 0), (1, 1, 0), (0, 1, 0)], dtype=float)
+    indices = numpy.array([(0, 1, 2), (0, 2, 3)])
+    store = TriangleStore.from_dict({'square': (points, indices), 't': [[(0, 0, 1), (1, 0, 1), (0, 1, 1)]]})
+    assert len(store) == 3
+    assert store.points.shape == (7, 3)
+    assert store.areas().tolist() == [0.5, 0.5, 0.5]
+    assert store.view()['square'][1] == [(0, 0, 0), (1, 1, 0), (0, 1, 0)]
+    mesh = store.mesh('square')
+    assert mesh.points.tolist() == points.tolist() and mesh.indices.tolist() == indices.tolist()
+    store.update({'square': IndexedMesh(points + 1, indices)})
+    assert store.bbox() == ((0, 0, 1), (2, 2, 1))
+    triangles = store.as_mesh()
+    assert numpy.asarray(triangles).shape == (3, 3, 3)
+    assert triangles[2].tolist() == [[0, 0, 1], [1, 0, 1], [0, 1, 1]]